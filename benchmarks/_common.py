@@ -0,0 +1,108 @@
+"""Result entries, comparison with a previous run and the JSON report shared by the benchmarks"""
+
+import argparse
+import json
+import platform
+import sys
+from datetime import UTC, datetime
+
+from tunsberg import __version__
+
+
+def result(name: str, count: int, seconds: float, unit: str = 'request', **params) -> dict:
+    """
+    Build a result entry with the throughput and time per unit of work.
+
+    :param name: Unique name of the scenario, used to match it with a previous run
+    :type name: str
+    :param count: Units of work done, e.g. requests or records
+    :type count: int
+    :param seconds: Elapsed seconds
+    :type seconds: float
+    :param unit: Name of a unit of work, defaults to 'request'
+    :type unit: str
+    :return: Name, params, count, seconds, units per second and microseconds per unit
+    :rtype: dict
+    """
+    return {
+        'name': name,
+        **params,
+        f'{unit}s': count,
+        'seconds': round(seconds, 6),
+        f'{unit}s_per_sec': round(count / seconds, 1) if seconds > 0 else None,
+        f'us_per_{unit}': round(seconds / count * 1e6, 3),
+    }
+
+
+def compare(results: list[dict], baseline: dict, metrics: tuple[tuple[str, str], ...]) -> str:
+    """
+    Render a table comparing results with a previous run.
+
+    :param results: Result entries of this run
+    :type results: list[dict]
+    :param baseline: Report of the previous run
+    :type baseline: dict
+    :param metrics: Key and column label of every metric shown, each followed by its change
+    :type metrics: tuple
+    :return: Table, one line per scenario
+    :rtype: str
+    """
+    previous = {entry['name']: entry for entry in baseline['results']}
+    width = max([len('scenario'), *(len(entry['name']) for entry in results)])
+    lines = [f'{"scenario":<{width}}' + ''.join(f' {label:>10} {"change":>8}' for _, label in metrics)]
+    for entry in results:
+        old = previous.get(entry['name'])
+        line = f'{entry["name"]:<{width}}'
+        for key, _ in metrics:
+            line += f' {entry[key]:>10.3f} {_change(entry[key], old.get(key) if old is not None else None)}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def _change(value: float, previous: float | None) -> str:
+    """Format the relative change from a previous value"""
+    if not previous:
+        return f'{"-":>8}'
+    return f'{(value - previous) / previous * 100:>+7.1f}%'
+
+
+def add_report_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the --output and --compare arguments"""
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='compare with results from a previous run')
+
+
+def report(benchmark: str, results: list[dict], args: argparse.Namespace, metrics: tuple[tuple[str, str], ...], **fields) -> dict:
+    """
+    Build the report of a run, write it to --output and print it, or the comparison with --compare.
+
+    :param benchmark: Name of the benchmark
+    :type benchmark: str
+    :param results: Result entries
+    :type results: list[dict]
+    :param args: Parsed arguments, see add_report_arguments()
+    :type args: argparse.Namespace
+    :param metrics: Metrics compared with --compare, see compare()
+    :type metrics: tuple
+    :param fields: More fields describing the run, added to the report before the results
+    :return: Report
+    :rtype: dict
+    """
+    run_report = {
+        'benchmark': benchmark,
+        'tunsberg': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now(UTC).isoformat(),
+        **fields,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run_report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            sys.stdout.write(compare(results, json.load(f), metrics) + '\n')
+    else:
+        sys.stdout.write(json.dumps(run_report, indent=2) + '\n')
+    return run_report
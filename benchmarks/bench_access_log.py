@@ -0,0 +1,95 @@
+"""
+Access log benchmarks for tunsberg.middleware.
+
+Measures the overhead of AccessLogMiddleware around a minimal ASGI app, with the access logger disabled and with every
+request logged to a handler that discards the records, so only creating and dispatching the record is timed. Exits
+with status 1 when the middleware adds more than --max-overhead-us to a logged request.
+
+    python -m benchmarks.bench_access_log --output access_log.json
+    python -m benchmarks.bench_access_log --compare access_log.json
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from benchmarks._common import add_report_arguments, report, result
+from tunsberg.middleware import ACCESS_LOGGER, AccessLogMiddleware
+
+METRICS = (('us_per_request', 'us/request'),)
+
+
+class DiscardHandler(logging.Handler):
+    """Accept records without writing them"""
+
+    def emit(self, record):
+        """Discard a record"""
+
+
+async def asgi_app(scope, receive, send):
+    """Respond with a small fixed body"""
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': b'{"key":"car"}'})
+
+
+async def noop_send(message):
+    """Discard a response message"""
+
+
+async def drive(app, requests: int) -> float:
+    """Call an ASGI app directly and return the elapsed seconds"""
+    scope = {'type': 'http', 'method': 'GET', 'path': '/vehicle-types', 'headers': [(b'x-request-id', b'bench-1234')]}
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(scope, None, noop_send)
+    return time.perf_counter() - start
+
+
+def run(requests: int, repeat: int) -> list[dict]:
+    """Run every scenario, keeping the fastest of the repeats"""
+    logger = logging.getLogger(ACCESS_LOGGER)
+    handler = DiscardHandler()
+    level, propagate = logger.level, logger.propagate
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        bare = min(asyncio.run(drive(asgi_app, requests)) for _ in range(repeat))
+        logger.setLevel(logging.WARNING)
+        disabled = min(asyncio.run(drive(AccessLogMiddleware(asgi_app), requests)) for _ in range(repeat))
+        logger.setLevel(logging.INFO)
+        logged = min(asyncio.run(drive(AccessLogMiddleware(asgi_app), requests)) for _ in range(repeat))
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = propagate
+
+    return [
+        result('middleware/bare', requests, bare),
+        result('middleware/disabled', requests, disabled),
+        result('middleware/logged', requests, logged),
+        result('overhead/disabled', requests, disabled - bare),
+        result('overhead/logged', requests, logged - bare),
+    ]
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the benchmarks from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100000, help='requests per scenario')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per scenario, the fastest is kept')
+    parser.add_argument('--max-overhead-us', type=float, default=10.0, help='fail when the middleware adds more to a logged request')
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = report('access_log', run(args.requests, args.repeat), args, METRICS)['results']
+
+    overhead = next(entry['us_per_request'] for entry in results if entry['name'] == 'overhead/logged')
+    if overhead > args.max_overhead_us:
+        sys.stderr.write(f'AccessLogMiddleware added {overhead:.3f}us to a logged request, the limit is {args.max_overhead_us}us\n')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Response envelope encoding benchmarks for tunsberg.encoding.
+
+Compares the size of an envelope and the time to encode and decode it as JSON, the way JSONResponse does it, and as
+MessagePack and CBOR, for records and for large numeric series. The MessagePack and CBOR results come from msgpack and
+cbor2 when they are installed, run with --pure to measure the built-in codecs instead.
+
+    python -m benchmarks.bench_encoding --output encoding.json
+    python -m benchmarks.bench_encoding --compare encoding.json
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks._common import add_report_arguments, report
+from tunsberg import encoding
+
+# Payload name: data of the envelope, built from the number of items
+PAYLOADS = {
+    'records': lambda items: {'items': [{'key': f'vehicle-{i}', 'name': f'Vehicle {i}', 'wheels': i % 8, 'active': i % 3 != 0} for i in range(items)]},
+    'floats': lambda items: {'values': [i * 0.37 for i in range(items)]},
+    'ints': lambda items: {'timestamps': [1_700_000_000 + 15 * i for i in range(items)]},
+}
+METRICS = (('encode_us', 'encode us'), ('decode_us', 'decode us'))
+
+
+def json_dumps(content: dict) -> bytes:
+    """Encode like starlette.responses.JSONResponse"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode()
+
+
+def codecs(pure: bool) -> dict:
+    """Get the encoder and decoder of every format"""
+    if pure:
+        return {
+            'json': (json_dumps, json.loads),
+            'msgpack': (encoding._pack_msgpack, encoding._unpack_msgpack),
+            'cbor': (encoding._pack_cbor, encoding._unpack_cbor),
+        }
+    return {
+        'json': (json_dumps, json.loads),
+        'msgpack': (encoding.encode_msgpack, encoding.decode_msgpack),
+        'cbor': (encoding.encode_cbor, encoding.decode_cbor),
+    }
+
+
+def best_of(function, argument, rounds: int, repeat: int) -> float:
+    """Fastest time in seconds of a single call"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            function(argument)
+        timings.append((time.perf_counter() - start) / rounds)
+    return min(timings)
+
+
+def run(item_counts: list[int], rounds: int, repeat: int, pure: bool) -> list[dict]:
+    """Run every combination of payload, size and format"""
+    results = []
+    for payload, build in PAYLOADS.items():
+        for items in item_counts:
+            content = {'status_code': 200, 'message': 'Resources was successfully retrieved', 'data': build(items)}
+            for name, (encode, decode) in codecs(pure).items():
+                body = encode(content)
+                results.append(
+                    {
+                        'name': f'{payload}/items={items}/{name}',
+                        'payload': payload,
+                        'items': items,
+                        'format': name,
+                        'bytes': len(body),
+                        'encode_us': round(best_of(encode, content, rounds, repeat) * 1e6, 3),
+                        'decode_us': round(best_of(decode, body, rounds, repeat) * 1e6, 3),
+                    }
+                )
+    return results
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the benchmarks from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, nargs='+', default=[100, 10000], help='items in every payload')
+    parser.add_argument('--rounds', type=int, default=50, help='calls per timing')
+    parser.add_argument('--repeat', type=int, default=5, help='timings per scenario, the fastest is kept')
+    parser.add_argument('--pure', action='store_true', help='measure the built-in codecs even when msgpack or cbor2 is installed')
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+
+    accelerated = {name: not args.pure and encoding._accelerator(name) is not None for name in ('msgpack', 'cbor2')}
+    report('encoding', run(args.items, args.rounds, args.repeat, args.pure), args, METRICS, accelerated=accelerated)
+
+
+if __name__ == '__main__':
+    main()
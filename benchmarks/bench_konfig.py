@@ -0,0 +1,139 @@
+"""
+Logging throughput benchmarks for tunsberg.konfig.
+
+Measures records/sec and microseconds per record for the default and JSON formatters, with and without exceptions,
+for every handler produced by log_config() and for single- and multi-threaded emitters.
+
+    python -m benchmarks.bench_konfig --output konfig.json
+    python -m benchmarks.bench_konfig --compare konfig.json
+"""
+
+import argparse
+import itertools
+import logging
+import logging.config
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks._common import add_report_arguments, report, result
+from tunsberg.konfig import JsonFormatter, log_config
+
+FORMATTERS = ('default', 'json')
+HANDLERS = ('file', 'rotating_file', 'time_rotating_file', 'console')
+LOGGER = 'tunsberg.benchmark'
+METRICS = (('us_per_record', 'us/record'),)
+
+
+def make_record(exception: bool) -> logging.LogRecord:
+    """Create a record like the ones logged by an application"""
+    exc_info = None
+    if exception:
+        try:
+            raise ValueError('benchmark failure')
+        except ValueError:
+            exc_info = sys.exc_info()
+    return logging.LogRecord(LOGGER, logging.ERROR if exception else logging.INFO, __file__, 1, 'request %s took %sms', ('abc', 12), exc_info)
+
+
+def bench_formatter(formatter_name: str, exception: bool, records: int) -> float:
+    """Time formatting only, without any I/O, and return the elapsed seconds"""
+    if formatter_name == 'json':
+        formatter = JsonFormatter()
+    else:
+        default = log_config()['formatters']['default']
+        formatter = logging.Formatter(default['format'], default['datefmt'])
+    record = make_record(exception)
+
+    start = time.perf_counter()
+    for _ in range(records):
+        # The default formatter caches the traceback on the record, clear it like a fresh record would be
+        record.exc_text = None
+        formatter.format(record)
+    return time.perf_counter() - start
+
+
+def emit(logger: logging.Logger, exception: bool, records: int) -> None:
+    """Log records the way application code does"""
+    if exception:
+        for i in range(records):
+            try:
+                raise ValueError('benchmark failure')
+            except ValueError:
+                logger.exception('request %s failed', i)
+    else:
+        for i in range(records):
+            logger.info('request %s took %sms', i, 12)
+
+
+def bench_handler(directory: str, handler: str, formatter_name: str, exception: bool, threads: int, records: int) -> float:  # noqa: PLR0913, PLR0917
+    """Time logging through a handler configured by log_config() and return the elapsed seconds"""
+    config = log_config(
+        log_level=logging.INFO,
+        log_file_path=os.path.join(directory, f'{handler}-{formatter_name}-{exception}-{threads}.log'),
+        log_handlers=[handler],
+        log_formatter=formatter_name,
+    )
+    logging.config.dictConfig(config)
+    logger = logging.getLogger(LOGGER)
+    devnull = open(os.devnull, 'w')  # noqa: SIM115
+    for configured in logging.getLogger('tunsberg').handlers:
+        if type(configured) is logging.StreamHandler:
+            configured.setStream(devnull)
+
+    per_thread = records // threads
+    workers = [threading.Thread(target=emit, args=(logger, exception, per_thread)) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False})
+    devnull.close()
+    return elapsed
+
+
+def run(records: int, repeat: int, thread_counts: list[int]) -> list[dict]:
+    """Run every scenario, keeping the fastest of the repeats"""
+    results = []
+    for formatter_name, exception in itertools.product(FORMATTERS, (False, True)):
+        seconds = min(bench_formatter(formatter_name, exception, records) for _ in range(repeat))
+        results.append(result(f'format/{formatter_name}/exc={exception}', records, seconds, 'record', formatter=formatter_name, exception=exception))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for handler, formatter_name, exception, threads in itertools.product(HANDLERS, FORMATTERS, (False, True), thread_counts):
+            total = records // threads * threads
+            seconds = min(bench_handler(directory, handler, formatter_name, exception, threads, total) for _ in range(repeat))
+            results.append(
+                result(
+                    f'handler/{handler}/{formatter_name}/exc={exception}/threads={threads}',
+                    total,
+                    seconds,
+                    'record',
+                    handler=handler,
+                    formatter=formatter_name,
+                    exception=exception,
+                    threads=threads,
+                )
+            )
+    return results
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the benchmarks from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000, help='records per scenario')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario, the fastest is kept')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4], help='emitter thread counts')
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+
+    report('konfig', run(args.records, args.repeat, args.threads), args, METRICS)
+
+
+if __name__ == '__main__':
+    main()
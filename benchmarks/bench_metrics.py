@@ -0,0 +1,112 @@
+"""
+Request metrics benchmarks for tunsberg.metrics.
+
+Measures the time MetricsRegistry.observe() adds to a request, in anonymous memory and in a shared directory, and the
+overhead of MetricsMiddleware around a minimal ASGI app. Exits with status 1 when recording takes longer than
+--max-observe-us, or the middleware adds more than --max-overhead-ratio times the cost of recording in anonymous memory
+measured in the same run, or more than --max-overhead-us when given. The ratio holds on slower and faster machines
+alike, the absolute limit is meant for machines with known timings.
+
+    python -m benchmarks.bench_metrics --output metrics.json
+    python -m benchmarks.bench_metrics --compare metrics.json
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+
+from benchmarks._common import add_report_arguments, report, result
+from tunsberg.metrics import MetricsMiddleware, MetricsRegistry
+
+ROUTES = ('/vehicle-types', '/vehicle-types/{key}', '/parking-areas', '/parking-areas/{key}')
+# Durations spread over the histogram so every branch of the bucket lookup is taken
+DURATIONS_NS = (8_000, 120_000, 2_500_000, 40_000_000)
+METRICS = (('us_per_request', 'us/request'),)
+
+
+def bench_observe(registry: MetricsRegistry, requests: int) -> float:
+    """Time recording requests to known series and return the elapsed seconds"""
+    observe = registry.observe
+    calls = [(route, duration) for route in ROUTES for duration in DURATIONS_NS]
+    for route, duration in calls:
+        observe('GET', route, 200, 512, duration)
+
+    rounds = requests // len(calls)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for route, duration in calls:
+            observe('GET', route, 200, 512, duration)
+    return (time.perf_counter() - start) * requests / (rounds * len(calls))
+
+
+async def asgi_app(scope, receive, send):
+    """Respond with a small fixed body"""
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': b'{"key":"car"}'})
+
+
+async def noop_send(message):
+    """Discard a response message"""
+
+
+async def drive(app, requests: int) -> float:
+    """Call an ASGI app directly and return the elapsed seconds"""
+    scope = {'type': 'http', 'method': 'GET', 'path': '/vehicle-types', 'headers': []}
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(scope, None, noop_send)
+    return time.perf_counter() - start
+
+
+def run(requests: int, repeat: int) -> list[dict]:
+    """Run every scenario, keeping the fastest of the repeats"""
+    results = []
+    seconds = min(bench_observe(MetricsRegistry(), requests) for _ in range(repeat))
+    results.append(result('observe/memory', requests, seconds, storage='memory'))
+    with tempfile.TemporaryDirectory() as directory:
+        seconds = min(bench_observe(MetricsRegistry(directory), requests) for _ in range(repeat))
+    results.append(result('observe/directory', requests, seconds, storage='directory'))
+
+    bare = min(asyncio.run(drive(asgi_app, requests)) for _ in range(repeat))
+    wrapped = min(asyncio.run(drive(MetricsMiddleware(asgi_app, metrics_path=None), requests)) for _ in range(repeat))
+    results.append(result('middleware/bare', requests, bare))
+    results.append(result('middleware/metrics', requests, wrapped))
+    results.append(result('middleware/overhead', requests, wrapped - bare))
+    return results
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the benchmarks from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200000, help='requests per scenario')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per scenario, the fastest is kept')
+    parser.add_argument('--max-observe-us', type=float, default=1.0, help='fail when recording a request takes longer')
+    parser.add_argument('--max-overhead-ratio', type=float, default=4.0, help='fail when the middleware adds more than this many times recording')
+    parser.add_argument('--max-overhead-us', type=float, default=None, help='fail when the middleware adds more to a request')
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = report('metrics', run(args.requests, args.repeat), args, METRICS)['results']
+
+    failures = []
+    slowest = max(entry['us_per_request'] for entry in results if entry['name'].startswith('observe/'))
+    if slowest > args.max_observe_us:
+        failures.append(f'Recording a request took {slowest:.3f}us, the limit is {args.max_observe_us}us\n')
+    overhead = next(entry['us_per_request'] for entry in results if entry['name'] == 'middleware/overhead')
+    observe = next(entry['us_per_request'] for entry in results if entry['name'] == 'observe/memory')
+    if overhead > args.max_overhead_ratio * observe:
+        failures.append(
+            f'MetricsMiddleware added {overhead:.3f}us to a request, {overhead / observe:.1f} times the {observe:.3f}us of recording it, '
+            f'the limit is {args.max_overhead_ratio} times\n'
+        )
+    if args.max_overhead_us is not None and overhead > args.max_overhead_us:
+        failures.append(f'MetricsMiddleware added {overhead:.3f}us to a request, the limit is {args.max_overhead_us}us\n')
+    if failures:
+        sys.stderr.write(''.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+End-to-end load test for a FastAPI app built with tunsberg.
+
+Builds a sample app that answers with response_success, response_pagination, response_created and the error helpers,
+logs through log_config(), and drives it in-process over ASGI with a number of concurrent clients. Every scenario
+reports throughput, p50/p99/max latency and the peak memory allocated while it ran. Use it as the reference for any
+change that may affect performance:
+
+    python -m benchmarks.loadtest --output before.json
+    python -m benchmarks.loadtest --compare before.json
+    python -m benchmarks.loadtest --scenarios list pagination --items 10 1000 --concurrency 1 64 --middleware all
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import logging.config
+import math
+import os
+import tempfile
+import time
+import tracemalloc
+
+from fastapi import FastAPI, Request
+from fastapi_pagination import Page
+
+from benchmarks._common import add_report_arguments, report, result
+from tunsberg.konfig import log_config
+from tunsberg.metrics import MetricsMiddleware, MetricsRegistry
+from tunsberg.middleware import AccessLogMiddleware
+from tunsberg.responses import (
+    response_bad_request,
+    response_created,
+    response_not_found,
+    response_pagination,
+    response_success,
+)
+
+# Scenario name: method, path with {items} filled in, request body
+SCENARIOS = {
+    'item': ('GET', '/vehicle-types/car', None),
+    'list': ('GET', '/vehicle-types?items={items}', None),
+    'pagination': ('GET', '/parking-areas?items={items}', None),
+    'create': ('POST', '/vehicle-types', {'key': 'bus', 'name': 'Bus', 'wheels': 6, 'tags': ['public', 'large']}),
+    'not_found': ('GET', '/vehicle-types/boat', None),
+    'bad_request': ('GET', '/vehicle-types?items=-1', None),
+}
+MIDDLEWARE = ('none', 'access', 'metrics', 'all')
+METRICS = (('requests_per_sec', 'req/s'), ('p99_ms', 'p99 ms'))
+
+
+def make_item(index: int) -> dict:
+    """Build a record like the ones returned by an API"""
+    return {'key': f'vehicle-{index}', 'name': f'Vehicle {index}', 'wheels': index % 8, 'active': index % 3 != 0, 'price': index * 1.5}
+
+
+def build_app(middleware: str = 'none') -> FastAPI:
+    """
+    Build the sample app.
+
+    :param middleware: Middleware to add, one of 'none', 'access', 'metrics' and 'all'
+    :type middleware: str
+    :return: FastAPI app
+    :rtype: FastAPI
+    """
+    app = FastAPI()
+    logger = logging.getLogger('tunsberg.loadtest')
+    catalogue = {'car': make_item(4), 'motorcycle': make_item(2)}
+
+    @app.get('/vehicle-types/{key}')
+    async def get_vehicle_type(key: str):
+        vehicle_type = catalogue.get(key)
+        if vehicle_type is None:
+            logger.info('Vehicle type %s not found', key)
+            return response_not_found('Vehicle type not found')
+        return response_success(message='Vehicle type retrieved successfully.', data=vehicle_type)
+
+    @app.get('/vehicle-types')
+    async def list_vehicle_types(items: int = 10):
+        if items < 0:
+            return response_bad_request(message='Invalid number of items', data={'field': 'items', 'value': items})
+        return response_success(message='Vehicle types retrieved successfully.', data={'items': [make_item(i) for i in range(items)]})
+
+    @app.get('/parking-areas')
+    async def list_parking_areas(items: int = 10):
+        page = Page(items=[make_item(i) for i in range(items)], total=items * 5, page=1, size=items, pages=5)
+        return response_pagination(message='Parking areas successfully fetched', data={'items': page.items}, pagination=page)
+
+    @app.post('/vehicle-types')
+    async def create_vehicle_type(request: Request):
+        payload = await request.json()
+        logger.info('Created vehicle type %s', payload['key'])
+        return response_created(message='Vehicle type created successfully.', data=payload)
+
+    if middleware in {'metrics', 'all'}:
+        app.add_middleware(MetricsMiddleware, registry=MetricsRegistry())
+    if middleware in {'access', 'all'}:
+        app.add_middleware(AccessLogMiddleware)
+    return app
+
+
+def make_request(method: str, target: str, body: dict | None) -> tuple[dict, bytes]:
+    """Build the ASGI scope and body of a request"""
+    path, _, query = target.partition('?')
+    content = json.dumps(body).encode() if body is not None else b''
+    headers = [(b'host', b'loadtest'), (b'user-agent', b'tunsberg-loadtest')]
+    if body is not None:
+        headers += [(b'content-type', b'application/json'), (b'content-length', str(len(content)).encode())]
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0', 'spec_version': '2.3'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': headers,
+        'client': ('127.0.0.1', 50000),
+        'server': ('loadtest', 80),
+    }
+    return scope, content
+
+
+async def call(app, scope: dict, content: bytes) -> tuple[int, int]:
+    """Send one request to the app and return the status and the size of the response body"""
+    response = [0, 0]
+
+    async def receive():
+        return {'type': 'http.request', 'body': content, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response[0] = message['status']
+        elif message['type'] == 'http.response.body':
+            response[1] += len(message.get('body', b''))
+
+    # Every request gets its own scope, the app and middleware add keys to it
+    await app(dict(scope), receive, send)
+    return response[0], response[1]
+
+
+async def drive(app, scope: dict, content: bytes, requests: int, concurrency: int) -> tuple[float, list[int], int]:
+    """Send requests from concurrent clients and return the elapsed seconds, latencies in nanoseconds and bytes"""
+    latencies = []
+    received = [0]
+    remaining = iter(range(requests))
+
+    async def client():
+        for _ in remaining:
+            start = time.perf_counter_ns()
+            _, nbytes = await call(app, scope, content)
+            latencies.append(time.perf_counter_ns() - start)
+            received[0] += nbytes
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, received[0]
+
+
+def percentile(values: list[int], fraction: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def run_scenario(scenario: str, items: int, concurrency: int, middleware: str, requests: int, memory_requests: int) -> dict:  # noqa: PLR0913, PLR0917
+    """Run a scenario and return its result entry"""
+    method, target, body = SCENARIOS[scenario]
+    scope, content = make_request(method, target.format(items=items), body)
+    app = build_app(middleware)
+
+    async def scenario_run():
+        # Warm up routing, validation and serialization caches before measuring
+        status, _ = await call(app, scope, content)
+        await drive(app, scope, content, min(requests, 200), concurrency)
+        gc.collect()
+        seconds, latencies, received = await drive(app, scope, content, requests, concurrency)
+
+        # Memory is measured in a separate, shorter run, tracing allocations slows everything down
+        tracemalloc.start()
+        await drive(app, scope, content, memory_requests, concurrency)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return status, seconds, latencies, received, peak
+
+    status, seconds, latencies, received, peak = asyncio.run(scenario_run())
+    latencies.sort()
+    return {
+        **result(
+            f'{scenario}/items={items}/concurrency={concurrency}/middleware={middleware}',
+            requests,
+            seconds,
+            scenario=scenario,
+            items=items,
+            concurrency=concurrency,
+            middleware=middleware,
+            status=status,
+        ),
+        'p50_ms': round(percentile(latencies, 0.50) / 1e6, 3),
+        'p99_ms': round(percentile(latencies, 0.99) / 1e6, 3),
+        'max_ms': round(latencies[-1] / 1e6, 3),
+        'bytes_per_response': received // requests,
+        'peak_memory_kib': round(peak / 1024, 1),
+    }
+
+
+def run(scenarios: list[str], item_counts: list[int], concurrencies: list[int], middleware: list[str], requests: int, memory_requests: int) -> list[dict]:  # noqa: PLR0913, PLR0917
+    """Run every combination of scenario, payload size, concurrency and middleware"""
+    results = []
+    for scenario, concurrency, middleware_name in itertools.product(scenarios, concurrencies, middleware):
+        # Only the list and pagination scenarios depend on the payload size
+        sizes = item_counts if '{items}' in SCENARIOS[scenario][1] else item_counts[:1]
+        results.extend(run_scenario(scenario, items, concurrency, middleware_name, requests, memory_requests) for items in sizes)
+    return results
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the load test from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS), help='scenarios to run')
+    parser.add_argument('--items', type=int, nargs='+', default=[10, 100], help='items in list and pagination responses')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 32], help='concurrent clients')
+    parser.add_argument('--middleware', nargs='+', choices=MIDDLEWARE, default=['none', 'all'], help='middleware to add')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--memory-requests', type=int, default=200, help='requests per scenario while tracing memory')
+    parser.add_argument('--log-formatter', choices=('default', 'json'), default='json', help='formatter passed to log_config()')
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = log_config(
+            log_level=logging.INFO,
+            log_file_path=os.path.join(directory, 'loadtest.log'),
+            log_handlers=['file'],
+            log_formatter=args.log_formatter,
+            access_log='tunsberg',
+        )
+        # Writing to the terminal would dominate the timings, send records of other libraries to the file as well
+        config['root'] = {'handlers': ['file'], 'level': 'WARNING'}
+        logging.config.dictConfig(config)
+        try:
+            results = run(args.scenarios, args.items, args.concurrency, args.middleware, args.requests, args.memory_requests)
+        finally:
+            logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False})
+
+    report('loadtest', results, args, METRICS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import logging
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self):
+        """Keep every handled record in memory"""
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_scope(path='/items', headers=None, method='GET'):
+    """Build a minimal HTTP scope"""
+    return {'type': 'http', 'method': method, 'path': path, 'headers': headers or []}
+
+
+async def run_app(app, scope, body=b''):
+    """Call an ASGI app with a request body and return the messages it sent"""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
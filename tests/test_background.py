@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import threading
+
+import pytest
+from fastapi import BackgroundTasks
+from starlette.background import BackgroundTask
+
+from tests.helpers import CollectingHandler, make_scope, run_app
+from tunsberg import background
+from tunsberg.background import (
+    BACKGROUND_LOGGER,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_INLINE,
+    BackgroundExecutor,
+    DeferredTasks,
+    get_default_executor,
+    set_default_executor,
+)
+from tunsberg.metrics import MetricsMiddleware, MetricsRegistry
+from tunsberg.responses import response_success
+
+TASKS = 20
+
+
+def write_pid(path):
+    """Write the ID of the process running the task"""
+    with open(path, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+class TestBackgroundExecutor:
+    def setup_method(self):
+        self.collector = CollectingHandler()
+        self.logger = logging.getLogger(BACKGROUND_LOGGER)
+        self.logger.addHandler(self.collector)
+        self.executors = []
+        self.release = threading.Event()
+
+    def teardown_method(self):
+        self.release.set()
+        self.logger.removeHandler(self.collector)
+        for executor in self.executors:
+            executor.shutdown()
+
+    def make_executor(self, **kwargs):
+        executor = BackgroundExecutor(**kwargs)
+        self.executors.append(executor)
+        return executor
+
+    def block_workers(self, executor):
+        """Keep every worker of an executor busy until self.release is set"""
+        started = threading.Barrier(executor.max_workers + 1)
+
+        def blocker():
+            started.wait()
+            self.release.wait()
+
+        for _ in range(executor.max_workers):
+            executor.submit(blocker)
+        started.wait()
+
+    def test_runs_functions_and_coroutine_functions(self):
+        executor = self.make_executor(max_workers=2)
+        results = []
+
+        async def append_async(value):
+            await asyncio.sleep(0)
+            results.append(value)
+
+        for i in range(TASKS):
+            assert executor.submit(results.append, i)
+            assert executor.submit(append_async, value=-i - 1)
+        executor.shutdown()
+
+        assert sorted(results) == list(range(-TASKS, TASKS))
+        stats = executor.stats()
+        assert stats['submitted'] == stats['completed'] == 2 * TASKS
+        assert stats['queued'] == stats['running'] == stats['failed'] == stats['dropped'] == 0
+        assert all(not thread.is_alive() for thread in executor._threads)
+
+    def test_drop_when_full(self):
+        executor = self.make_executor(max_workers=1, max_queue=2)
+        self.block_workers(executor)
+        results = []
+        queued = [executor.submit(results.append, i) for i in range(5)]
+        assert queued == [True, True, False, False, False]
+        assert executor.stats()['queued'] == 2  # noqa: PLR2004
+        assert executor.stats()['dropped'] == 3  # noqa: PLR2004
+
+        self.release.set()
+        executor.shutdown()
+        assert results == [0, 1]
+        # The overflow is logged once, not for every dropped task
+        assert [record.levelno for record in self.collector.records] == [logging.WARNING]
+
+    def test_drop_oldest_when_full(self):
+        executor = self.make_executor(max_workers=1, max_queue=2, overflow=OVERFLOW_DROP_OLDEST)
+        self.block_workers(executor)
+        results = []
+        assert all(executor.submit(results.append, i) for i in range(5))
+
+        self.release.set()
+        executor.shutdown()
+        assert results == [3, 4]
+        assert executor.stats()['dropped'] == 3  # noqa: PLR2004
+
+    def test_inline_when_full(self):
+        executor = self.make_executor(max_workers=1, max_queue=1, overflow=OVERFLOW_INLINE)
+        self.block_workers(executor)
+        results = []
+        tasks = BackgroundTasks()
+        tasks.add_task(results.append, 'queued')
+        tasks.add_task(results.append, 'inline')
+        asyncio.run(executor.defer(tasks)())
+
+        assert results == ['inline']
+        assert executor.stats()['inline'] == 1
+        self.release.set()
+        executor.shutdown()
+        assert results == ['inline', 'queued']
+
+    def test_failed_task_is_logged(self):
+        executor = self.make_executor()
+
+        def fail():
+            raise RuntimeError('boom')
+
+        executor.submit(fail)
+        executor.shutdown()
+
+        assert executor.stats()['failed'] == 1
+        record = self.collector.records[0]
+        assert record.levelno == logging.ERROR
+        assert record.exc_info[0] is RuntimeError
+        assert record.extra_fields['task'].endswith('fail')
+        assert record.extra_fields['backend'] == 'thread'
+
+    def test_process_backend(self, tmp_path):
+        executor = self.make_executor(backend='process', max_workers=1)
+        path = tmp_path / 'pid'
+        executor.submit(write_pid, str(path))
+        executor.shutdown()
+        assert executor.stats()['completed'] == 1
+        assert int(path.read_text()) != os.getpid()
+
+    def test_shutdown_without_waiting_drops_queued_tasks(self):
+        executor = self.make_executor(max_workers=1)
+        self.block_workers(executor)
+        results = []
+        executor.submit(results.append, 1)
+        self.release.set()
+        executor.shutdown(wait=False)
+        assert executor.stats()['dropped'] + len(results) == 1
+        with pytest.raises(RuntimeError, match='shut down'):
+            executor.submit(results.append, 2)
+
+    def test_render_prometheus_text(self):
+        executor = self.make_executor(max_queue=10)
+        executor.submit(int)
+        executor.shutdown()
+        text = executor.render(prefix='app_background').decode()
+        assert '# TYPE app_background_queued gauge\napp_background_queued 0\n' in text
+        assert 'app_background_queue_capacity 10\n' in text
+        assert '# TYPE app_background_tasks_dropped_total counter\napp_background_tasks_dropped_total 0\n' in text
+        assert 'app_background_tasks_completed_total 1\n' in text
+
+    def test_served_with_request_metrics(self):
+        executor = self.make_executor()
+        app = MetricsMiddleware(None, registry=MetricsRegistry(), collectors=(executor,))
+        body = []
+
+        async def send(message):
+            body.append(message.get('body', b''))
+
+        asyncio.run(app.serve(send))
+        assert b'tunsberg_background_queued 0' in b''.join(body)
+
+    def test_reset_after_fork(self):
+        executor = self.make_executor()
+        executor.submit(int)
+        executor.shutdown()
+        background._reset_after_fork()
+        assert executor.stats()['submitted'] == 0
+        assert executor._threads == []
+
+    @pytest.mark.parametrize('kwargs', [{'backend': 'fiber'}, {'overflow': 'block'}, {'max_workers': 0}, {'max_queue': 0}])
+    def test_invalid_arguments(self, kwargs):
+        with pytest.raises(ValueError, match='must be'):
+            BackgroundExecutor(**kwargs)
+
+
+class TestDeferredTasks:
+    def setup_method(self):
+        self.executor = BackgroundExecutor()
+
+    def teardown_method(self):
+        set_default_executor(None)
+        self.executor.shutdown()
+
+    def test_response_helpers_use_default_executor(self):
+        results = []
+        set_default_executor(self.executor)
+        assert get_default_executor() is self.executor
+
+        tasks = BackgroundTasks()
+        tasks.add_task(results.append, 'sent')
+        response = response_success(data={'key': 'value'}, background_tasks=tasks)
+        assert isinstance(response.background, DeferredTasks)
+
+        asyncio.run(run_app(response, make_scope('/')))
+        self.executor.shutdown()
+        assert results == ['sent']
+
+    def test_response_helpers_without_default_executor(self):
+        tasks = BackgroundTasks()
+        assert response_success(background_tasks=tasks).background is tasks
+
+    def test_already_deferred_tasks_are_kept(self):
+        set_default_executor(self.executor)
+        deferred = BackgroundExecutor().defer(BackgroundTasks())
+        assert response_success(background_tasks=deferred).background is deferred
+
+    def test_single_task_and_plain_callable(self):
+        results = []
+
+        async def plain():
+            results.append('plain')
+
+        asyncio.run(self.executor.defer(BackgroundTask(results.append, 'task'))())
+        asyncio.run(self.executor.defer(plain)())
+        self.executor.shutdown()
+        assert sorted(results) == ['plain', 'task']
+
+    def test_empty_tasks(self):
+        asyncio.run(self.executor.defer(BackgroundTasks())())
+        assert self.executor.stats()['submitted'] == 0
@@ -0,0 +1,330 @@
+import asyncio
+import json
+import math
+import sys
+import types
+
+import pytest
+from starlette import status
+
+from tests.helpers import make_scope, run_app
+from tunsberg import encoding
+from tunsberg.encoding import (
+    CBOR_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    ContentNegotiationMiddleware,
+    decode_cbor,
+    decode_msgpack,
+    encode_cbor,
+    encode_msgpack,
+    negotiate,
+    response_media_type,
+)
+from tunsberg.responses import response_no_content, response_pagination, response_success
+
+# Values covering every type and length class of both formats
+VALUES = [
+    None,
+    True,
+    False,
+    0,
+    1,
+    -1,
+    -32,
+    -33,
+    127,
+    128,
+    255,
+    256,
+    65535,
+    65536,
+    2**32,
+    2**64 - 1,
+    -(2**63),
+    -129,
+    -40000,
+    -(2**31) - 1,
+    1.5,
+    -0.0,
+    math.inf,
+    '',
+    'a',
+    'æøå',
+    'x' * 31,
+    'x' * 32,
+    'x' * 256,
+    'x' * 65536,
+    b'',
+    b'\x00\x01',
+    b'x' * 256,
+    b'x' * 65536,
+    [],
+    [1, 'two', 3.0, None],
+    list(range(16)),
+    list(range(70000)),
+    {},
+    {'a': 1, 'b': [True, False]},
+    {str(i): i for i in range(16)},
+    {1: 'one', 'nested': {'list': [{'x': 1}]}},
+    # Lists of numbers of one type take the bulk path
+    [0.25 * i for i in range(10)],
+    list(range(-32, 100)),
+    list(range(100, 300)),
+    list(range(-200, 100)),
+    [2**16 + i for i in range(10)],
+    [2**40 + i for i in range(10)],
+    [-(2**15) - i for i in range(10)],
+    [-(2**40) - i for i in range(10)],
+    [-1 - i for i in range(20)],
+    [-(2**63)] * 10,
+    [2**64 - 1] * 10,
+    [-5, 5] * 10,
+    [True] * 10,
+]
+
+PAYLOAD = {
+    'status_code': 200,
+    'message': 'Series retrieved successfully.',
+    'data': {'timestamps': list(range(1_700_000_000, 1_700_000_100)), 'values': [i / 7 for i in range(100)]},
+}
+
+
+@pytest.fixture
+def pure(monkeypatch):
+    """Make the public functions use the built-in codecs even when msgpack or cbor2 is installed"""
+    monkeypatch.setitem(sys.modules, 'msgpack', None)
+    monkeypatch.setitem(sys.modules, 'cbor2', None)
+    encoding._accelerator.cache_clear()
+    yield
+    encoding._accelerator.cache_clear()
+
+
+def envelope_app(helper):
+    """ASGI app answering with a response helper"""
+
+    async def app(scope, receive, send):
+        await helper()(scope, receive, send)
+
+    return app
+
+
+class TestMsgpack:
+    @pytest.mark.parametrize('value', VALUES, ids=range(len(VALUES)))
+    def test_round_trip(self, value, pure):
+        assert decode_msgpack(encode_msgpack(value)) == value
+
+    @pytest.mark.parametrize(
+        ('value', 'expected'),
+        [
+            (None, 'c0'),
+            (True, 'c3'),
+            (-1, 'ff'),
+            (200, 'ccc8'),
+            (-200, 'd1ff38'),
+            (1.0, 'cb3ff0000000000000'),
+            ('a', 'a161'),
+            (b'a', 'c40161'),
+            ([1, 2], '920102'),
+            ({'a': 1}, '81a16101'),
+            (list(range(8)), '980001020304050607'),
+            ([300] * 8, '98' + 'cd012c' * 8),
+        ],
+    )
+    def test_encoding(self, value, expected):
+        assert encoding._pack_msgpack(value).hex() == expected
+
+    def test_tuple_and_subclasses(self):
+        assert decode_msgpack(encode_msgpack((1, status.HTTP_200_OK))) == [1, 200]
+        assert encoding._pack_msgpack(status.HTTP_200_OK) == encoding._pack_msgpack(200)
+
+    def test_decodes_float32(self):
+        assert encoding._unpack_msgpack(bytes.fromhex('ca3fc00000')) == 1.5  # noqa: PLR2004
+
+    def test_decodes_bulk_floats32(self):
+        assert encoding._unpack_msgpack(bytes.fromhex('98' + 'ca3fc00000' * 8)) == [1.5] * 8
+
+    @pytest.mark.parametrize('value', [2**64, -(2**63) - 1])
+    def test_integer_out_of_range(self, value):
+        with pytest.raises(OverflowError):
+            encoding._pack_msgpack(value)
+        with pytest.raises(OverflowError):
+            encoding._pack_msgpack([value] * 10)
+
+    def test_unsupported_type(self):
+        with pytest.raises(TypeError, match='set'):
+            encoding._pack_msgpack({1, 2})
+
+    @pytest.mark.parametrize(('data', 'message'), [('92 01', 'Truncated'), ('a3 61', 'Truncated'), ('01 02', 'Extra'), ('c1', 'Unsupported')])
+    def test_invalid_data(self, data, message):
+        with pytest.raises(ValueError, match=message):
+            encoding._unpack_msgpack(bytes.fromhex(data))
+
+
+class TestCbor:
+    @pytest.mark.parametrize('value', VALUES, ids=range(len(VALUES)))
+    def test_round_trip(self, value, pure):
+        assert decode_cbor(encode_cbor(value)) == value
+
+    @pytest.mark.parametrize('value', [2**64, -(2**64) - 1, 2**100, [-(2**70)] * 10])
+    def test_bignums(self, value, pure):
+        assert decode_cbor(encode_cbor(value)) == value
+
+    @pytest.mark.parametrize(
+        ('value', 'expected'),
+        # Examples from RFC 8949, appendix A
+        [
+            (0, '00'),
+            (23, '17'),
+            (24, '1818'),
+            (1000, '1903e8'),
+            (1000000, '1a000f4240'),
+            (1000000000000, '1b000000e8d4a51000'),
+            (18446744073709551616, 'c249010000000000000000'),
+            (-18446744073709551617, 'c349010000000000000000'),
+            (-1, '20'),
+            (-1000, '3903e7'),
+            (1.1, 'fb3ff199999999999a'),
+            (False, 'f4'),
+            (None, 'f6'),
+            (b'\x01\x02\x03\x04', '4401020304'),
+            ('IETF', '6449455446'),
+            ('ü', '62c3bc'),
+            ([1, [2, 3], [4, 5]], '8301820203820405'),
+            ({'a': 1, 'b': [2, 3]}, 'a26161016162820203'),
+        ],
+    )
+    def test_encoding(self, value, expected):
+        assert encoding._pack_cbor(value).hex() == expected
+
+    def test_bulk_lists_use_one_width(self):
+        assert encoding._pack_cbor(list(range(20, 28))).hex() == '88' + ''.join(f'18{i:02x}' for i in range(20, 28))
+        assert encoding._pack_cbor([-1] * 8).hex() == '88' + '20' * 8
+
+    @pytest.mark.parametrize(
+        ('data', 'expected'),
+        [
+            ('f93c00', 1.0),
+            ('fa47c35000', 100000.0),
+            ('f5', True),
+            ('f7', None),
+            ('c074323031332d30332d32315432303a30343a30305a', '2013-03-21T20:04:00Z'),
+            ('5f42010243030405ff', b'\x01\x02\x03\x04\x05'),
+            ('7f657374726561646d696e67ff', 'streaming'),
+            ('9f018202039f0405ffff', [1, [2, 3], [4, 5]]),
+            ('bf61610161629f0203ffff', {'a': 1, 'b': [2, 3]}),
+            ('88' + 'f93c00' * 8, [1.0] * 8),
+            ('88' + '3818' * 8, [-25] * 8),
+        ],
+    )
+    def test_decoding(self, data, expected):
+        assert encoding._unpack_cbor(bytes.fromhex(data)) == expected
+
+    def test_unsupported_type(self):
+        with pytest.raises(TypeError, match='set'):
+            encoding._pack_cbor({1, 2})
+
+    @pytest.mark.parametrize(
+        ('data', 'message'),
+        [('8201', 'Truncated'), ('6361', 'Truncated'), ('0102', 'Extra'), ('ff', 'break'), ('f8ff', 'simple'), ('1c', 'initial byte')],
+    )
+    def test_invalid_data(self, data, message):
+        with pytest.raises(ValueError, match=message):
+            encoding._unpack_cbor(bytes.fromhex(data))
+
+
+class TestAccelerator:
+    def test_uses_installed_packages(self, monkeypatch):
+        calls = []
+        msgpack = types.SimpleNamespace(packb=lambda value: calls.append('packb') or b'm', unpackb=lambda data, strict_map_key: calls.append('unpackb'))
+        cbor2 = types.SimpleNamespace(dumps=lambda value: calls.append('dumps') or b'c', loads=lambda data: calls.append('loads'))
+        monkeypatch.setitem(sys.modules, 'msgpack', msgpack)
+        monkeypatch.setitem(sys.modules, 'cbor2', cbor2)
+        encoding._accelerator.cache_clear()
+        try:
+            assert encode_msgpack({}) == b'm'
+            assert encode_cbor({}) == b'c'
+            decode_msgpack(b'')
+            decode_cbor(b'')
+        finally:
+            encoding._accelerator.cache_clear()
+        assert calls == ['packb', 'dumps', 'unpackb', 'loads']
+
+    def test_missing_package(self, pure):
+        assert encoding._accelerator('msgpack') is None
+
+
+class TestNegotiate:
+    @pytest.mark.parametrize(
+        ('accept', 'expected'),
+        [
+            ('application/msgpack', MSGPACK_MEDIA_TYPE),
+            ('application/x-msgpack', 'application/x-msgpack'),
+            ('Application/CBOR', CBOR_MEDIA_TYPE),
+            ('application/json', None),
+            ('*/*', None),
+            ('text/html', None),
+            ('application/json, application/msgpack', None),
+            ('application/msgpack, application/json', MSGPACK_MEDIA_TYPE),
+            ('application/json;q=0.5, application/cbor', CBOR_MEDIA_TYPE),
+            ('application/cbor;q=0.2, */*;q=0.8', None),
+            ('application/msgpack;q=0', None),
+            ('application/msgpack;q=abc', None),
+            ('application/msgpack; charset=utf-8', MSGPACK_MEDIA_TYPE),
+        ],
+    )
+    def test_negotiate(self, accept, expected):
+        assert negotiate(accept) == expected
+
+
+class TestContentNegotiationMiddleware:
+    @pytest.mark.parametrize(('media_type', 'decode'), [(MSGPACK_MEDIA_TYPE, decode_msgpack), (CBOR_MEDIA_TYPE, decode_cbor)])
+    def test_binary_envelope(self, media_type, decode):
+        app = ContentNegotiationMiddleware(envelope_app(lambda: response_success(message=PAYLOAD['message'], data=PAYLOAD['data'])))
+        messages = asyncio.run(run_app(app, make_scope('/series', [(b'accept', media_type.encode())])))
+
+        headers = dict(messages[0]['headers'])
+        assert messages[0]['status'] == status.HTTP_200_OK
+        assert headers[b'content-type'] == media_type.encode()
+        assert headers[b'vary'] == b'accept'
+        assert decode(messages[1]['body']) == PAYLOAD
+        assert len(messages[1]['body']) < len(json.dumps(PAYLOAD, separators=(',', ':')))
+
+    def test_pagination_envelope(self):
+        from fastapi_pagination import Page  # noqa: PLC0415
+
+        page = Page(items=[1, 2], total=2, page=1, size=10, pages=1)
+        app = ContentNegotiationMiddleware(envelope_app(lambda: response_pagination(message='Fetched', data={'items': [1, 2]}, pagination=page)))
+        messages = asyncio.run(run_app(app, make_scope('/series', [(b'accept', b'application/cbor')])))
+        assert decode_cbor(messages[1]['body']) == {
+            'status_code': 200,
+            'message': 'Fetched',
+            'data': {'items': [1, 2]},
+            'pagination': {'total': 2, 'page': 1, 'size': 10, 'pages': 1},
+        }
+
+    @pytest.mark.parametrize('headers', [[], [(b'accept', b'application/json')], [(b'accept', b'*/*')]])
+    def test_json_by_default(self, headers):
+        app = ContentNegotiationMiddleware(envelope_app(lambda: response_success(data={'key': 'value'})))
+        messages = asyncio.run(run_app(app, make_scope('/series', headers)))
+        assert dict(messages[0]['headers'])[b'content-type'] == b'application/json'
+        assert json.loads(messages[1]['body'])['data'] == {'key': 'value'}
+
+    def test_no_content_is_unchanged(self):
+        app = ContentNegotiationMiddleware(envelope_app(response_no_content))
+        messages = asyncio.run(run_app(app, make_scope('/series', [(b'accept', b'application/msgpack')])))
+        assert messages[0]['status'] == status.HTTP_204_NO_CONTENT
+        assert messages[1]['body'] == b''
+
+    def test_media_type_is_reset(self):
+        app = ContentNegotiationMiddleware(envelope_app(response_no_content))
+        asyncio.run(run_app(app, make_scope('/series', [(b'accept', b'application/msgpack')])))
+        assert response_media_type.get() is None
+
+    def test_passes_through_non_http_scopes(self):
+        seen = []
+
+        async def lifespan_app(scope, receive, send):
+            seen.append(scope['type'])
+
+        asyncio.run(ContentNegotiationMiddleware(lifespan_app)({'type': 'lifespan'}, None, None))
+        assert seen == ['lifespan']
@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Cumulative import time budgets in milliseconds, measured with python -X importtime in a fresh interpreter. Wall-clock
+# times depend on the machine, so they are only checked with pytest -m import_time, which the Code workflow runs with a
+# scale for its runners. Set TUNSBERG_IMPORT_BUDGET_SCALE to adjust them.
+IMPORT_BUDGETS_MS = {
+    'tunsberg': 25,
+    'tunsberg.utsikten': 50,
+    'tunsberg.encoding': 50,
+    'tunsberg.background': 75,
+    'tunsberg.middleware': 75,
+    'tunsberg.logquery': 75,
+    'tunsberg.metrics': 75,
+    'tunsberg.serialization': 75,
+    'tunsberg.profiling': 150,
+    'tunsberg.konfig': 150,
+    'tunsberg.responses': 350,
+}
+
+# Modules that must not be imported as a side effect of importing an entry point, they are imported when first used
+HEAVY_MODULES = ('asyncio', 'concurrent.futures', 'fastapi', 'fastapi_pagination', 'multiprocessing', 'pydantic', 'starlette')
+HEAVY_MODULES_ALLOWED = {
+    'tunsberg.profiling': ('asyncio', 'concurrent.futures'),
+    'tunsberg.responses': ('asyncio', 'concurrent.futures', 'pydantic', 'starlette'),
+}
+
+
+def import_time_ms(module: str) -> float:
+    """Import a module in a fresh interpreter and return its cumulative import time"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True)
+    for line in reversed(result.stderr.splitlines()):
+        _, _, cumulative, name = (part.strip() for part in line.replace('import time:', '|').split('|'))
+        if name == module:
+            return int(cumulative) / 1000
+    raise AssertionError(f'{module} not found in -X importtime output')
+
+
+def imported_heavy_modules(module: str) -> list[str]:
+    """Import a module in a fresh interpreter and return the heavy modules it pulled in"""
+    code = f'import json, sys, {module}; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+class TestImportedModules:
+    @pytest.mark.parametrize('module', IMPORT_BUDGETS_MS)
+    def test_heavy_dependencies_are_not_imported(self, module):
+        assert imported_heavy_modules(module) == list(HEAVY_MODULES_ALLOWED.get(module, ()))
+
+
+@pytest.mark.import_time
+class TestImportTime:
+    @pytest.mark.parametrize('module', IMPORT_BUDGETS_MS)
+    def test_import_time_within_budget(self, module):
+        budget = IMPORT_BUDGETS_MS[module] * float(os.getenv('TUNSBERG_IMPORT_BUDGET_SCALE', '1'))
+        # Take the best of a few runs, the first one may include compiling the module
+        elapsed = min(import_time_ms(module) for _ in range(3))
+        assert elapsed <= budget, f'Importing {module} took {elapsed:.1f}ms, the budget is {budget:.0f}ms'
+
+
+class TestLazyAttributes:
+    def test_package_imports_submodules_on_access(self):
+        import tunsberg  # noqa: PLC0415
+
+        assert tunsberg.utsikten.format_version_tag('1.2.3') == '1.2.3'
+        assert 'konfig' in dir(tunsberg)
+
+    def test_package_unknown_attribute(self):
+        import tunsberg  # noqa: PLC0415
+
+        with pytest.raises(AttributeError):
+            tunsberg.missing  # noqa: B018
+
+    def test_custom_params_is_created_on_first_use(self):
+        from fastapi_pagination import Params  # noqa: PLC0415
+
+        from tunsberg import responses  # noqa: PLC0415
+        from tunsberg.responses import CustomParams  # noqa: PLC0415
+
+        assert issubclass(CustomParams, Params)
+        assert CustomParams().size == 10  # noqa: PLR2004
+        assert responses.CustomParams is CustomParams
+
+    def test_responses_unknown_attribute(self):
+        from tunsberg import responses  # noqa: PLC0415
+
+        with pytest.raises(AttributeError):
+            responses.missing  # noqa: B018
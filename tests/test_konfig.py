@@ -1,11 +1,43 @@
+import asyncio
+import copy
+import io
 import json
 import logging
+import logging.config
+import logging.handlers
 import os
+import pickle
+import signal
+import socket
+import struct
 import sys
+import threading
+import time
+from http import HTTPStatus
 
 import pytest
 
-from tunsberg.konfig import JsonFormatter, check_required_env_vars, log_config, uvicorn_log_config
+from tests.helpers import CollectingHandler, make_scope, run_app
+from tunsberg.konfig import (
+    FILE_HANDLERS,
+    JsonFormatter,
+    LogAggregator,
+    LogLevelController,
+    RingBufferHandler,
+    Settings,
+    SettingsLoader,
+    check_required_env_vars,
+    load_settings,
+    log_config,
+    parse_bool,
+    parse_env_file,
+    parse_list,
+    parse_url,
+    per_worker_file_handler,
+    start_log_aggregator,
+    uvicorn_log_config,
+)
+from tunsberg.middleware import RequestContext, RequestContextFilter, request_context
 
 
 class TestLogConfig:
@@ -52,6 +84,19 @@ class TestLogConfig:
         config = log_config(log_level=logging.NOTSET, log_file_path=log_file_path)
         assert config['handlers']['file']['filename'] == log_file_path
 
+    def test_tunsberg_logger_uses_selected_handlers(self):
+        config = log_config(log_level=logging.INFO, log_handlers=['console'])
+        assert config['loggers']['tunsberg'] == {'handlers': ['console'], 'level': 'INFO', 'propagate': False}
+
+    def test_tunsberg_access_log_silences_uvicorn_access(self):
+        config = log_config(access_log='tunsberg')
+        assert config['loggers']['uvicorn.access']['handlers'] == []
+        assert config['loggers']['uvicorn.access']['level'] == 'WARNING'
+
+    def test_invalid_access_log(self):
+        with pytest.raises(ValueError, match='Invalid access log'):
+            log_config(access_log='nginx')
+
     def test_custom_log_level(self):
         log_lvl = logging.INFO
         config = log_config(log_level=log_lvl)
@@ -60,6 +105,608 @@ class TestLogConfig:
         assert config['loggers']['uvicorn.access']['level'] == logging.getLevelName(log_lvl)
 
 
+class TestMultiprocessLogConfig:
+    def test_invalid_multiprocess_mode(self):
+        with pytest.raises(ValueError, match='Invalid multiprocess mode'):
+            log_config(multiprocess_mode='threads')
+
+    def test_per_worker_uses_factory_for_file_handlers(self):
+        config = log_config(multiprocess_mode='per_worker')
+        for name in ('file', 'rotating_file', 'time_rotating_file'):
+            handler = config['handlers'][name]
+            assert handler['()'] is per_worker_file_handler
+            assert 'class' not in handler
+            assert handler['delay'] is True
+        assert config['handlers']['time_rotating_file']['handler_class'] == 'logging.handlers.TimedRotatingFileHandler'
+        assert config['loggers']['uvicorn']['handlers'] == ['time_rotating_file', 'console']
+
+    def test_per_worker_file_handler_adds_pid_to_filename(self, tmp_path):
+        handler = per_worker_file_handler('logging.FileHandler', str(tmp_path / 'fastapi.log'), delay=True)
+        try:
+            assert isinstance(handler, logging.FileHandler)
+            assert handler.baseFilename == str(tmp_path / f'fastapi.{os.getpid()}.log')
+        finally:
+            handler.close()
+
+    def test_per_worker_config_can_be_applied(self, tmp_path):
+        config = log_config(log_file_path=str(tmp_path / 'app.log'), log_handlers=['rotating_file'], multiprocess_mode='per_worker')
+        logging.config.dictConfig(config)
+        logger = logging.getLogger('uvicorn')
+        try:
+            logger.info('hello')
+            assert (tmp_path / f'app.{os.getpid()}.log').read_text().endswith('uvicorn: hello\n')
+        finally:
+            for handler in logger.handlers:
+                handler.close()
+            logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False})
+
+    def test_per_worker_files_of_forked_workers(self, tmp_path):
+        config = log_config(log_file_path=str(tmp_path / 'app.log'), log_handlers=['rotating_file'], multiprocess_mode='per_worker')
+        logging.config.dictConfig(config)
+        logger = logging.getLogger('uvicorn')
+        try:
+            logger.info('master')
+            workers = []
+            for _ in range(2):
+                pid = os.fork()
+                if pid == 0:
+                    logger.info('worker %d', os.getpid())
+                    os._exit(0)
+                workers.append(pid)
+            for pid in workers:
+                assert os.waitpid(pid, 0)[1] == 0
+            logger.info('master again')
+            master_log = (tmp_path / f'app.{os.getpid()}.log').read_text()
+            assert 'uvicorn: master\n' in master_log
+            assert master_log.endswith('uvicorn: master again\n')
+            for pid in workers:
+                assert (tmp_path / f'app.{pid}.log').read_text().endswith(f'uvicorn: worker {pid}\n')
+        finally:
+            for handler in logger.handlers:
+                handler.close()
+            logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False})
+
+    def test_aggregator_replaces_file_handlers_with_socket(self):
+        config = log_config(log_handlers=['file', 'time_rotating_file', 'console'], multiprocess_mode='aggregator')
+        assert config['handlers']['socket']['host'] == 'fastapi.log.sock'
+        assert config['handlers']['socket']['port'] is None
+        assert 'formatter' not in config['handlers']['socket']
+        assert config['handlers']['socket']['filters'] == ['request_context']
+        assert config['filters']['request_context']['()'] is RequestContextFilter
+        for logger in config['loggers'].values():
+            assert logger['handlers'] == ['socket', 'console']
+
+    def test_aggregator_worker_never_opens_the_log_file(self, tmp_path):
+        log_file = tmp_path / 'app.log'
+        config = log_config(log_file_path=str(log_file), multiprocess_mode='aggregator')
+        assert not set(FILE_HANDLERS) & set(config['handlers'])
+        logging.config.dictConfig(config)
+        logger = logging.getLogger('uvicorn')
+        try:
+            # No aggregator is listening, the socket handler drops the record
+            logger.info('hello')
+            assert not log_file.exists()
+        finally:
+            logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False})
+
+    def test_aggregator_custom_socket_path(self):
+        config = log_config(multiprocess_mode='aggregator', log_socket_path='/run/app/log.sock')
+        assert config['handlers']['socket']['host'] == '/run/app/log.sock'
+
+
+class TestLogAggregator:
+    def test_receives_records_from_socket_handler(self, tmp_path):
+        socket_path = str(tmp_path / 'log.sock')
+        aggregator = LogAggregator(socket_path)
+        aggregator.bind()
+        thread = threading.Thread(target=aggregator.serve_forever, kwargs={'poll_interval': 0.01})
+        thread.start()
+
+        collector = CollectingHandler()
+        target = logging.getLogger('tests.aggregator')
+        target.addHandler(collector)
+        sender = logging.handlers.SocketHandler(socket_path, None)
+        try:
+            record = logging.LogRecord('tests.aggregator', logging.WARNING, 'x.py', 1, 'hello %s', ('world',), None)
+            sent = 3
+            for _ in range(sent):
+                sender.handle(record)
+            deadline = time.monotonic() + 5
+            while len(collector.records) < sent and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            sender.close()
+            aggregator.shutdown()
+            thread.join()
+            target.removeHandler(collector)
+
+        assert [r.getMessage() for r in collector.records] == ['hello world'] * sent
+        assert not os.path.exists(socket_path)
+
+    def test_exception_text_survives_transport(self, tmp_path):
+        socket_path = str(tmp_path / 'log.sock')
+        aggregator = LogAggregator(socket_path)
+        aggregator.bind()
+        thread = threading.Thread(target=aggregator.serve_forever, kwargs={'poll_interval': 0.01})
+        thread.start()
+
+        collector = CollectingHandler()
+        target = logging.getLogger('tests.aggregator.exc')
+        target.addHandler(collector)
+        sender = logging.handlers.SocketHandler(socket_path, None)
+        try:
+            try:
+                raise ValueError('boom')
+            except ValueError:
+                sender.handle(logging.LogRecord('tests.aggregator.exc', logging.ERROR, 'x.py', 1, 'failed', (), sys.exc_info()))
+            deadline = time.monotonic() + 5
+            while not collector.records and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            sender.close()
+            aggregator.shutdown()
+            thread.join()
+            target.removeHandler(collector)
+
+        payload = json.loads(JsonFormatter().format(collector.records[0]))
+        assert 'ValueError: boom' in payload['exception']
+
+    def test_corrupt_frame_only_closes_its_connection(self, tmp_path, capsys):
+        socket_path = str(tmp_path / 'log.sock')
+        aggregator = LogAggregator(socket_path)
+        aggregator.bind()
+        thread = threading.Thread(target=aggregator.serve_forever, kwargs={'poll_interval': 0.01})
+        thread.start()
+
+        collector = CollectingHandler()
+        target = logging.getLogger('tests.aggregator.corrupt')
+        target.addHandler(collector)
+        corrupt = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sender = logging.handlers.SocketHandler(socket_path, None)
+        try:
+            garbage = b'not a pickled record'
+            corrupt.connect(socket_path)
+            corrupt.sendall(struct.pack('>L', len(garbage)) + garbage)
+            # The aggregator closes the connection of the corrupt frame
+            corrupt.settimeout(5)
+            assert corrupt.recv(1) == b''
+
+            sender.handle(logging.LogRecord('tests.aggregator.corrupt', logging.WARNING, 'x.py', 1, 'still served', (), None))
+            deadline = time.monotonic() + 5
+            while not collector.records and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            corrupt.close()
+            sender.close()
+            aggregator.shutdown()
+            thread.join()
+            target.removeHandler(collector)
+
+        assert [r.getMessage() for r in collector.records] == ['still served']
+        assert 'corrupt record' in capsys.readouterr().err
+
+    def test_start_log_aggregator_writes_single_file(self, tmp_path):
+        socket_path = str(tmp_path / 'log.sock')
+        log_file = tmp_path / 'app.log'
+        process = start_log_aggregator(socket_path, log_config(log_file_path=str(log_file), log_handlers=['file']))
+        sender = logging.handlers.SocketHandler(socket_path, None)
+        try:
+            sender.handle(logging.LogRecord('uvicorn', logging.INFO, 'x.py', 1, 'from worker', (), None))
+            deadline = time.monotonic() + 5
+            while (not log_file.exists() or 'from worker' not in log_file.read_text()) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            sender.close()
+            process.terminate()
+            process.join()
+
+        assert 'uvicorn: from worker' in log_file.read_text()
+
+
+RING_CAPACITY = 50
+RING_CAPACITY_SMALL = 3
+
+
+class TestRingBufferHandler:
+    def make_record(self, message, level=logging.DEBUG, **extra):
+        record = logging.LogRecord('tests.ring', level, 'x.py', 1, message, (), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_keeps_last_records_and_dumps_on_error(self):
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=RING_CAPACITY_SMALL, target=target)
+        for i in range(5):
+            handler.handle(self.make_record(f'debug {i}'))
+        assert len(handler) == RING_CAPACITY_SMALL
+        assert target.records == []
+
+        handler.handle(self.make_record('failed', logging.ERROR))
+        assert [r.getMessage() for r in target.records] == ['debug 3', 'debug 4', 'failed']
+        assert len(handler) == 0
+
+    def test_formats_only_when_dumped(self):
+        class Lazy:
+            formatted = 0
+
+            def __str__(self):
+                Lazy.formatted += 1
+                return 'lazy'
+
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=10, target=target)
+        handler.handle(logging.LogRecord('tests.ring', logging.DEBUG, 'x.py', 1, 'value %s', (Lazy(),), None))
+        assert Lazy.formatted == 0
+        handler.dump()
+        assert target.records[0].getMessage() == 'value lazy'
+
+    def test_restores_record_fields(self):
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=10, target=target)
+        original = self.make_record('hello', extra_fields={'status': 200}, request_id='abc')
+        handler.handle(original)
+        handler.dump()
+        record = target.records[0]
+        for field in ('name', 'levelno', 'levelname', 'pathname', 'filename', 'module', 'lineno', 'created', 'thread', 'process'):
+            assert getattr(record, field) == getattr(original, field)
+        assert record.extra_fields == {'status': 200}
+        assert record.request_id == 'abc'
+
+    def test_captures_request_id_from_context(self):
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=10, target=target)
+        token = request_context.set(RequestContext('from-context', 0.0, {}))
+        try:
+            handler.handle(self.make_record('hello'))
+        finally:
+            request_context.reset(token)
+        handler.handle(self.make_record('outside'))
+        handler.dump()
+        assert target.records[0].request_id == 'from-context'
+        assert not hasattr(target.records[1], 'request_id')
+
+    def test_renders_tracebacks_when_stored(self):
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=10, target=target)
+        handler.handle(make_exception_record())
+        record = target.records[0]
+        assert record.exc_info is None
+        assert 'ValueError: boom' in record.exc_text
+
+    def test_max_bytes_drops_oldest_records(self):
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=100, target=target, max_bytes=1000)
+        for i in range(10):
+            handler.handle(self.make_record(f'{i}' * 200))
+        handler.dump()
+        assert [r.getMessage()[0] for r in target.records] == ['8', '9']
+
+    def test_flush_does_not_dump(self):
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=10, target=target)
+        handler.handle(self.make_record('hello'))
+        handler.flush()
+        assert target.records == []
+
+    def test_close_dumps_only_with_flush_on_close(self):
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=10, target=target)
+        handler.handle(self.make_record('dropped'))
+        handler.close()
+        assert target.records == []
+
+        handler = RingBufferHandler(capacity=10, target=target, flushOnClose=True)
+        handler.handle(self.make_record('kept'))
+        handler.close()
+        assert [r.getMessage() for r in target.records] == ['kept']
+
+    def test_dump_without_target(self):
+        handler = RingBufferHandler(capacity=10)
+        handler.handle(self.make_record('failed', logging.ERROR))
+        handler.flush()
+        assert len(handler) == 0
+
+    def test_signal_dumps_buffer(self):
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=10, target=target)
+        handler.install_signal_handler(signal.SIGUSR2)
+        try:
+            handler.handle(self.make_record('hello'))
+            os.kill(os.getpid(), signal.SIGUSR2)
+            deadline = time.monotonic() + 5
+            while not target.records and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+        assert [r.getMessage() for r in target.records] == ['hello']
+
+    def test_signal_handler_does_not_dump_in_signal_context(self):
+        target = CollectingHandler()
+        handler = RingBufferHandler(capacity=10, target=target)
+        handler.install_signal_handler(signal.SIGUSR2)
+        threads = []
+        target.emit = lambda record: threads.append(threading.current_thread())
+        try:
+            with handler.lock:
+                handler.handle(self.make_record('hello'))
+                os.kill(os.getpid(), signal.SIGUSR2)
+                time.sleep(0.05)
+                assert threads == []
+            deadline = time.monotonic() + 5
+            while not threads and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+        assert threads
+        assert threads[0] is not threading.main_thread()
+
+    def test_log_config_ring_buffer(self, tmp_path):
+        config = log_config(
+            log_level=logging.INFO, log_file_path=str(tmp_path / 'app.log'), log_handlers=['file', 'ring_buffer'], ring_buffer_capacity=RING_CAPACITY
+        )
+        assert config['handlers']['ring_buffer']['capacity'] == RING_CAPACITY
+        assert config['handlers']['ring_buffer_file']['filename'] == str(tmp_path / 'app.debug.log')
+        assert config['handlers']['file']['level'] == 'INFO'
+        assert config['loggers']['uvicorn']['level'] == 'DEBUG'
+
+        logging.config.dictConfig(config)
+        logger = logging.getLogger('uvicorn')
+        try:
+            logger.debug('context')
+            logger.info('normal')
+            assert 'context' not in (tmp_path / 'app.log').read_text()
+            assert not (tmp_path / 'app.debug.log').exists()
+
+            logger.error('failed')
+            debug_lines = (tmp_path / 'app.debug.log').read_text().splitlines()
+            assert [line.rsplit(': ', 1)[1] for line in debug_lines] == ['context', 'normal', 'failed']
+        finally:
+            for handler in logger.handlers:
+                handler.close()
+            logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False})
+
+    def test_log_config_ring_buffer_targets_socket_in_aggregator_mode(self):
+        config = log_config(log_handlers=['file', 'ring_buffer'], multiprocess_mode='aggregator')
+        assert config['handlers']['ring_buffer']['target'] == 'socket'
+        assert config['loggers']['uvicorn']['handlers'] == ['socket', 'ring_buffer']
+
+    def test_log_config_ring_buffer_levels_socket_in_aggregator_mode(self, tmp_path):
+        config = log_config(
+            log_level=logging.INFO,
+            log_file_path=str(tmp_path / 'app.log'),
+            log_handlers=['ring_buffer', 'time_rotating_file'],
+            multiprocess_mode='aggregator',
+        )
+        assert config['handlers']['socket']['level'] == 'INFO'
+        assert 'level' not in config['handlers']['ring_buffer']
+        assert config['loggers']['uvicorn']['level'] == 'DEBUG'
+
+        received = []
+        logging.config.dictConfig(config)
+        logger = logging.getLogger('uvicorn')
+        socket_handler = next(handler for handler in logger.handlers if isinstance(handler, logging.handlers.SocketHandler))
+        socket_handler.emit = received.append
+        try:
+            logger.debug('context')
+            logger.info('normal')
+            assert [record.getMessage() for record in received] == ['normal']
+        finally:
+            for handler in logger.handlers:
+                handler.close()
+            logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False})
+
+    def test_log_config_ring_buffer_file_per_worker(self):
+        config = log_config(multiprocess_mode='per_worker')
+        assert config['handlers']['ring_buffer_file']['()'] is per_worker_file_handler
+
+
+class TestLogLevelController:
+    def setup_method(self):
+        self.logger = logging.getLogger('tests.control')
+        self.logger.setLevel(logging.WARNING)
+        self.handler = logging.NullHandler()
+        self.handler.name = 'tests_null'
+        self.other = logging.getLogger('tests.control.other')
+        self.other.addHandler(self.handler)
+        self.controller = LogLevelController(loggers=['tests.control'])
+
+    def teardown_method(self):
+        self.controller.revert()
+        self.controller.stop()
+        self.other.removeHandler(self.handler)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_set_level_and_revert(self):
+        self.controller.set_level('tests.control', 'debug')
+        assert self.logger.level == logging.DEBUG
+        assert self.controller.overrides()['tests.control'] == {'level': 'DEBUG', 'handlers': [], 'expires_in': None}
+        self.controller.revert('tests.control')
+        assert self.logger.level == logging.WARNING
+        assert self.controller.overrides() == {}
+
+    def test_repeated_override_keeps_original(self):
+        self.controller.set_level('tests.control', logging.INFO)
+        self.controller.set_level('tests.control', logging.DEBUG)
+        self.controller.revert()
+        assert self.logger.level == logging.WARNING
+
+    def test_override_reverts_after_ttl(self):
+        ttl = 0.05
+        self.controller.set_level('tests.control', logging.DEBUG, ttl=ttl)
+        assert self.controller.overrides()['tests.control']['expires_in'] <= ttl
+        assert self.wait_for(lambda: self.logger.level == logging.WARNING)
+        assert self.controller.overrides() == {}
+
+    def test_stale_ttl_timer_does_not_revert_newer_override(self):
+        self.controller.set_level('tests.control', logging.INFO, ttl=0.01)
+        with self.controller._lock:
+            stale = self.controller._timers['tests.control']
+            # The timer fires and waits for the lock while a newer override replaces it
+            time.sleep(0.05)
+            self.controller.set_level('tests.control', logging.DEBUG, ttl=60)
+        stale.join(5)
+        assert self.logger.level == logging.DEBUG
+        assert self.controller.overrides()['tests.control']['expires_in'] > 0
+
+    def test_set_handlers(self):
+        self.controller.set_handlers('tests.control', ['tests_null'])
+        assert self.logger.handlers == [self.handler]
+        self.controller.revert('tests.control')
+        assert self.logger.handlers == []
+
+    def test_set_handlers_configured_but_unattached(self, tmp_path):
+        logging.config.dictConfig(log_config(log_file_path=str(tmp_path / 'app.log'), log_handlers=['console']))
+        uvicorn_logger = logging.getLogger('uvicorn')
+        try:
+            self.controller.set_handlers('uvicorn', ['file'])
+            assert [handler.name for handler in uvicorn_logger.handlers] == ['file']
+            assert uvicorn_logger.handlers[0].baseFilename == str(tmp_path / 'app.log')
+            self.controller.revert('uvicorn')
+            assert [handler.name for handler in uvicorn_logger.handlers] == ['console']
+        finally:
+            self.controller.revert()
+            logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False})
+
+    def test_unknown_handler(self):
+        with pytest.raises(ValueError, match='Unknown log handler'):
+            self.controller.set_handlers('tests.control', ['missing'])
+
+    def test_invalid_level(self):
+        with pytest.raises(ValueError, match='Invalid log level'):
+            self.controller.set_level('tests.control', 'LOUD')
+
+    @pytest.mark.parametrize(
+        'options',
+        [{'level': 'DEBUG', 'ttl': '300'}, {'level': 'DEBUG', 'ttl': -1}, {'level': 'DEBUG', 'ttl': True}, {'level': True}, {'handlers': 'tests_null'}],
+    )
+    def test_invalid_override_changes_nothing(self, options):
+        with pytest.raises(ValueError):
+            self.controller.override('tests.control', **options)
+        assert self.logger.level == logging.WARNING
+        assert self.controller.overrides() == {}
+
+    def test_apply(self):
+        self.controller.set_level('tests.control.other', logging.ERROR)
+        self.controller.apply({'loggers': {'tests.control': {'level': 'INFO', 'ttl': 60}}, 'revert': ['tests.control.other']})
+        assert self.logger.level == logging.INFO
+        assert set(self.controller.overrides()) == {'tests.control'}
+
+    def test_apply_rejects_invalid_specification(self):
+        with pytest.raises(ValueError):
+            self.controller.apply(['tests.control'])
+        with pytest.raises(ValueError):
+            self.controller.apply({'loggers': {'tests.control': 'DEBUG'}})
+        with pytest.raises(ValueError):
+            self.controller.apply({'loggers': []})
+        with pytest.raises(ValueError):
+            self.controller.apply({'revert': 'tests.control'})
+
+    def test_apply_validates_everything_first(self):
+        self.controller.set_level('tests.control.other', logging.ERROR)
+        spec = {'loggers': {'tests.control': {'level': 'DEBUG'}, 'tests.control.third': {'level': 'DEBUG', 'ttl': 'soon'}}, 'revert': ['tests.control.other']}
+        with pytest.raises(ValueError, match='TTL'):
+            self.controller.apply(spec)
+        assert self.logger.level == logging.WARNING
+        assert set(self.controller.overrides()) == {'tests.control.other'}
+
+    def test_signal_toggles_levels(self):
+        self.controller.install_signal_handler(signal.SIGUSR1, ttl=None)
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+            assert self.wait_for(lambda: self.logger.level == logging.DEBUG)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            assert self.wait_for(lambda: self.logger.level == logging.WARNING)
+        finally:
+            signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
+    def test_signal_handler_does_not_toggle_in_signal_context(self):
+        self.controller.install_signal_handler(signal.SIGUSR1, ttl=None)
+        try:
+            with self.controller._lock:
+                os.kill(os.getpid(), signal.SIGUSR1)
+                time.sleep(0.05)
+                assert self.logger.level == logging.WARNING
+            assert self.wait_for(lambda: self.logger.level == logging.DEBUG)
+        finally:
+            signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
+    def test_poll_file(self, tmp_path):
+        path = tmp_path / 'logging.json'
+        assert self.controller.poll_file(str(path)) is None
+
+        path.write_text(json.dumps({'loggers': {'tests.control': {'level': 'DEBUG'}}}))
+        seen = self.controller.poll_file(str(path))
+        assert self.logger.level == logging.DEBUG
+
+        # Unchanged files are not read again
+        self.controller.revert()
+        assert self.controller.poll_file(str(path), seen) == seen
+        assert self.logger.level == logging.WARNING
+
+        self.controller.set_level('tests.control', logging.INFO)
+        path.unlink()
+        assert self.controller.poll_file(str(path), seen) is None
+        assert self.logger.level == logging.WARNING
+
+    def test_poll_file_logs_invalid_json(self, tmp_path, caplog):
+        path = tmp_path / 'logging.json'
+        path.write_text('{not json')
+        self.controller.poll_file(str(path))
+        assert 'Invalid log control file' in caplog.text
+
+    def test_poll_file_logs_unreadable_file(self, tmp_path, caplog):
+        path = tmp_path / 'logging.json'
+        path.mkdir()
+        seen = self.controller.poll_file(str(path))
+        assert seen is not None
+        assert 'Cannot read log control file' in caplog.text
+
+    def test_watch_file_survives_invalid_files(self, tmp_path):
+        path = tmp_path / 'logging.json'
+        path.mkdir()
+        self.controller.watch_file(str(path), interval=0.01)
+        time.sleep(0.05)
+        path.rmdir()
+        path.write_text(json.dumps({'loggers': {'tests.control': {'level': 'DEBUG', 'ttl': '300'}}}))
+        time.sleep(0.05)
+        path.write_text(json.dumps({'loggers': {'tests.control': {'level': 'INFO', 'ttl': 300}}}))
+        assert self.wait_for(lambda: self.logger.level == logging.INFO)
+
+    def test_watch_file(self, tmp_path):
+        path = tmp_path / 'logging.json'
+        path.write_text(json.dumps({'loggers': {'tests.control': {'level': 'INFO'}}}))
+        self.controller.watch_file(str(path), interval=0.01)
+        assert self.wait_for(lambda: self.logger.level == logging.INFO)
+
+    def call_app(self, method, body=b''):
+        messages = asyncio.run(run_app(self.controller.asgi_app(), make_scope(method=method), body))
+        return messages[0]['status'], json.loads(messages[1]['body'])
+
+    def test_asgi_app(self):
+        assert self.call_app('GET') == (HTTPStatus.OK, {})
+
+        status, payload = self.call_app('POST', json.dumps({'loggers': {'tests.control': {'level': 'DEBUG'}}}).encode())
+        assert status == HTTPStatus.OK
+        assert payload['tests.control']['level'] == 'DEBUG'
+
+        status, payload = self.call_app('POST', b'{broken')
+        assert status == HTTPStatus.BAD_REQUEST
+        assert 'error' in payload
+
+        status, payload = self.call_app('POST', json.dumps({'loggers': {'tests.control': {'level': 'INFO', 'ttl': 'long'}}}).encode())
+        assert status == HTTPStatus.BAD_REQUEST
+        assert 'TTL' in payload['error']
+
+        assert self.call_app('PUT')[0] == HTTPStatus.METHOD_NOT_ALLOWED
+        assert self.call_app('DELETE') == (HTTPStatus.OK, {})
+        assert self.logger.level == logging.WARNING
+
+
 class TestJsonFormatter:
     def test_format_emits_json_with_expected_keys(self):
         formatter = JsonFormatter()
@@ -78,6 +725,33 @@ class TestJsonFormatter:
         assert payload['logger'] == 'test.logger'
         assert 'timestamp' in payload
 
+    def test_format_adds_request_id_from_context(self):
+        record = logging.LogRecord('test', logging.INFO, 'x.py', 1, 'hello', (), None)
+        token = request_context.set(RequestContext('abc123', 0.0, {}))
+        try:
+            payload = json.loads(JsonFormatter().format(record))
+        finally:
+            request_context.reset(token)
+        assert payload['request_id'] == 'abc123'
+
+    def test_format_prefers_request_id_on_record(self):
+        record = logging.LogRecord('test', logging.INFO, 'x.py', 1, 'hello', (), None)
+        record.request_id = 'from-worker'
+        payload = json.loads(JsonFormatter().format(record))
+        assert payload['request_id'] == 'from-worker'
+
+    def test_format_without_request_id(self):
+        record = logging.LogRecord('test', logging.INFO, 'x.py', 1, 'hello', (), None)
+        assert 'request_id' not in json.loads(JsonFormatter().format(record))
+
+    def test_format_merges_extra_fields(self):
+        record = logging.LogRecord('test', logging.INFO, 'x.py', 1, 'hello', (), None)
+        extra_fields = {'status': 200, 'duration_ms': 1.5}
+        record.extra_fields = extra_fields
+        payload = json.loads(JsonFormatter().format(record))
+        assert payload['status'] == extra_fields['status']
+        assert payload['duration_ms'] == extra_fields['duration_ms']
+
     def test_format_includes_exception_when_exc_info_set(self):
         formatter = JsonFormatter()
         try:
@@ -97,6 +771,178 @@ class TestJsonFormatter:
         assert 'ValueError' in payload['exception']
 
 
+def make_exception_record(message='boom'):
+    """Create an error record for an exception raised from the same line every time"""
+    try:
+        raise ValueError(message)
+    except ValueError:
+        return logging.LogRecord('test', logging.ERROR, 'x.py', 1, 'failed', (), sys.exc_info())
+
+
+class TestJsonFormatterDeduplication:
+    def setup_method(self):
+        self.collector = CollectingHandler()
+        self.summary_logger = logging.getLogger('tunsberg.konfig')
+        self.summary_logger.addHandler(self.collector)
+
+    def teardown_method(self):
+        self.summary_logger.removeHandler(self.collector)
+
+    def wait_for_summaries(self, count=1):
+        # Summaries that close while a record is formatted are logged by a background thread
+        deadline = time.monotonic() + 5
+        while len(self.collector.records) < count and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def test_first_occurrence_has_full_traceback(self):
+        formatter = JsonFormatter(dedupe_window=60)
+        payload = json.loads(formatter.format(make_exception_record()))
+        assert 'Traceback' in payload['exception']
+        assert len(payload['exception_fingerprint']) == len('0123456789abcdef')
+        assert 'exception_repeat' not in payload
+
+    def test_repeats_are_logged_without_traceback(self):
+        formatter = JsonFormatter(dedupe_window=60)
+        first = json.loads(formatter.format(make_exception_record()))
+        second = json.loads(formatter.format(make_exception_record('again')))
+        third = json.loads(formatter.format(make_exception_record()))
+        assert second['exception'] == 'ValueError: again'
+        assert second['exception_fingerprint'] == first['exception_fingerprint']
+        assert [second['exception_repeat'], third['exception_repeat']] == [1, 2]
+
+    def test_same_record_is_counted_once_by_shared_formatter(self):
+        formatter = JsonFormatter(dedupe_window=60)
+        record = make_exception_record()
+        first = json.loads(formatter.format(record))
+        second = json.loads(formatter.format(record))
+        assert first['exception'] == second['exception']
+        assert 'exception_repeat' not in second
+
+    def test_different_locations_have_different_fingerprints(self):
+        formatter = JsonFormatter(dedupe_window=60)
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            other = logging.LogRecord('test', logging.ERROR, 'x.py', 1, 'failed', (), sys.exc_info())
+        first = json.loads(formatter.format(make_exception_record()))
+        second = json.loads(formatter.format(other))
+        assert first['exception_fingerprint'] != second['exception_fingerprint']
+        assert 'Traceback' in second['exception']
+
+    def test_summary_is_logged_when_window_closes(self):
+        formatter = JsonFormatter(dedupe_window=0.05)
+        first = json.loads(formatter.format(make_exception_record()))
+        formatter.format(make_exception_record())
+        formatter.format(make_exception_record())
+        time.sleep(0.06)
+        formatter.format(logging.LogRecord('test', logging.INFO, 'x.py', 1, 'later', (), None))
+        self.wait_for_summaries()
+
+        assert len(self.collector.records) == 1
+        summary = self.collector.records[0].extra_fields
+        assert summary['exception_fingerprint'] == first['exception_fingerprint']
+        assert summary['exception_type'] == 'ValueError'
+        assert summary['exception_repeat'] == len(['second', 'third'])
+
+        # A new window starts with the full traceback again
+        assert 'Traceback' in json.loads(formatter.format(make_exception_record()))['exception']
+
+    def test_first_occurrence_after_expiry_opens_new_window(self):
+        formatter = JsonFormatter(dedupe_window=0.05)
+        formatter.format(make_exception_record())
+        formatter.format(make_exception_record())
+        time.sleep(0.06)
+        payload = json.loads(formatter.format(make_exception_record()))
+        self.wait_for_summaries()
+
+        assert 'Traceback' in payload['exception']
+        assert 'exception_repeat' not in payload
+        assert self.collector.records[0].extra_fields['exception_repeat'] == 1
+        assert json.loads(formatter.format(make_exception_record()))['exception_repeat'] == 1
+
+    def test_no_summary_without_repeats(self):
+        formatter = JsonFormatter(dedupe_window=60)
+        formatter.format(make_exception_record())
+        formatter.flush_exception_summaries()
+        assert not self.collector.records
+
+    def test_flush_exception_summaries(self):
+        formatter = JsonFormatter(dedupe_window=60)
+        formatter.format(make_exception_record())
+        formatter.format(make_exception_record())
+        formatter.flush_exception_summaries()
+        assert self.collector.records[0].extra_fields['exception_repeat'] == 1
+
+    def test_cache_is_bounded(self):
+        formatter = JsonFormatter(dedupe_window=60, dedupe_cache_size=1)
+        formatter.format(make_exception_record())
+        formatter.format(make_exception_record())
+        try:
+            raise KeyError('other')
+        except KeyError:
+            formatter.format(logging.LogRecord('test', logging.ERROR, 'x.py', 1, 'failed', (), sys.exc_info()))
+        self.wait_for_summaries()
+        assert self.collector.records[0].extra_fields['exception_type'] == 'ValueError'
+
+    def test_summary_is_written_after_the_record_that_closed_the_window(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter(dedupe_window=0.01))
+        logger = logging.getLogger('tests.dedupe.order')
+        logger.addHandler(handler)
+        self.summary_logger.addHandler(handler)
+        try:
+            logger.error('failed', exc_info=make_exception_record().exc_info)
+            logger.error('failed', exc_info=make_exception_record().exc_info)
+            time.sleep(0.02)
+            logger.info('later')
+            self.wait_for_summaries()
+        finally:
+            logger.removeHandler(handler)
+            self.summary_logger.removeHandler(handler)
+
+        messages = [json.loads(line)['message'] for line in stream.getvalue().splitlines()]
+        assert messages[:3] == ['failed', 'failed', 'later']
+        assert messages[3].startswith('Exception ValueError')
+
+    def test_shared_formatter_does_not_deadlock_handlers(self):
+        formatter = JsonFormatter(dedupe_window=0.01)
+        first, second = logging.StreamHandler(io.StringIO()), logging.StreamHandler(io.StringIO())
+        for handler in (first, second):
+            handler.setFormatter(formatter)
+            self.summary_logger.addHandler(handler)
+        logger = logging.getLogger('tests.dedupe.shared')
+        logger.addHandler(first)
+        formatter.format(make_exception_record())
+        formatter.format(make_exception_record())
+        time.sleep(0.02)
+
+        # Another thread is inside the second handler, e.g. formatting a record of a logger that calls it first
+        second.acquire()
+        try:
+            worker = threading.Thread(target=logger.info, args=('closes the window',), daemon=True)
+            worker.start()
+            worker.join(5)
+            # Logging the summary while formatting would hold the first handler and wait for the second one
+            assert not worker.is_alive()
+            assert first.lock.acquire(timeout=5)
+            first.release()
+        finally:
+            second.release()
+            logger.removeHandler(first)
+            deadline = time.monotonic() + 5
+            while 'repeated' not in second.stream.getvalue() and time.monotonic() < deadline:
+                time.sleep(0.001)
+            for handler in (first, second):
+                self.summary_logger.removeHandler(handler)
+        assert 'repeated 1 times' in second.stream.getvalue()
+
+    def test_log_config_passes_dedupe_window(self):
+        window = 30
+        config = log_config(exception_dedupe_window=window)
+        assert config['formatters']['json']['dedupe_window'] == window
+
+
 class TestUvicornLogConfig:
     def test_deprecated_success_returns_config(self):
         with pytest.warns(DeprecationWarning, match='uvicorn_log_config'):
@@ -151,3 +997,318 @@ class TestCheckRequiredEnvVars:
         req_envs = {'SOME_OTHER_RANDOM_ENV_VAR': {'runtime': True, 'build': False}}
         with pytest.raises(ValueError):
             check_required_env_vars(required_env_vars=req_envs, env='production', live_envs=['production'])
+
+
+SETTINGS_SPEC = {
+    'ENV': {'runtime': True, 'build': True},
+    'WORKERS': {'runtime': True, 'build': False, 'type': int, 'default': 4},
+    'DEBUG': {'runtime': False, 'build': False, 'type': bool, 'default': False},
+    'ALLOWED_HOSTS': {'runtime': False, 'build': False, 'type': list},
+    'DATABASE_URL': {'runtime': True, 'build': False, 'parser': parse_url},
+}
+
+
+class TestLoadSettings:
+    spec = SETTINGS_SPEC
+
+    def test_parses_values_once(self):
+        environ = {'ENV': 'production', 'WORKERS': '8', 'DEBUG': 'yes', 'ALLOWED_HOSTS': 'a.no, b.no,', 'DATABASE_URL': 'postgresql://db:5432/app'}
+        settings = load_settings(self.spec, env='production', environ=environ)
+        assert isinstance(settings, Settings)
+        assert settings.as_dict() == {
+            'ENV': 'production',
+            'WORKERS': 8,
+            'DEBUG': True,
+            'ALLOWED_HOSTS': ['a.no', 'b.no'],
+            'DATABASE_URL': 'postgresql://db:5432/app',
+        }
+        assert settings.DEBUG is True
+
+    def test_uses_defaults_for_unset_variables(self):
+        settings = load_settings(self.spec, env='local', environ={})
+        assert settings.as_dict() == {'ENV': None, 'WORKERS': 4, 'DEBUG': False, 'ALLOWED_HOSTS': None, 'DATABASE_URL': None}
+
+    def test_reports_every_problem_at_once(self):
+        environ = {'WORKERS': 'many', 'DEBUG': 'maybe'}
+        with pytest.raises(ValueError) as e:
+            load_settings(self.spec, env='production', environ=environ)
+        message = str(e.value)
+        assert message.startswith('Environment Config Error: The following variables are not set: ENV, DATABASE_URL;')
+        assert message.endswith('The following variables are invalid: WORKERS (expected int), DEBUG (expected bool)')
+        assert 'many' not in message
+        assert 'maybe' not in message
+
+    def test_invalid_value_names_parser(self):
+        with pytest.raises(ValueError, match=r'DATABASE_URL \(expected parse_url\)$') as e:
+            load_settings(self.spec, env='local', environ={'DATABASE_URL': 'secret-password'})
+        assert 'secret' not in str(e.value)
+
+    def test_required_variable_with_default_is_not_missing(self):
+        settings = load_settings({'WORKERS': {'runtime': True, 'build': False, 'type': int, 'default': 2}}, env='production', environ={})
+        assert settings.as_dict() == {'WORKERS': 2}
+
+    def test_build_requirements(self):
+        with pytest.raises(ValueError, match='not set: ENV'):
+            load_settings({'ENV': {'runtime': False, 'build': True}}, env='local', code_build=True, environ={})
+
+    def test_reads_os_environ_by_default(self):
+        settings = load_settings({'RANDOM_ENV_VAR': {'runtime': True, 'build': True}}, env='production')
+        assert settings.as_dict() == {'RANDOM_ENV_VAR': 'random_value'}
+
+    def test_snapshot_is_immutable(self):
+        settings = load_settings(self.spec, env='local', environ={})
+        with pytest.raises(AttributeError):
+            settings.WORKERS = 1
+        with pytest.raises(AttributeError):
+            del settings.WORKERS
+        with pytest.raises(AttributeError):
+            settings.OTHER = 1
+        assert not hasattr(settings, '__dict__')
+
+    def test_snapshots_compare_by_value(self):
+        first = load_settings(self.spec, env='local', environ={'WORKERS': '2'})
+        second = load_settings(self.spec, env='local', environ={'WORKERS': '2'})
+        assert first == second
+        assert hash(first) == hash(second)
+        assert first != load_settings(self.spec, env='local', environ={'WORKERS': '3'})
+        assert first != first.as_dict()
+        assert type(first) is type(second)
+
+    def test_equal_snapshots_of_reordered_specs_hash_equal(self):
+        environ = {'WORKERS': '2', 'ALLOWED_HOSTS': 'a.no'}
+        first = load_settings(self.spec, env='local', environ=environ)
+        second = load_settings(dict(reversed(self.spec.items())), env='local', environ=environ)
+        assert first == second
+        assert hash(first) == hash(second)
+        assert len({first, second}) == 1
+
+    def test_snapshots_copy_and_pickle(self):
+        settings = load_settings(self.spec, env='local', environ={'WORKERS': '2', 'ALLOWED_HOSTS': 'a.no, b.no'})
+        for copied in (copy.copy(settings), copy.deepcopy(settings), pickle.loads(pickle.dumps(settings))):
+            assert copied == settings
+            assert copied.ALLOWED_HOSTS == ['a.no', 'b.no']
+            assert type(copied) is type(settings)
+
+    def test_repr_hides_values(self):
+        settings = load_settings({'SECRET': {'runtime': False, 'build': False}}, env='local', environ={'SECRET': 'hunter2'})
+        assert repr(settings) == 'Settings(SECRET)'
+
+    def test_rejects_names_that_are_not_identifiers(self):
+        with pytest.raises(ValueError, match='not valid attribute names: MY-VAR'):
+            load_settings({'MY-VAR': {'runtime': False, 'build': False}}, env='local', environ={})
+
+
+class TestSettingsParsers:
+    def test_parse_bool(self):
+        assert parse_bool(' TRUE ') is True
+        assert parse_bool('off') is False
+        with pytest.raises(ValueError, match=r'^not a boolean$'):
+            parse_bool('2')
+
+    def test_parse_list(self):
+        assert parse_list('') == []
+        assert parse_list('a,,b ') == ['a', 'b']
+
+    def test_parse_url(self):
+        assert parse_url('https://kilobyte.no/') == 'https://kilobyte.no/'
+        with pytest.raises(ValueError, match=r'^not a URL with scheme and host$'):
+            parse_url('kilobyte.no')
+
+
+class TestParseEnvFile:
+    def test_parses_assignments(self, tmp_path):
+        path = tmp_path / '.env'
+        path.write_text(
+            '# comment\n'
+            '\n'
+            'PLAIN=value\n'
+            'export EXPORTED = spaced \n'
+            'DOUBLE="line\\nbreak # kept"\n'
+            "SINGLE='raw\\n'\n"
+            'COMMENTED=value # comment\n'
+            'EMPTY=\n'
+            'not an assignment\n'
+        )
+        assert parse_env_file(str(path)) == {
+            'PLAIN': 'value',
+            'EXPORTED': 'spaced',
+            'DOUBLE': 'line\nbreak # kept',
+            'SINGLE': 'raw\\n',
+            'COMMENTED': 'value',
+            'EMPTY': '',
+        }
+
+
+LOADER_SPEC = {
+    'TUNSBERG_TEST_DB_PASSWORD': {'runtime': True, 'build': False},
+    'TUNSBERG_TEST_WORKERS': {'runtime': False, 'build': False, 'type': int, 'default': 1},
+}
+
+
+class TestSettingsLoader:
+    def make_loader(self, tmp_path, **kwargs):
+        secrets = tmp_path / 'secrets'
+        secrets.mkdir(exist_ok=True)
+        (secrets / 'TUNSBERG_TEST_DB_PASSWORD').write_text('first\n')
+        env_file = tmp_path / '.env'
+        env_file.write_text('TUNSBERG_TEST_WORKERS=2\nTUNSBERG_TEST_DB_PASSWORD=from-env-file\n')
+        return SettingsLoader(LOADER_SPEC, env='production', env_files=[str(env_file), str(tmp_path / 'missing.env')], secrets_dir=str(secrets), **kwargs)
+
+    def test_merges_sources(self, tmp_path):
+        loader = self.make_loader(tmp_path)
+        assert loader.settings.as_dict() == {'TUNSBERG_TEST_DB_PASSWORD': 'first', 'TUNSBERG_TEST_WORKERS': 2}
+
+    def test_environment_takes_precedence(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('TUNSBERG_TEST_WORKERS', '3')
+        loader = self.make_loader(tmp_path)
+        assert loader.settings.as_dict()['TUNSBERG_TEST_WORKERS'] == int(os.environ['TUNSBERG_TEST_WORKERS'])
+
+    def test_missing_required_variable(self, tmp_path):
+        with pytest.raises(ValueError, match='not set: TUNSBERG_TEST_DB_PASSWORD'):
+            SettingsLoader(LOADER_SPEC, env='production', secrets_dir=str(tmp_path / 'missing'))
+
+    def test_poll_without_changes(self, tmp_path):
+        loader = self.make_loader(tmp_path)
+        settings = loader.settings
+        assert not loader.poll()
+        assert loader.settings is settings
+
+    def test_poll_reloads_rotated_secret_and_notifies(self, tmp_path):
+        loader = self.make_loader(tmp_path)
+        notifications = []
+        loader.subscribe(lambda settings, changed: notifications.append((settings, changed)))
+
+        secret = tmp_path / 'secrets' / 'TUNSBERG_TEST_DB_PASSWORD'
+        replacement = tmp_path / 'secrets' / '.rotated'
+        replacement.write_text('second')
+        os.replace(replacement, secret)
+
+        assert loader.poll()
+        assert loader.settings.as_dict()['TUNSBERG_TEST_DB_PASSWORD'] == 'second'
+        assert notifications == [(loader.settings, ['TUNSBERG_TEST_DB_PASSWORD'])]
+
+    def test_removed_secret_falls_back_to_env_file(self, tmp_path):
+        loader = self.make_loader(tmp_path)
+        (tmp_path / 'secrets' / 'TUNSBERG_TEST_DB_PASSWORD').unlink()
+        assert loader.poll()
+        assert loader.settings.as_dict()['TUNSBERG_TEST_DB_PASSWORD'] == 'from-env-file'
+
+    def test_removed_env_file(self, tmp_path):
+        loader = self.make_loader(tmp_path)
+        (tmp_path / '.env').unlink()
+        assert loader.poll()
+        assert loader.settings.as_dict()['TUNSBERG_TEST_WORKERS'] == 1
+
+    def test_changed_file_without_changed_values(self, tmp_path):
+        loader = self.make_loader(tmp_path)
+        callback = []
+        loader.subscribe(callback.append)
+        (tmp_path / '.env').write_text('TUNSBERG_TEST_WORKERS=2\nTUNSBERG_TEST_DB_PASSWORD=from-env-file\n# touched\n')
+        assert not loader.poll()
+        assert callback == []
+
+    def test_invalid_reload_keeps_previous_settings(self, tmp_path, caplog):
+        loader = self.make_loader(tmp_path)
+        (tmp_path / '.env').write_text('TUNSBERG_TEST_WORKERS=many\n')
+        assert not loader.poll()
+        assert loader.settings.as_dict()['TUNSBERG_TEST_WORKERS'] == len('ab')
+        assert 'Reloading settings failed' in caplog.text
+
+    def test_raising_subscriber_does_not_block_others(self, tmp_path, caplog):
+        loader = self.make_loader(tmp_path)
+        notifications = []
+
+        def fail(settings, changed):
+            raise RuntimeError('subscriber failed')
+
+        loader.subscribe(fail)
+        loader.subscribe(lambda settings, changed: notifications.append(changed))
+        (tmp_path / '.env').write_text('TUNSBERG_TEST_WORKERS=5\n')
+        assert loader.poll()
+        (tmp_path / '.env').write_text('TUNSBERG_TEST_WORKERS=6\n')
+        assert loader.poll()
+        assert notifications == [['TUNSBERG_TEST_WORKERS'], ['TUNSBERG_TEST_WORKERS']]
+        assert 'Settings subscriber' in caplog.text
+
+    def test_unreadable_file_keeps_previous_values(self, tmp_path, caplog):
+        loader = self.make_loader(tmp_path)
+        notifications = []
+        loader.subscribe(lambda settings, changed: notifications.append(changed))
+        secret = tmp_path / 'secrets' / 'TUNSBERG_TEST_DB_PASSWORD'
+        secret.write_bytes(b'\xff\xfe')
+        assert not loader.poll()
+        assert loader.settings.as_dict()['TUNSBERG_TEST_DB_PASSWORD'] == 'first'
+        assert 'Cannot read settings file' in caplog.text
+
+        secret.write_text('second')
+        assert loader.poll()
+        assert loader.settings.as_dict()['TUNSBERG_TEST_DB_PASSWORD'] == 'second'
+        assert notifications == [['TUNSBERG_TEST_DB_PASSWORD']]
+
+    def test_unreadable_secret_fails_first_load(self, tmp_path, monkeypatch):
+        def deny(path):
+            raise PermissionError(13, 'Permission denied', path)
+
+        monkeypatch.setattr('tunsberg.konfig._read_secret', deny)
+        with pytest.raises(ValueError, match='Cannot read .*TUNSBERG_TEST_DB_PASSWORD'):
+            self.make_loader(tmp_path)
+
+    def test_unreadable_secret_keeps_last_good_value(self, tmp_path, monkeypatch):
+        loader = self.make_loader(tmp_path)
+
+        def deny(path):
+            raise PermissionError(13, 'Permission denied', path)
+
+        monkeypatch.setattr('tunsberg.konfig._read_secret', deny)
+        (tmp_path / 'secrets' / 'TUNSBERG_TEST_DB_PASSWORD').write_text('second')
+        (tmp_path / '.env').write_text('TUNSBERG_TEST_WORKERS=4\n')
+        assert loader.poll()
+        assert loader.settings.as_dict() == {'TUNSBERG_TEST_DB_PASSWORD': 'first', 'TUNSBERG_TEST_WORKERS': 4}
+
+    def test_secret_directory_entry_is_not_an_empty_value(self, tmp_path):
+        secrets = tmp_path / 'secrets'
+        (secrets / 'TUNSBERG_TEST_DB_PASSWORD').mkdir(parents=True)
+        with pytest.raises(ValueError, match='not set: TUNSBERG_TEST_DB_PASSWORD'):
+            SettingsLoader(LOADER_SPEC, env='production', secrets_dir=str(secrets))
+
+    def test_background_polling_survives_errors(self, tmp_path, monkeypatch):
+        loader = self.make_loader(tmp_path)
+        changed = threading.Event()
+        loader.subscribe(lambda settings, names: changed.set())
+        refresh_files = loader._refresh_files
+        calls = []
+
+        def flaky_refresh_files():
+            calls.append(None)
+            if len(calls) == 1:
+                raise PermissionError('secrets directory is not readable')
+            return refresh_files()
+
+        monkeypatch.setattr(loader, '_refresh_files', flaky_refresh_files)
+        (tmp_path / '.env').write_text('TUNSBERG_TEST_WORKERS=7\n')
+        loader.start(interval=0.01)
+        try:
+            assert changed.wait(5)
+        finally:
+            loader.stop()
+        assert len(calls) > 1
+
+    def test_unsubscribe(self, tmp_path):
+        loader = self.make_loader(tmp_path)
+        notifications = []
+        loader.subscribe(notifications.append)
+        loader.unsubscribe(notifications.append)
+        (tmp_path / '.env').write_text('TUNSBERG_TEST_WORKERS=5\n')
+        assert loader.poll()
+        assert notifications == []
+
+    def test_start_polls_in_background(self, tmp_path):
+        loader = self.make_loader(tmp_path)
+        changed = threading.Event()
+        loader.subscribe(lambda settings, names: changed.set())
+        loader.start(interval=0.01)
+        try:
+            (tmp_path / '.env').write_text('TUNSBERG_TEST_WORKERS=7\n')
+            assert changed.wait(5)
+        finally:
+            loader.stop()
@@ -0,0 +1,226 @@
+import gzip
+import itertools
+import json
+import logging
+import logging.config
+import os
+from datetime import UTC, datetime
+
+import pytest
+
+from tunsberg import logquery
+from tunsberg.konfig import JsonFormatter, log_config
+from tunsberg.logquery import (
+    INDEX_DIRECTORY,
+    _bloom,
+    _bloom_contains,
+    find_segments,
+    index_logs,
+    index_path,
+    index_segment,
+    main,
+    parse_time,
+    query_logs,
+)
+
+START = 1_700_000_000
+LINES = 300
+BLOCK_BYTES = 4096
+
+
+def format_lines(start: int, count: int) -> str:
+    """Format records one second apart the way JsonFormatter writes them to a log file"""
+    formatter = JsonFormatter()
+    lines = []
+    for i in range(count):
+        level = logging.ERROR if i % 50 == 0 else logging.INFO
+        record = logging.LogRecord('tunsberg.access' if i % 2 else 'app.db', level, 'app.py', 1, 'message %s', (i,), None)
+        record.created = start + i
+        record.request_id = f'request-{start}-{i}'
+        record.extra_fields = {'status': 500 if level == logging.ERROR else 200}
+        lines.append(formatter.format(record) + '\n')
+    return ''.join(lines)
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    """Write a log file with a rotated file and an older gzip-compressed one"""
+    path = tmp_path / 'fastapi.log'
+    path.write_text(format_lines(START + 2 * LINES, LINES))
+    (tmp_path / 'fastapi.log.1').write_text(format_lines(START + LINES, LINES))
+    with gzip.open(tmp_path / 'fastapi.log.2.gz', 'wt') as f:
+        f.write(format_lines(START, LINES))
+    (tmp_path / 'fastapi.log.sock').touch()
+    (tmp_path / 'other.log').write_text(format_lines(START, 1))
+    return str(path)
+
+
+def query(log_file, **kwargs):
+    """Query in this process"""
+    return list(query_logs(log_file, workers=1, **kwargs))
+
+
+class TestIndex:
+    def test_find_segments(self, log_file, tmp_path):
+        assert find_segments(log_file) == [str(tmp_path / name) for name in ('fastapi.log', 'fastapi.log.1', 'fastapi.log.2.gz')]
+
+    def test_find_segments_per_worker(self, tmp_path):
+        path = str(tmp_path / 'fastapi.log')
+        logging.config.dictConfig(log_config(log_file_path=path, log_handlers=['file'], log_formatter='json', multiprocess_mode='per_worker'))
+        try:
+            logging.getLogger('uvicorn').info('from this worker')
+        finally:
+            logging.config.dictConfig({'version': 1, 'disable_existing_loggers': False})
+        (tmp_path / 'fastapi.1234.log.1').write_text(format_lines(START, 1))
+        (tmp_path / 'fastapi.debug.log').write_text(format_lines(START, 1))
+        (tmp_path / 'fastapi.debug.1234.log.2.gz').touch()
+        (tmp_path / 'fastapi.1234.log.tmp').touch()
+        (tmp_path / 'fastapi.txt').touch()
+
+        names = [os.path.basename(segment) for segment in find_segments(path)]
+        assert names == sorted([f'fastapi.{os.getpid()}.log', 'fastapi.1234.log.1', 'fastapi.debug.log', 'fastapi.debug.1234.log.2.gz'])
+        assert 'from this worker' in [record['message'] for record in query(path)]
+
+    def test_find_segments_requires_rotation_suffix(self, tmp_path):
+        segments = ['app', 'app.1', 'app.4711', 'app.debug', 'app.debug.4711.2', 'app.2024-05-01.gz', 'app.2024-05-01_12-30']
+        for name in (*segments, 'app.py', 'app.cfg', 'app.sock', 'app.1.tmp', 'app.log', 'application'):
+            (tmp_path / name).touch()
+        assert [os.path.basename(segment) for segment in find_segments(str(tmp_path / 'app'))] == sorted(segments)
+
+    def test_files_are_ordered_by_first_record(self, log_file):
+        indexes = index_logs(log_file, workers=1)
+        assert [os.path.basename(path) for path in indexes] == ['fastapi.log.2.gz', 'fastapi.log.1', 'fastapi.log']
+
+    def test_blocks(self, log_file):
+        index = index_segment(log_file, block_bytes=BLOCK_BYTES)
+        blocks = index['blocks']
+        assert len(blocks) > 1
+        assert sum(block['lines'] for block in blocks) == LINES
+        assert blocks[0]['offset'] == 0
+        assert all(block['offset'] + block['length'] == after['offset'] for block, after in itertools.pairwise(blocks))
+        assert blocks[-1]['offset'] + blocks[-1]['length'] == index['end'] == os.path.getsize(log_file)
+        assert blocks[0]['start'] == START + 2 * LINES
+        assert blocks[0]['levels'] == ['ERROR', 'INFO']
+        assert blocks[0]['loggers'] == ['app.db', 'tunsberg.access']
+        assert os.path.dirname(index_path(log_file)).endswith(INDEX_DIRECTORY)
+
+    def test_saved_index_is_reused(self, log_file, monkeypatch):
+        index = index_segment(log_file)
+        with open(index_path(log_file)) as f:
+            assert json.load(f) == index
+        monkeypatch.setattr('tunsberg.logquery._index_lines', None)
+        assert index_segment(log_file) == index
+
+    def test_appended_lines_extend_index(self, log_file, monkeypatch):
+        index = index_segment(log_file, block_bytes=BLOCK_BYTES)
+        with open(log_file, 'a') as f:
+            f.write(format_lines(START + 3 * LINES, 10))
+            f.write('{"timestamp": "incomplete')
+        offsets = []
+        original = logquery._index_lines
+
+        def spy(f, offset, size, block_bytes):
+            offsets.append(offset)
+            return original(f, offset, size, block_bytes)
+
+        monkeypatch.setattr('tunsberg.logquery._index_lines', spy)
+        extended = index_segment(log_file, block_bytes=BLOCK_BYTES)
+        assert offsets == [index['end']]
+        assert extended['blocks'][: len(index['blocks'])] == index['blocks']
+        assert sum(block['lines'] for block in extended['blocks']) == LINES + 10
+        assert extended['end'] == os.path.getsize(log_file) - len('{"timestamp": "incomplete')
+
+    def test_rotated_file_is_indexed_again(self, log_file):
+        index_segment(log_file)
+        os.replace(log_file, f'{log_file}.3')
+        with open(log_file, 'w') as f:
+            f.write(format_lines(START + 5 * LINES, 2 * LINES))
+        assert sum(block['lines'] for block in index_segment(log_file)['blocks']) == 2 * LINES
+
+    def test_unwritable_index_directory(self, log_file, tmp_path):
+        (tmp_path / 'blocked').write_text('')
+        index = index_segment(log_file, index_dir=str(tmp_path / 'blocked'))
+        assert sum(block['lines'] for block in index['blocks']) == LINES
+
+    def test_lines_not_written_by_json_formatter(self, tmp_path):
+        path = tmp_path / 'mixed.log'
+        path.write_text('plain text\n[1, 2]\n' + format_lines(START, 1))
+        block = index_segment(str(path))['blocks'][0]
+        assert block['lines'] == 3  # noqa: PLR2004
+        assert block['start'] == block['end'] == START
+        assert len(query(str(path))) == 1
+
+    def test_bloom_filter(self):
+        keys = {f'request-{i}' for i in range(1000)}
+        bloom = _bloom(keys)
+        assert all(_bloom_contains(bloom, key) for key in keys)
+        assert sum(_bloom_contains(bloom, f'other-{i}') for i in range(1000)) < 50  # noqa: PLR2004
+        assert _bloom(set()) is None
+        assert not _bloom_contains(None, 'request-1')
+
+
+class TestQuery:
+    def test_time_range_across_files(self, log_file):
+        records = query(log_file, since=START + LINES - 5, until=START + LINES + 5)
+        assert [record['message'] for record in records] == [f'message {i}' for i in range(LINES - 5, LINES)] + [f'message {i}' for i in range(5)]
+
+    def test_level_is_minimum(self, log_file):
+        records = query(log_file, level='warning')
+        assert len(records) == 3 * LINES // 50
+        assert {record['level'] for record in records} == {'ERROR'}
+        assert query(log_file, level=logging.CRITICAL) == []
+
+    def test_logger_includes_children(self, log_file):
+        assert len(query(log_file, logger='tunsberg')) == 3 * LINES // 2
+        assert query(log_file, logger='tunsberg.acc') == []
+
+    def test_request_id(self, log_file):
+        request_id = f'request-{START + LINES}-42'
+        records = query(log_file, request_id=request_id)
+        assert [record['request_id'] for record in records] == [request_id]
+
+    def test_fields_and_limit(self, log_file):
+        records = query(log_file, fields={'status': 500}, logger='app.db', limit=4)
+        assert [record['timestamp'] for record in records] == [datetime.fromtimestamp(START + i * 50, UTC).isoformat() for i in range(4)]
+        assert query(log_file, fields={'status': '500'}) == []
+
+    def test_list_of_files(self, log_file):
+        assert len(query([log_file], since=START)) == LINES
+
+    def test_parallel(self, log_file):
+        expected = query(log_file, level='ERROR')
+        assert list(query_logs(log_file, level='ERROR', workers=2)) == expected
+
+    def test_unknown_level(self, log_file):
+        with pytest.raises(ValueError, match='Unknown log level'):
+            query(log_file, level='LOUD')
+
+    def test_parse_time(self, monkeypatch):
+        monkeypatch.setattr('tunsberg.logquery.time', lambda: 10_000.0)
+        assert parse_time(None) is None
+        assert parse_time(START) == START
+        assert parse_time('2023-11-14T22:13:20') == START
+        assert parse_time('2023-11-15T00:13:20+02:00') == START
+        assert parse_time(datetime.fromtimestamp(START, UTC)) == START
+        assert parse_time('15m') == 10_000 - 900
+        assert parse_time('1.5h') == 10_000 - 5400
+
+
+class TestMain:
+    def test_prints_matching_records(self, log_file, capsys):
+        main([log_file, '--since', '2023-11-14T22:13:20', '--until', '2023-11-14T22:13:22', '--workers', '1'])
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)['message'] for line in lines] == ['message 0', 'message 1']
+
+    def test_count_with_fields(self, log_file, capsys):
+        main([log_file, '--field', 'status=500', '--count', '--workers', '1'])
+        assert capsys.readouterr().out == f'{3 * LINES // 50}\n'
+
+    def test_reindex(self, log_file, capsys):
+        main([log_file, '--reindex', '--workers', '1'])
+        assert capsys.readouterr().out.splitlines()[0].endswith(f'fastapi.log.2.gz: {LINES} lines in 1 blocks')
+
+    @pytest.mark.parametrize('arguments', [['--field', 'status'], ['--level', 'LOUD']])
+    def test_invalid_arguments(self, log_file, arguments):
+        with pytest.raises(SystemExit):
+            main([log_file, '--workers', '1', *arguments])
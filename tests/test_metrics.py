@@ -0,0 +1,209 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+
+import pytest
+from fastapi import FastAPI
+from starlette import status
+
+from tests.helpers import run_app
+from tunsberg.metrics import DURATION_BUCKETS, OVERFLOW_ROUTE, UNMATCHED_ROUTE, MetricsMiddleware, MetricsRegistry
+
+
+def bucket_counts(registry, key):
+    """Return the bucket counts of a series"""
+    return registry.collect()[key][3]
+
+
+def observe_in_child(registry):
+    """Record a request in a forked worker"""
+    registry.observe('GET', '/items/{item_id}', status.HTTP_200_OK, 10, 1_000_000)
+
+
+def request(app, path, method='GET'):
+    """Send a request without a body to an ASGI app and return the status, headers and body"""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', b'testserver')],
+        'server': ('testserver', 80),
+    }
+    messages = asyncio.run(run_app(app, scope))
+    start = messages[0]
+    return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in messages[1:])
+
+
+class TestMetricsRegistry:
+    def test_collects_counts_bytes_and_durations(self):
+        registry = MetricsRegistry()
+        registry.observe('GET', '/items', status.HTTP_200_OK, 100, 2_000_000)
+        registry.observe('GET', '/items', status.HTTP_200_OK, 50, 3_000_000)
+        registry.observe('POST', '/items', status.HTTP_201_CREATED, 10, 1_000)
+
+        totals = registry.collect()
+        count, nbytes, duration_ns, buckets = totals['GET', '/items', status.HTTP_200_OK]
+        assert (count, nbytes, duration_ns) == (2, 150, 5_000_000)
+        assert sum(buckets) == count
+        assert totals['POST', '/items', status.HTTP_201_CREATED][:3] == (1, 10, 1_000)
+
+    def test_empty_registry(self):
+        assert MetricsRegistry().collect() == {}
+
+    @pytest.mark.parametrize('duration_ns', [0, 1, 16_383, 16_384, 24_575, 24_576, 999_999, 1_000_000, 3_141_592_653, 68_719_476_735])
+    def test_durations_land_in_the_right_bucket(self, duration_ns):
+        registry = MetricsRegistry()
+        registry.observe('GET', '/', status.HTTP_200_OK, 0, duration_ns)
+        index = bucket_counts(registry, ('GET', '/', status.HTTP_200_OK)).index(1)
+        seconds = duration_ns / 1e9
+        assert seconds < DURATION_BUCKETS[index]
+        if index:
+            assert seconds >= DURATION_BUCKETS[index - 1]
+
+    def test_slow_requests_only_count_towards_inf(self):
+        registry = MetricsRegistry()
+        registry.observe('GET', '/', status.HTTP_200_OK, 0, 100 * 10**9)
+        buckets = bucket_counts(registry, ('GET', '/', status.HTTP_200_OK))
+        assert len(buckets) == len(DURATION_BUCKETS) + 1
+        assert buckets[-1] == 1
+
+    def test_buckets_grow_log_linearly(self):
+        ratios = [upper / lower for lower, upper in itertools.pairwise(DURATION_BUCKETS)]
+        assert all(1.3 <= ratio <= 1.5 for ratio in ratios)  # noqa: PLR2004
+
+    def test_series_beyond_max_series_overflow(self):
+        registry = MetricsRegistry(max_series=3)
+        for i in range(5):
+            registry.observe('GET', f'/route/{i}', status.HTTP_200_OK, 1, 1_000)
+
+        totals = registry.collect()
+        assert set(totals) == {
+            ('GET', '/route/0', status.HTTP_200_OK),
+            ('GET', '/route/1', status.HTTP_200_OK),
+            ('', OVERFLOW_ROUTE, 0),
+        }
+        assert totals['', OVERFLOW_ROUTE, 0][0] == len(['/route/2', '/route/3', '/route/4'])
+
+    def test_long_routes_are_truncated(self):
+        registry = MetricsRegistry()
+        registry.observe('GET', '/' + 'x' * 500, status.HTTP_200_OK, 1, 1_000)
+        ((method, route, code),) = registry.collect()
+        assert (method, code) == ('GET', status.HTTP_200_OK)
+        assert route.startswith('/xxx')
+
+    def test_invalid_max_series(self):
+        with pytest.raises(ValueError, match='max_series'):
+            MetricsRegistry(max_series=0)
+
+    def test_aggregates_workers_through_directory(self, tmp_path):
+        registry = MetricsRegistry(str(tmp_path))
+        registry.observe('GET', '/items/{item_id}', status.HTTP_200_OK, 10, 1_000_000)
+
+        context = multiprocessing.get_context('fork')
+        for _ in range(2):
+            worker = context.Process(target=observe_in_child, args=(registry,))
+            worker.start()
+            worker.join()
+            assert worker.exitcode == 0
+
+        assert len(list(tmp_path.glob('metrics.*.bin'))) == len(['parent', 'child', 'child'])
+        assert registry.path == str(tmp_path / f'metrics.{os.getpid()}.bin')
+        count, nbytes, duration_ns, _ = registry.collect()['GET', '/items/{item_id}', status.HTTP_200_OK]
+        assert (count, nbytes, duration_ns) == (3, 30, 3_000_000)
+
+    def test_skips_foreign_files(self, tmp_path):
+        (tmp_path / 'metrics.1.bin').write_bytes(b'not metrics')
+        (tmp_path / 'metrics.2.bin').write_bytes(b'')
+        registry = MetricsRegistry(str(tmp_path))
+        registry.observe('GET', '/', status.HTTP_200_OK, 1, 1_000)
+        assert list(registry.collect()) == [('GET', '/', status.HTTP_200_OK)]
+
+    def test_render_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.observe('GET', '/items/"quoted"', status.HTTP_200_OK, 100, 20_000)
+        registry.observe('GET', '/items/"quoted"', status.HTTP_200_OK, 50, 2_000_000)
+
+        text = registry.render().decode()
+        labels = 'method="GET",route="/items/\\"quoted\\"",status="200"'
+        assert f'tunsberg_http_requests_total{{{labels}}} 2\n' in text
+        assert f'tunsberg_http_response_bytes_total{{{labels}}} 150\n' in text
+        assert f'tunsberg_http_request_duration_seconds_bucket{{{labels},le="1.6384e-05"}} 0\n' in text
+        assert f'tunsberg_http_request_duration_seconds_bucket{{{labels},le="2.4576e-05"}} 1\n' in text
+        assert f'tunsberg_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2\n' in text
+        assert f'tunsberg_http_request_duration_seconds_sum{{{labels}}} 0.00202\n' in text
+        assert f'tunsberg_http_request_duration_seconds_count{{{labels}}} 2\n' in text
+        assert '# TYPE tunsberg_http_request_duration_seconds histogram\n' in text
+
+    def test_render_prefix(self):
+        registry = MetricsRegistry()
+        registry.observe('GET', '/', status.HTTP_200_OK, 1, 1_000)
+        assert b'app_requests_total{' in registry.render(prefix='app')
+
+
+class TestMetricsMiddleware:
+    def make_app(self, registry, **kwargs):
+        app = FastAPI()
+
+        @app.get('/items/{item_id}')
+        def get_item(item_id: int):
+            return {'item_id': item_id}
+
+        return MetricsMiddleware(app, registry=registry, **kwargs)
+
+    def test_records_route_templates(self):
+        registry = MetricsRegistry()
+        app = self.make_app(registry)
+        for path in ('/items/1', '/items/2', '/missing'):
+            request(app, path)
+
+        totals = registry.collect()
+        count, nbytes, _, _ = totals['GET', '/items/{item_id}', status.HTTP_200_OK]
+        assert count == len(['/items/1', '/items/2'])
+        assert nbytes == len(b'{"item_id":1}') * count
+        assert totals['GET', UNMATCHED_ROUTE, status.HTTP_404_NOT_FOUND][0] == 1
+
+    def test_serves_metrics(self):
+        registry = MetricsRegistry()
+        app = self.make_app(registry)
+        request(app, '/items/1')
+
+        code, headers, body = request(app, '/metrics')
+        assert code == status.HTTP_200_OK
+        assert headers[b'content-type'].startswith(b'text/plain; version=0.0.4')
+        assert int(headers[b'content-length']) == len(body)
+        assert b'route="/items/{item_id}"' in body
+        assert b'route="/metrics"' not in body
+        assert request(app, '/metrics', method='HEAD')[2] == b''
+
+    def test_metrics_path_disabled(self):
+        app = self.make_app(MetricsRegistry(), metrics_path=None)
+        assert request(app, '/metrics')[0] == status.HTTP_404_NOT_FOUND
+
+    def test_records_failed_requests(self):
+        async def failing_app(scope, receive, send):
+            raise RuntimeError('boom')
+
+        registry = MetricsRegistry()
+        app = MetricsMiddleware(failing_app, registry=registry)
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'headers': []}
+        with pytest.raises(RuntimeError):
+            asyncio.run(app(scope, None, None))
+        assert registry.collect()['GET', UNMATCHED_ROUTE, status.HTTP_500_INTERNAL_SERVER_ERROR][0] == 1
+
+    def test_ignores_other_scopes(self):
+        calls = []
+
+        async def lifespan_app(scope, receive, send):
+            calls.append(scope['type'])
+
+        registry = MetricsRegistry()
+        asyncio.run(MetricsMiddleware(lifespan_app, registry=registry)({'type': 'lifespan'}, None, None))
+        assert calls == ['lifespan']
+        assert registry.collect() == {}
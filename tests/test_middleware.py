@@ -0,0 +1,135 @@
+import asyncio
+import contextlib
+import logging
+
+from starlette import status
+
+from tests.helpers import CollectingHandler, make_scope, run_app
+from tunsberg.middleware import AccessLogMiddleware, RequestContextFilter, get_request_id, request_context
+
+
+async def hello_app(scope, receive, send):
+    """Log the request ID and respond with 201 and a short body"""
+    logging.getLogger('tests.app').info('handling %s', get_request_id())
+    await send({'type': 'http.response.start', 'status': status.HTTP_201_CREATED, 'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b'hello'})
+
+
+class TestAccessLogMiddleware:
+    def setup_method(self):
+        self.collector = CollectingHandler()
+        self.logger = logging.getLogger('tests.access')
+        self.logger.addHandler(self.collector)
+        self.logger.setLevel(logging.INFO)
+
+    def teardown_method(self):
+        self.logger.removeHandler(self.collector)
+
+    def test_logs_one_structured_record_per_request(self):
+        app = AccessLogMiddleware(hello_app, logger_name='tests.access')
+        messages = asyncio.run(run_app(app, make_scope()))
+
+        assert len(self.collector.records) == 1
+        record = self.collector.records[0]
+        assert record.extra_fields['method'] == 'GET'
+        assert record.extra_fields['path'] == '/items'
+        assert record.extra_fields['status'] == status.HTTP_201_CREATED
+        assert record.extra_fields['bytes'] == len(b'hello')
+        assert record.extra_fields['duration_ms'] >= 0
+        assert record.getMessage().startswith('GET /items 201 5B ')
+        request_ids = [value for name, value in messages[0]['headers'] if name == b'x-request-id']
+        assert len(request_ids) == 1
+        assert len(request_ids[0]) == len(b'0123456789abcdef')
+
+    def test_reuses_request_id_from_header(self):
+        app = AccessLogMiddleware(hello_app, logger_name='tests.access')
+        messages = asyncio.run(run_app(app, make_scope(headers=[(b'x-request-id', b'abc123')])))
+        assert (b'x-request-id', b'abc123') in messages[0]['headers']
+
+    def test_ignores_request_id_from_header_when_not_trusted(self):
+        app = AccessLogMiddleware(hello_app, logger_name='tests.access', trust_header=False)
+        messages = asyncio.run(run_app(app, make_scope(headers=[(b'x-request-id', b'abc123')])))
+        request_ids = [value for name, value in messages[0]['headers'] if name == b'x-request-id']
+        assert request_ids
+        assert request_ids != [b'abc123']
+
+    def test_replaces_invalid_request_id_from_header(self):
+        app = AccessLogMiddleware(hello_app, logger_name='tests.access')
+        for invalid in (b'a' * 129, b'abc\r\nx-injected: 1', b'abc def', b'{"a": 1}', '\u00e6'.encode('latin-1')):
+            messages = asyncio.run(run_app(app, make_scope(headers=[(b'x-request-id', invalid)])))
+            request_ids = [value for name, value in messages[0]['headers'] if name == b'x-request-id']
+            assert len(request_ids[0]) == len(b'0123456789abcdef')
+
+    def test_accepts_request_id_of_maximum_length(self):
+        request_id = b'A-z_0.9' + b'a' * 121
+        app = AccessLogMiddleware(hello_app, logger_name='tests.access')
+        messages = asyncio.run(run_app(app, make_scope(headers=[(b'x-request-id', request_id)])))
+        assert (b'x-request-id', request_id) in messages[0]['headers']
+
+    def test_replaces_request_id_header_set_by_the_app(self):
+        async def app_with_request_id(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': status.HTTP_200_OK, 'headers': [(b'X-Request-ID', b'from-app')]})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        app = AccessLogMiddleware(app_with_request_id, logger_name='tests.access')
+        messages = asyncio.run(run_app(app, make_scope(headers=[(b'x-request-id', b'abc123')])))
+        assert [(name, value) for name, value in messages[0]['headers'] if name.lower() == b'x-request-id'] == [(b'x-request-id', b'abc123')]
+
+    def test_request_id_is_available_inside_the_app(self):
+        app_logger = logging.getLogger('tests.app')
+        app_logger.addHandler(self.collector)
+        try:
+            app = AccessLogMiddleware(hello_app, logger_name='tests.access')
+            asyncio.run(run_app(app, make_scope(headers=[(b'x-request-id', b'abc123')])))
+        finally:
+            app_logger.removeHandler(self.collector)
+        assert self.collector.records[0].getMessage() == 'handling abc123'
+        assert request_context.get() is None
+
+    def test_logs_status_500_when_app_raises(self):
+        async def failing_app(scope, receive, send):
+            raise RuntimeError('boom')
+
+        app = AccessLogMiddleware(failing_app, logger_name='tests.access')
+        with contextlib.suppress(RuntimeError):
+            asyncio.run(run_app(app, make_scope()))
+        assert self.collector.records[0].extra_fields['status'] == status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    def test_skips_logging_when_disabled(self):
+        self.logger.setLevel(logging.WARNING)
+        app = AccessLogMiddleware(hello_app, logger_name='tests.access')
+        asyncio.run(run_app(app, make_scope()))
+        assert not self.collector.records
+
+    def test_passes_through_non_http_scopes(self):
+        seen = []
+
+        async def lifespan_app(scope, receive, send):
+            seen.append(scope['type'])
+
+        app = AccessLogMiddleware(lifespan_app, logger_name='tests.access')
+        asyncio.run(app({'type': 'lifespan'}, None, None))
+        assert seen == ['lifespan']
+        assert not self.collector.records
+
+
+class TestRequestContextFilter:
+    def test_adds_request_id_from_context(self):
+        record = logging.LogRecord('test', logging.INFO, 'x.py', 1, 'msg', (), None)
+
+        async def app(scope, receive, send):
+            RequestContextFilter().filter(record)
+
+        asyncio.run(run_app(AccessLogMiddleware(app, logger_name='tests.filter'), make_scope(headers=[(b'x-request-id', b'abc')])))
+        assert record.request_id == 'abc'
+
+    def test_keeps_existing_request_id(self):
+        record = logging.LogRecord('test', logging.INFO, 'x.py', 1, 'msg', (), None)
+        record.request_id = 'existing'
+        assert RequestContextFilter().filter(record)
+        assert record.request_id == 'existing'
+
+    def test_outside_request(self):
+        record = logging.LogRecord('test', logging.INFO, 'x.py', 1, 'msg', (), None)
+        RequestContextFilter().filter(record)
+        assert record.request_id is None
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import time
+
+import pytest
+from starlette import status
+
+from tests.helpers import CollectingHandler, make_scope, run_app
+from tunsberg.konfig import JsonFormatter
+from tunsberg.profiling import PROFILER_LOGGER, ProfilingMiddleware, SamplingProfiler
+
+
+def spin(seconds):
+    """Keep the CPU busy"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def wait_for_database(seconds):
+    """Stand in for awaiting I/O"""
+    await asyncio.sleep(seconds)
+
+
+async def busy_app(scope, receive, send):
+    """Spend some time on the CPU and some time waiting"""
+    spin(0.1)
+    await wait_for_database(0.1)
+    await send({'type': 'http.response.start', 'status': status.HTTP_200_OK, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+async def fast_app(scope, receive, send):
+    """Respond straight away"""
+    await send({'type': 'http.response.start', 'status': status.HTTP_200_OK, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+class TestProfilingMiddleware:
+    def setup_method(self):
+        self.collector = CollectingHandler()
+        self.logger = logging.getLogger(PROFILER_LOGGER)
+        self.logger.addHandler(self.collector)
+        self.logger.setLevel(logging.INFO)
+        self.profilers = []
+
+    def teardown_method(self):
+        self.logger.removeHandler(self.collector)
+        for profiler in self.profilers:
+            profiler.stop()
+
+    def make_profiler(self, **kwargs):
+        kwargs.setdefault('interval', 0.002)
+        kwargs.setdefault('max_overhead', 0.5)
+        profiler = SamplingProfiler(**kwargs)
+        self.profilers.append(profiler)
+        return profiler
+
+    def test_sampled_request_summary(self):
+        profiler = self.make_profiler(sample_rate=1.0, slow_threshold=None)
+        asyncio.run(run_app(ProfilingMiddleware(busy_app, profiler=profiler), make_scope()))
+
+        assert len(self.collector.records) == 1
+        record = self.collector.records[0]
+        assert record.levelno == logging.INFO
+        fields = record.extra_fields
+        assert fields['reason'] == 'sampled'
+        assert fields['method'] == 'GET'
+        assert fields['path'] == '/items'
+        assert fields['samples'] > 0
+        assert fields['duration_ms'] >= 200  # noqa: PLR2004
+        functions = {entry['function']: entry for entry in fields['top']}
+        assert functions['spin']['self'] > 0
+        assert functions['sleep']['self'] > 0
+        assert functions['wait_for_database']['total'] >= functions['sleep']['self']
+        assert functions['busy_app']['total'] >= functions['spin']['total']
+        assert 'ProfilingMiddleware.__call__' not in functions
+        assert all(entry['file'].endswith('.py') and entry['line'] > 0 for entry in fields['top'])
+
+    def test_slow_request_is_profiled_after_threshold(self):
+        profiler = self.make_profiler(slow_threshold=0.05)
+        asyncio.run(run_app(ProfilingMiddleware(busy_app, profiler=profiler), make_scope()))
+
+        assert len(self.collector.records) == 1
+        record = self.collector.records[0]
+        assert record.levelno == logging.WARNING
+        assert record.extra_fields['reason'] == 'slow'
+
+    def test_fast_request_is_not_logged(self):
+        profiler = self.make_profiler(slow_threshold=0.05)
+        asyncio.run(run_app(ProfilingMiddleware(fast_app, profiler=profiler), make_scope()))
+        assert self.collector.records == []
+        assert profiler._sessions == {}
+
+    def test_disabled_at_runtime(self):
+        profiler = self.make_profiler(sample_rate=1.0)
+        app = ProfilingMiddleware(busy_app, profiler=profiler)
+        profiler.enabled = False
+        asyncio.run(run_app(app, make_scope()))
+        assert self.collector.records == []
+        assert profiler._thread is None
+
+    def test_nothing_to_profile(self):
+        profiler = self.make_profiler(sample_rate=0.0, slow_threshold=None)
+        asyncio.run(run_app(ProfilingMiddleware(busy_app, profiler=profiler), make_scope()))
+        assert self.collector.records == []
+        assert profiler._thread is None
+
+    def test_top_limits_summary(self):
+        profiler = self.make_profiler(sample_rate=1.0, slow_threshold=None, top=1)
+        asyncio.run(run_app(ProfilingMiddleware(busy_app, profiler=profiler), make_scope()))
+        assert len(self.collector.records[0].extra_fields['top']) == 1
+
+    def test_max_sessions_limits_concurrent_profiling(self):
+        profiler = self.make_profiler(sample_rate=1.0, slow_threshold=None, max_sessions=1)
+        app = ProfilingMiddleware(busy_app, profiler=profiler)
+
+        async def concurrent():
+            await asyncio.gather(run_app(app, make_scope('/a')), run_app(app, make_scope('/b')))
+
+        asyncio.run(concurrent())
+        assert [record.extra_fields['path'] for record in self.collector.records] == ['/a']
+
+    def test_running_task_is_attributed_to_its_own_request(self):
+        profiler = self.make_profiler(sample_rate=1.0, slow_threshold=None, max_sessions=2)
+
+        async def routed_app(scope, receive, send):
+            if scope['path'] == '/cpu':
+                spin(0.2)
+            else:
+                await wait_for_database(0.3)
+            await fast_app(scope, receive, send)
+
+        app = ProfilingMiddleware(routed_app, profiler=profiler)
+
+        async def concurrent():
+            await asyncio.gather(run_app(app, make_scope('/wait')), run_app(app, make_scope('/cpu')))
+
+        asyncio.run(concurrent())
+        tops = {record.extra_fields['path']: {entry['function'] for entry in record.extra_fields['top']} for record in self.collector.records}
+        assert 'spin' in tops['/cpu']
+        assert 'wait_for_database' not in tops['/cpu']
+        assert 'wait_for_database' in tops['/wait']
+        assert 'spin' not in tops['/wait']
+
+    def test_summary_through_json_formatter(self):
+        profiler = self.make_profiler(sample_rate=1.0, slow_threshold=None)
+        asyncio.run(run_app(ProfilingMiddleware(busy_app, profiler=profiler), make_scope()))
+        payload = json.loads(JsonFormatter().format(self.collector.records[0]))
+        assert payload['logger'] == PROFILER_LOGGER
+        assert payload['reason'] == 'sampled'
+        assert payload['top'][0].keys() == {'function', 'file', 'line', 'self', 'total'}
+
+    def test_ignores_other_scopes(self):
+        calls = []
+
+        async def lifespan_app(scope, receive, send):
+            calls.append(scope['type'])
+
+        profiler = self.make_profiler(sample_rate=1.0)
+        asyncio.run(ProfilingMiddleware(lifespan_app, profiler=profiler)({'type': 'lifespan'}, None, None))
+        assert calls == ['lifespan']
+
+    def test_creates_profiler_from_arguments(self):
+        app = ProfilingMiddleware(fast_app, sample_rate=0.5, slow_threshold=2.0)
+        assert app.profiler.sample_rate == 0.5  # noqa: PLR2004
+        assert app.profiler.slow_threshold == 2.0  # noqa: PLR2004
+
+
+class TestSamplingProfiler:
+    def test_overhead_cap_stretches_delay(self):
+        profiler = SamplingProfiler(max_overhead=0.01)
+        assert profiler.next_delay(0.005, 0.00001) == 0.005  # noqa: PLR2004
+        assert profiler.next_delay(0.005, 0.001) == pytest.approx(0.099)
+        assert profiler.next_delay(None, 0.001) is None
+
+    def test_invalid_max_overhead(self):
+        with pytest.raises(ValueError, match='max_overhead'):
+            SamplingProfiler(max_overhead=0)
+
+    def test_end_without_session(self):
+        assert SamplingProfiler().end(None) is None
+
+    def test_sample_without_sessions(self):
+        assert SamplingProfiler().sample(time.perf_counter()) is None
+
+    def test_stop(self):
+        profiler = SamplingProfiler()
+        profiler.start()
+        profiler.stop()
+        assert profiler._thread is None
+        profiler.stop()
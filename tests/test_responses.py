@@ -1,7 +1,13 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
 from fastapi_pagination import Page
 from starlette import status
 
+from tunsberg.encoding import MSGPACK_MEDIA_TYPE, decode_msgpack, response_media_type
 from tunsberg.responses import (
+    ExceptionResponses,
     ResponseModel,
     generate_json_response,
     response_bad_request,
@@ -307,3 +313,110 @@ class TestResponseCustom:
         response = response_custom(data={'key': 'value'})
         assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
         assert response.body == b'{"status_code":500,"message":"An unknown error has occurred","data":{"key":"value"}}'
+
+
+class VehicleError(Exception):
+    pass
+
+
+class VehicleNotFoundError(VehicleError, LookupError):
+    pass
+
+
+class VehicleExistsError(VehicleError):
+    pass
+
+
+class TestExceptionResponses:
+    def setup_method(self):
+        self.registry = ExceptionResponses()
+        self.registry.register(VehicleError, status_code=status.HTTP_400_BAD_REQUEST)
+        self.registry.register(LookupError, response_not_found, message='Vehicle not found')
+        self.registry.register(VehicleExistsError, response_conflict, expose_message=True)
+
+    def test_dynamic_message(self):
+        response = self.registry.response_for(VehicleExistsError('Vehicle AB12345 already exists'))
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.body == b'{"status_code":409,"message":"Vehicle AB12345 already exists"}'
+
+    def test_default_message_of_helper(self):
+        response = self.registry.response_for(VehicleExistsError())
+        assert response.body == b'{"status_code":409,"message":"Resource already exists"}'
+
+    def test_status_code(self):
+        response = self.registry.response_for(VehicleError('Invalid wheel count'))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.body == b'{"status_code":400,"message":"An unknown error has occurred"}'
+
+    def test_exception_text_is_not_exposed_by_default(self):
+        self.registry.register(ConnectionError, response_service_unavailable)
+        response = self.registry.response_for(ConnectionError('connect to 10.0.0.5:5432 failed for user admin'))
+        assert response.body == b'{"status_code":503,"message":"Service unavailable"}'
+        assert self.registry.response_for(ConnectionError('other')).body is response.body
+
+    def test_exposed_message_falls_back_to_registered_message(self):
+        self.registry.register(VehicleExistsError, response_conflict, message='Vehicle exists', expose_message=True)
+        assert self.registry.response_for(VehicleExistsError()).body == b'{"status_code":409,"message":"Vehicle exists"}'
+
+    def test_closest_base_class_in_mro(self):
+        # VehicleError comes before LookupError in the MRO of VehicleNotFoundError
+        assert self.registry.response_for(VehicleNotFoundError()).status_code == status.HTTP_400_BAD_REQUEST
+        assert self.registry.response_for(KeyError('key')).status_code == status.HTTP_404_NOT_FOUND
+
+    def test_unregistered_exception(self):
+        assert self.registry.response_for(ValueError()) is None
+
+    def test_fixed_message_body_is_reused(self):
+        first = self.registry.response_for(KeyError('one'))
+        second = self.registry.response_for(IndexError('two'))
+        assert second is not first
+        assert second.body is first.body
+        assert second.body == b'{"status_code":404,"message":"Vehicle not found"}'
+        assert second.headers['content-type'] == 'application/json'
+        assert second.headers['content-length'] == str(len(first.body))
+
+    def test_fixed_message_body_per_media_type(self):
+        json_body = self.registry.response_for(KeyError()).body
+        token = response_media_type.set(MSGPACK_MEDIA_TYPE)
+        try:
+            responses = [self.registry.response_for(KeyError()) for _ in range(2)]
+        finally:
+            response_media_type.reset(token)
+        assert responses[1].media_type == MSGPACK_MEDIA_TYPE
+        assert decode_msgpack(responses[1].body) == {'status_code': 404, 'message': 'Vehicle not found'}
+        assert self.registry.response_for(KeyError()).body == json_body
+
+    def test_register_clears_cache(self):
+        assert self.registry.response_for(VehicleNotFoundError()).status_code == status.HTTP_400_BAD_REQUEST
+        self.registry.register(VehicleNotFoundError, response_not_found)
+        assert self.registry.response_for(VehicleNotFoundError()).status_code == status.HTTP_404_NOT_FOUND
+
+    def test_register_needs_helper_or_status_code(self):
+        with pytest.raises(ValueError, match='either'):
+            self.registry.register(ValueError)
+        with pytest.raises(ValueError, match='either'):
+            self.registry.register(ValueError, response_bad_request, status_code=status.HTTP_400_BAD_REQUEST)
+
+    def test_register_rejects_helper_without_message(self):
+        with pytest.raises(TypeError, match='response_no_content'):
+            self.registry.register(ValueError, response_no_content)
+
+        def invalid_wheels(message):
+            return response_bad_request(message, data={'field': 'wheels'})
+
+        # Without a message of its own the helper would be called without one
+        with pytest.raises(TypeError, match='invalid_wheels'):
+            self.registry.register(ValueError, invalid_wheels)
+        self.registry.register(ValueError, invalid_wheels, message='Invalid wheel count')
+        assert self.registry.response_for(ValueError()).status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_install(self):
+        app = FastAPI()
+        self.registry.install(app)
+        assert {VehicleError, LookupError, VehicleExistsError} <= app.exception_handlers.keys()
+        response = asyncio.run(app.exception_handlers[LookupError](None, KeyError()))
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_handle_reraises_unregistered_exception(self):
+        with pytest.raises(ValueError, match='unhandled'):
+            asyncio.run(self.registry.handle(None, ValueError('unhandled')))
@@ -0,0 +1,148 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from tests.helpers import CollectingHandler
+from tunsberg import responses
+from tunsberg.encoding import CBOR_MEDIA_TYPE, response_media_type
+from tunsberg.middleware import RequestContext, request_context
+from tunsberg.responses import response_created, response_success, set_serialization_recorder
+from tunsberg.serialization import OVERFLOW_ROUTE, SERIALIZATION_LOGGER, UNKNOWN_ROUTE, SerializationRecorder, data_shape
+
+RECORDS = {'items': [{'key': f'vehicle-{i}', 'tags': ['a', 'b', 'c']} for i in range(50)], 'total': 50}
+
+
+def in_route(path: str | None):
+    """Set a request context as AccessLogMiddleware does, with the route FastAPI puts in the scope"""
+    scope = {'route': SimpleNamespace(path=path)} if path is not None else {}
+    return request_context.set(RequestContext('request-id', 0.0, scope))
+
+
+class TestDataShape:
+    @pytest.mark.parametrize(
+        ('data', 'shape'),
+        [
+            (None, (0, 0)),
+            ('text', (0, 0)),
+            ({}, (0, 1)),
+            ([], (0, 1)),
+            ([1, 2, 3], (3, 1)),
+            ({'key': 'value'}, (0, 1)),
+            (RECORDS, (50, 4)),
+            ([[1, 2, 3, 4]], (4, 2)),
+        ],
+    )
+    def test_shape(self, data, shape):
+        assert data_shape(data) == shape
+
+
+class TestSerializationRecorder:
+    def setup_method(self):
+        self.calls = []
+        self.recorder = SerializationRecorder(callback=self.calls.append)
+        set_serialization_recorder(self.recorder)
+        self.collector = CollectingHandler()
+        self.logger = logging.getLogger(SERIALIZATION_LOGGER)
+        self.logger.addHandler(self.collector)
+        self.logger.setLevel(logging.INFO)
+
+    def teardown_method(self):
+        set_serialization_recorder(None)
+        self.logger.removeHandler(self.collector)
+        self.logger.setLevel(logging.NOTSET)
+
+    def test_records_every_call_of_the_response_helpers(self):
+        token = in_route('/vehicles')
+        try:
+            response = response_success(data=RECORDS)
+            response_created()
+        finally:
+            request_context.reset(token)
+
+        assert len(self.calls) == 2  # noqa: PLR2004
+        call = self.calls[0]
+        assert call['route'] == '/vehicles'
+        assert call['media_type'] == 'application/json'
+        assert call['bytes'] == len(response.body)
+        assert call['encode_ms'] >= 0
+        assert (call['items'], call['depth']) == (50, 4)
+        assert (self.calls[1]['items'], self.calls[1]['depth']) == (0, 0)
+
+        summary = self.recorder.summary()['/vehicles']
+        assert summary['calls'] == 2  # noqa: PLR2004
+        assert summary['bytes_total'] == len(response.body) + len(response_created().body)
+        assert summary['bytes_max'] == len(response.body)
+        assert summary['items_max'] == 50  # noqa: PLR2004
+        assert summary['depth_max'] == 4  # noqa: PLR2004
+        assert summary['encode_ms_max'] <= summary['encode_ms_total']
+
+    def test_negotiated_media_type(self):
+        token = response_media_type.set(CBOR_MEDIA_TYPE)
+        try:
+            response = response_success(data=RECORDS)
+        finally:
+            response_media_type.reset(token)
+        assert self.calls[0]['media_type'] == CBOR_MEDIA_TYPE
+        assert self.calls[0]['bytes'] == len(response.body)
+
+    def test_route_unknown_without_request_context(self):
+        response_success()
+        token = in_route(None)
+        try:
+            response_success()
+        finally:
+            request_context.reset(token)
+        assert [call['route'] for call in self.calls] == [UNKNOWN_ROUTE, UNKNOWN_ROUTE]
+
+    def test_warns_once_without_request_context(self):
+        response_success()
+        response_success()
+        warnings = [record for record in self.collector.records if 'AccessLogMiddleware' in record.getMessage()]
+        assert len(warnings) == 1
+        assert warnings[0].levelno == logging.WARNING
+
+    def test_routes_are_bounded(self):
+        recorder = SerializationRecorder(max_routes=2)
+        for route in ('/a', '/b', '/c', '/d', '/a'):
+            token = in_route(route)
+            try:
+                recorder.record(None, 10, 1000)
+            finally:
+                request_context.reset(token)
+        summary = recorder.summary()
+        assert set(summary) == {'/a', '/b', OVERFLOW_ROUTE}
+        assert summary['/a']['calls'] == summary[OVERFLOW_ROUTE]['calls'] == 2  # noqa: PLR2004
+
+    def test_logs_slow_and_large_calls(self):
+        recorder = SerializationRecorder(slow_threshold_ms=5, large_bytes=1000)
+        token = in_route('/vehicles')
+        try:
+            recorder.record(None, 10, 1_000_000)
+            recorder.record(None, 10, 6_000_000)
+            recorder.record(None, 2000, 1_000_000)
+        finally:
+            request_context.reset(token)
+        assert [(record.extra_fields['slow'], record.extra_fields['large']) for record in self.collector.records] == [(True, False), (False, True)]
+        assert self.collector.records[0].levelno == logging.WARNING
+        assert self.collector.records[0].extra_fields['encode_ms'] == 6  # noqa: PLR2004
+
+    def test_log_summary_slowest_first(self):
+        recorder = SerializationRecorder()
+        for route, duration_ns in (('/fast', 1000), ('/slow', 9000)):
+            token = in_route(route)
+            try:
+                recorder.record(None, 10, duration_ns)
+            finally:
+                request_context.reset(token)
+        summary = recorder.log_summary()
+        assert set(summary) == {'/fast', '/slow'}
+        assert [record.extra_fields['route'] for record in self.collector.records] == ['/slow', '/fast']
+        assert self.collector.records[0].levelno == logging.INFO
+
+    def test_disabled(self):
+        set_serialization_recorder(None)
+        response_success(data=RECORDS)
+        assert responses._serialization_recorder is None
+        assert self.calls == []
+        assert self.recorder.summary() == {}
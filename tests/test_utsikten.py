@@ -1,6 +1,36 @@
+import copy
+import itertools
+import pickle
+import shutil
+import subprocess
+
 import pytest
 
-from tunsberg.utsikten import format_version_tag
+from tunsberg.utsikten import (
+    Version,
+    VersionConstraint,
+    format_version_tag,
+    iter_git_tags,
+    latest_git_tag,
+    max_satisfying,
+    parse_versions,
+    sort_versions,
+)
+
+SEMVER_PRECEDENCE = [
+    '1.0.0-alpha',
+    '1.0.0-alpha.1',
+    '1.0.0-alpha.beta',
+    '1.0.0-beta',
+    '1.0.0-beta.2',
+    '1.0.0-beta.11',
+    '1.0.0-rc.1',
+    '1.0.0',
+    '1.0.1',
+    '1.1.0',
+    '2.0.0',
+    '10.0.0',
+]
 
 
 class TestFormatVersionTag:
@@ -63,3 +93,359 @@ class TestFormatVersionTag:
         # Act & Assert
         with pytest.raises(ValueError):
             format_version_tag(name)
+
+    def test_rejects_pre_release_versions(self):
+        """Rejects pre-release versions, which are valid semantic versions"""
+        # Arrange
+        name = '1.2.3-rc.1'
+
+        # Act & Assert
+        with pytest.raises(ValueError):
+            format_version_tag(name)
+
+    @pytest.mark.parametrize('name', ['1.2.3\n', ' 1.2.3', '1.2.3+build.5'])
+    def test_rejects_tag_names_that_are_not_release_versions(self, name):
+        """Rejects surrounding whitespace and build metadata"""
+        # Act & Assert
+        with pytest.raises(ValueError):
+            format_version_tag(name)
+
+    @pytest.mark.parametrize('name', ['01.2.3', '1.02.0', '1.2.03', '2024.01.5'])
+    def test_accepts_tag_names_with_leading_zeros(self, name):
+        """Accepts leading zeros and CalVer tags, which PEP 440 allows"""
+        # Act & Assert
+        assert format_version_tag(name) == name
+
+    @pytest.mark.parametrize('name', ['01.2.3', '1.02.0', '1.2.03', '2024.01.5'])
+    def test_strict_rejects_tag_names_with_leading_zeros(self, name):
+        """Rejects leading zeros like Version.parse when strict"""
+        # Act & Assert
+        with pytest.raises(ValueError):
+            format_version_tag(name, strict=True)
+
+    def test_strict_accepts_release_versions(self):
+        """Accepts semantic release versions when strict"""
+        # Act & Assert
+        assert format_version_tag('10.0.1', strict=True) == '10.0.1'
+
+    def test_caches_results(self):
+        """Caches results of repeated calls"""
+        # Arrange
+        format_version_tag.cache_clear()
+
+        # Act
+        format_version_tag('4.5.6')
+        format_version_tag('4.5.6')
+
+        # Assert
+        assert format_version_tag.cache_info().hits == 1
+
+
+class TestVersion:
+    def test_parses_all_parts(self):
+        """Parses major, minor, patch, pre-release and build metadata"""
+        # Act
+        version = Version.parse('1.22.333-rc.1+build.5.sha-abc')
+
+        # Assert
+        assert (version.major, version.minor, version.patch) == (1, 22, 333)
+        assert version.prerelease == ('rc', '1')
+        assert version.build == ('build', '5', 'sha-abc')
+        assert version.is_prerelease
+        assert str(version) == '1.22.333-rc.1+build.5.sha-abc'
+        assert repr(version) == "Version('1.22.333-rc.1+build.5.sha-abc')"
+
+    @pytest.mark.parametrize(
+        'text', ['1.2', '1.2.3.4', '01.2.3', '1.2.3-', '1.2.3-01', '1.2.3+', '1.2.3-rc..1', 'v1.2.3', ' 1.2.3', '1.2.3\n', '\u0661.\u0662.\u0663']
+    )
+    def test_rejects_invalid_versions(self, text):
+        """Rejects anything that is not a semantic version"""
+        # Act & Assert
+        with pytest.raises(ValueError, match='Invalid version'):
+            Version.parse(text)
+
+    def test_orders_by_precedence(self):
+        """Orders versions by semantic version precedence"""
+        # Arrange
+        versions = [Version.parse(text) for text in SEMVER_PRECEDENCE]
+
+        # Act & Assert
+        for lower, higher in itertools.pairwise(versions):
+            assert lower < higher
+            assert lower <= higher
+            assert higher > lower
+            assert higher >= lower
+            assert lower != higher
+
+    def test_build_metadata_does_not_affect_precedence(self):
+        """Ignores build metadata when ordering, but not for equality"""
+        # Arrange
+        first = Version.parse('1.0.0+build.1')
+        second = Version.parse('1.0.0+build.2')
+
+        # Act & Assert
+        assert not first < second
+        assert not second < first
+        assert first != second
+        assert first == Version(1, 0, 0, build=('build', '1'))
+        assert first.sort_key == second.sort_key
+
+    def test_is_hashable_and_immutable(self):
+        """Can be used in sets and cannot be changed"""
+        # Arrange
+        version = Version.parse('1.2.3')
+
+        # Act & Assert
+        assert {version, Version(1, 2, 3)} == {version}
+        with pytest.raises(AttributeError):
+            version.major = 2
+
+    def test_copies_and_pickles(self):
+        """Survives copy, deepcopy and a pickle round-trip"""
+        # Arrange
+        version = Version.parse('1.2.3-rc.1+build.5')
+
+        # Act & Assert
+        for copied in (copy.copy(version), copy.deepcopy(version), pickle.loads(pickle.dumps(version))):
+            assert copied == version
+            assert copied.sort_key == version.sort_key
+            assert str(copied) == '1.2.3-rc.1+build.5'
+
+    def test_does_not_compare_with_strings(self):
+        """Does not compare with other types"""
+        # Arrange
+        version = Version.parse('1.2.3')
+
+        # Act & Assert
+        assert version != '1.2.3'
+        with pytest.raises(TypeError):
+            version < '1.2.4'  # noqa: B015
+        with pytest.raises(TypeError):
+            version <= '1.2.4'  # noqa: B015
+        with pytest.raises(TypeError):
+            version > '1.2.4'  # noqa: B015
+        with pytest.raises(TypeError):
+            version >= '1.2.4'  # noqa: B015
+
+
+class TestParseVersions:
+    def test_validates_and_sorts_in_one_pass(self):
+        """Sorts valid tags and returns the invalid ones"""
+        # Arrange
+        tags = [*reversed(SEMVER_PRECEDENCE), 'latest', '1.2']
+
+        # Act
+        versions, invalid = parse_versions(tags)
+
+        # Assert
+        assert [str(version) for version in versions] == SEMVER_PRECEDENCE
+        assert invalid == ['latest', '1.2']
+
+    def test_strips_prefix(self):
+        """Only accepts tags with the prefix"""
+        # Act
+        versions, invalid = parse_versions(['v1.0.0', 'v0.9.0', '2.0.0'], prefix='v')
+
+        # Assert
+        assert versions == [Version(0, 9, 0), Version(1, 0, 0)]
+        assert invalid == ['2.0.0']
+
+    def test_sort_versions(self):
+        """Sorts from highest to lowest and leaves out invalid tags"""
+        # Act
+        versions = sort_versions(['1.0.0', 'nightly', '1.10.0', '1.9.0'], reverse=True)
+
+        # Assert
+        assert [str(version) for version in versions] == ['1.10.0', '1.9.0', '1.0.0']
+
+
+class TestVersionConstraint:
+    @pytest.mark.parametrize(
+        ('constraint', 'expected'),
+        [
+            ('>=1.2,<2', ['1.2.0', '1.2.9', '1.3.0', '1.9.9']),
+            ('>1.2.0, <=1.3.0', ['1.2.9', '1.3.0']),
+            ('==1.2', ['1.2.0', '1.2.9']),
+            ('1', ['1.2.0', '1.2.9', '1.3.0', '1.9.9']),
+            ('0', ['0.0.1', '0.2.3', '0.2.9', '0.3.0']),
+            ('=1.3.0', ['1.3.0']),
+            ('1.3.0', ['1.3.0']),
+            ('!=1.3.0,>=1.2.9,<2', ['1.2.9', '1.9.9']),
+            ('~1.2', ['1.2.0', '1.2.9']),
+            ('~1', ['1.2.0', '1.2.9', '1.3.0', '1.9.9']),
+            ('^1.2.3', ['1.2.9', '1.3.0', '1.9.9']),
+            ('^0.2.3', ['0.2.3', '0.2.9']),
+            ('^0.0.1', ['0.0.1']),
+            ('^0.0', ['0.0.1']),
+            ('*', ['0.0.1', '0.2.3', '0.2.9', '0.3.0', '1.2.0', '1.2.9', '1.3.0', '1.9.9', '2.0.0']),
+            ('>=v2.0.0-rc.1', ['2.0.0-rc.1', '2.0.0']),
+            ('<2.0.0-rc.2', ['0.0.1', '0.2.3', '0.2.9', '0.3.0', '1.2.0', '1.2.9', '1.3.0', '1.9.9', '2.0.0-rc.1']),
+        ],
+    )
+    def test_matches(self, constraint, expected):
+        """Matches the versions meeting every requirement"""
+        # Arrange
+        versions = [Version.parse(text) for text in ['0.0.1', '0.2.3', '0.2.9', '0.3.0', '1.2.0', '1.2.9', '1.3.0', '1.9.9', '2.0.0-rc.1', '2.0.0']]
+
+        # Act
+        matching = [str(version) for version in versions if version in VersionConstraint(constraint)]
+
+        # Assert
+        assert matching == expected
+
+    def test_include_prerelease(self):
+        """Matches pre-releases when asked to"""
+        # Arrange
+        constraint = VersionConstraint('>=1.0,<2', include_prerelease=True)
+
+        # Act & Assert
+        assert constraint.matches(Version.parse('1.5.0-beta'))
+        assert not constraint.matches(Version.parse('2.0.0-beta'))
+        assert repr(constraint) == "VersionConstraint('>=1.0,<2')"
+
+    @pytest.mark.parametrize('constraint', ['>=', '>=1.2.x', '=>1.2', '1.2.3.4', '>=1.2 <2'])
+    def test_rejects_invalid_constraints(self, constraint):
+        """Rejects constraints that cannot be parsed"""
+        # Act & Assert
+        with pytest.raises(ValueError, match='Invalid version constraint'):
+            VersionConstraint(constraint)
+
+
+class TestMaxSatisfying:
+    def test_picks_latest_matching_tag(self):
+        """Picks the highest matching version and skips invalid tags"""
+        # Arrange
+        tags = ['v1.2.0', 'v1.10.1', 'v2.0.0', 'v1.11.0-rc.1', 'latest', 'v1.9.5']
+
+        # Act
+        version = max_satisfying(tags, '>=1.2,<2', prefix='v')
+
+        # Assert
+        assert version == Version(1, 10, 1)
+
+    def test_accepts_versions(self):
+        """Accepts parsed versions and constraints"""
+        # Arrange
+        versions = [Version(1, 0, 0), Version(1, 1, 0)]
+
+        # Act & Assert
+        assert max_satisfying(versions, VersionConstraint('^1')) == Version(1, 1, 0)
+        assert max_satisfying(versions, '>=2') is None
+
+
+PACKED_REFS = """# pack-refs with: peeled fully-peeled sorted
+1111111111111111111111111111111111111111 refs/heads/main
+2222222222222222222222222222222222222222 refs/tags/v1.9.0
+^3333333333333333333333333333333333333333
+4444444444444444444444444444444444444444 refs/tags/v1.10.0
+5555555555555555555555555555555555555555 refs/tags/v2.0.0-rc.1
+6666666666666666666666666666666666666666 refs/tags/v3.0.0"""
+
+
+def make_git_dir(root):
+    """Create the refs of a repository with loose and packed tags, like git would"""
+    git_dir = root / '.git'
+    (git_dir / 'refs' / 'heads').mkdir(parents=True)
+    (git_dir / 'refs' / 'tags' / 'release').mkdir(parents=True)
+    for tag in ('v1.2.0', 'v3.0.0', 'nightly', 'release/2024'):
+        (git_dir / 'refs' / 'tags' / tag).write_text('7777777777777777777777777777777777777777\n')
+    (git_dir / 'packed-refs').write_text(PACKED_REFS)
+    return git_dir
+
+
+class TestGitTags:
+    def test_lists_loose_and_packed_tags_once(self, tmp_path):
+        """Lists every loose and packed tag once"""
+        # Arrange
+        make_git_dir(tmp_path)
+
+        # Act
+        tags = list(iter_git_tags(str(tmp_path)))
+
+        # Assert
+        assert sorted(tags) == ['nightly', 'release/2024', 'v1.10.0', 'v1.2.0', 'v1.9.0', 'v2.0.0-rc.1', 'v3.0.0']
+
+    def test_accepts_git_directory(self, tmp_path):
+        """Accepts the .git directory itself"""
+        # Arrange
+        git_dir = make_git_dir(tmp_path)
+
+        # Act & Assert
+        assert sorted(iter_git_tags(str(git_dir))) == sorted(iter_git_tags(str(tmp_path)))
+
+    def test_latest_git_tag(self, tmp_path):
+        """Returns the highest release, optionally limited by a constraint or including pre-releases"""
+        # Arrange
+        make_git_dir(tmp_path)
+
+        # Act & Assert
+        assert latest_git_tag(str(tmp_path), prefix='v') == Version(3, 0, 0)
+        assert latest_git_tag(str(tmp_path), prefix='v', constraint='<3') == Version(1, 10, 0)
+        assert latest_git_tag(str(tmp_path), prefix='v', constraint='<3', include_prerelease=True) == Version.parse('2.0.0-rc.1')
+        assert latest_git_tag(str(tmp_path), prefix='v', constraint=VersionConstraint('^1.2')) == Version(1, 10, 0)
+        assert latest_git_tag(str(tmp_path)) is None
+
+    def test_without_packed_refs(self, tmp_path):
+        """Reads loose tags when there is no or an empty packed-refs file"""
+        # Arrange
+        git_dir = make_git_dir(tmp_path)
+        (git_dir / 'packed-refs').write_text('')
+
+        # Act & Assert
+        assert latest_git_tag(str(tmp_path), prefix='v') == Version(3, 0, 0)
+        (git_dir / 'packed-refs').unlink()
+        assert latest_git_tag(str(tmp_path), prefix='v') == Version(3, 0, 0)
+
+    def test_without_tags(self, tmp_path):
+        """Returns None for a repository without tags"""
+        # Arrange
+        (tmp_path / '.git' / 'refs').mkdir(parents=True)
+
+        # Act & Assert
+        assert latest_git_tag(str(tmp_path)) is None
+
+    def test_follows_git_file_of_linked_work_tree(self, tmp_path):
+        """Follows the .git file of a linked work tree to the tags of the main repository"""
+        # Arrange
+        git_dir = make_git_dir(tmp_path / 'main')
+        worktree_dir = git_dir / 'worktrees' / 'feature'
+        worktree_dir.mkdir(parents=True)
+        (worktree_dir / 'commondir').write_text('../..\n')
+        (tmp_path / 'feature').mkdir()
+        (tmp_path / 'feature' / '.git').write_text(f'gitdir: {worktree_dir}\n')
+
+        # Act & Assert
+        assert latest_git_tag(str(tmp_path / 'feature'), prefix='v') == Version(3, 0, 0)
+
+    def test_rejects_other_directories(self, tmp_path):
+        """Raises ValueError when the path is not a repository"""
+        # Arrange
+        (tmp_path / 'submodule').mkdir()
+        (tmp_path / 'submodule' / '.git').write_text('not a pointer')
+
+        # Act & Assert
+        with pytest.raises(ValueError, match='Not a git repository'):
+            list(iter_git_tags(str(tmp_path)))
+        with pytest.raises(ValueError, match='Not a git repository'):
+            list(iter_git_tags(str(tmp_path / 'submodule')))
+
+    @pytest.mark.skipif(shutil.which('git') is None, reason='git is not installed')
+    def test_matches_git(self, tmp_path):
+        """Lists the same tags as git tag"""
+
+        # Arrange
+        def git(*args):
+            command = ['git', '-C', str(tmp_path), '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args]
+            return subprocess.run(command, capture_output=True, text=True, check=True).stdout
+
+        git('init', '-q')
+        git('commit', '-q', '--allow-empty', '-m', 'initial')
+        for tag in ('1.0.0', '1.1.0', 'feature/x'):
+            git('tag', tag)
+        git('pack-refs', '--all')
+        git('tag', '-a', '1.2.0', '-m', 'annotated')
+        git('tag', '2.0.0-beta')
+
+        # Act & Assert
+        assert sorted(iter_git_tags(str(tmp_path))) == sorted(git('tag').split())
+        assert latest_git_tag(str(tmp_path)) == Version(1, 2, 0)
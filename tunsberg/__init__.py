@@ -1,4 +1,21 @@
 """Init file for the package"""
 
+import importlib
+
 __name__ = 'tunsberg'
 __version__ = '0.3.0'
+
+# Submodules are imported the first time they are accessed as attributes of the package
+_SUBMODULES = ('background', 'encoding', 'konfig', 'logquery', 'metrics', 'middleware', 'profiling', 'responses', 'serialization', 'utsikten')
+
+
+def __getattr__(name: str):
+    """Import a submodule on first access"""
+    if name in _SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> list[str]:
+    """List the submodules together with the attributes that are already loaded"""
+    return sorted({*globals(), *_SUBMODULES})
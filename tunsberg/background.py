@@ -0,0 +1,324 @@
+"""Bounded executor for the background tasks of responses"""
+
+import logging
+import os
+import threading
+import weakref
+from collections import deque
+from time import perf_counter
+
+BACKGROUND_LOGGER = 'tunsberg.background'
+BACKENDS = ('thread', 'process')
+OVERFLOW_DROP = 'drop'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_INLINE = 'inline'
+OVERFLOW_POLICIES = (OVERFLOW_DROP, OVERFLOW_DROP_OLDEST, OVERFLOW_INLINE)
+
+_executors = weakref.WeakSet()
+_default_executor = None
+# Event loop of a worker thread or process, for tasks that are coroutine functions
+_local = threading.local()
+
+
+def _reset_after_fork() -> None:
+    """Forget worker threads and queued tasks inherited from the parent process"""
+    for executor in list(_executors):
+        executor._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _run_task(func, args: tuple, kwargs: dict) -> None:
+    """Call a task and run the awaitable it returns on the event loop of the current worker"""
+    result = func(*args, **kwargs)
+    if hasattr(result, '__await__'):
+        loop = getattr(_local, 'loop', None)
+        if loop is None:
+            # asyncio takes longer to import than the rest of the module, only load it for coroutine functions
+            import asyncio  # noqa: PLC0415
+
+            loop = _local.loop = asyncio.new_event_loop()
+        loop.run_until_complete(result)
+
+
+def _task_name(func) -> str:
+    """Name of a task for log records"""
+    return getattr(func, '__qualname__', None) or type(func).__qualname__
+
+
+class BackgroundExecutor:
+    """
+    Run background tasks on a fixed number of workers fed from a bounded queue.
+
+    With the thread backend every worker is a thread. Coroutine functions run on an event loop private to the worker, so
+    they must not use objects bound to the event loop of the app. With the process backend the workers hand the tasks to
+    a process pool of the same size, tasks and their arguments must then be picklable.
+
+    When the queue is full the overflow policy decides what happens to a new task: 'drop' discards it, 'drop_oldest'
+    discards the oldest queued task to make room, and 'inline' leaves it to the caller, which for responses means it is
+    run after the response like Starlette does without an executor. Failed tasks are logged on the 'tunsberg.background'
+    logger. Workers are started on the first task and are daemon threads, call shutdown() when the app stops to finish
+    the queued tasks.
+    """
+
+    def __init__(  # noqa: PLR0913, PLR0917
+        self,
+        backend: str = 'thread',
+        max_workers: int = 4,
+        max_queue: int = 1000,
+        overflow: str = OVERFLOW_DROP,
+        name: str = 'tunsberg-background',
+        logger_name: str = BACKGROUND_LOGGER,
+    ):
+        """
+        Create an executor.
+
+        :param backend: Where tasks run, 'thread' or 'process', defaults to 'thread'
+        :type backend: str
+        :param max_workers: Number of tasks run at the same time, defaults to 4
+        :type max_workers: int
+        :param max_queue: Number of tasks waiting for a worker, defaults to 1000
+        :type max_queue: int
+        :param overflow: What to do with a task when the queue is full, 'drop', 'drop_oldest' or 'inline', defaults to 'drop'
+        :type overflow: str
+        :param name: Prefix of the names of the worker threads, defaults to 'tunsberg-background'
+        :type name: str
+        :param logger_name: Logger failed tasks and overflows are logged on, defaults to 'tunsberg.background'
+        :type logger_name: str
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f'backend must be one of {", ".join(BACKENDS)}')
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'overflow must be one of {", ".join(OVERFLOW_POLICIES)}')
+        if max_workers < 1 or max_queue < 1:
+            raise ValueError('max_workers and max_queue must be at least 1')
+        self.backend = backend
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.name = name
+        self.logger = logging.getLogger(logger_name)
+        self._closed = False
+        self._reset()
+        _executors.add(self)
+
+    def _reset(self) -> None:
+        """Start over without workers, a forked child does not have the threads of its parent"""
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._threads = []
+        self._pool = None
+        self._overflowing = False
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._dropped = 0
+        self._inline = 0
+
+    def submit(self, func, *args, **kwargs) -> bool:
+        """
+        Queue a task without waiting for it.
+
+        :param func: Function or coroutine function to call
+        :param args: Positional arguments
+        :param kwargs: Keyword arguments
+        :return: Whether the task was queued, False when it was dropped or has to be run by the caller
+        :rtype: bool
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Executor has been shut down')
+            if len(self._queue) >= self.max_queue:
+                if not self._overflowing:
+                    # Log once per overflow, not for every task, the counters tell how many tasks it affected
+                    self._overflowing = True
+                    self.logger.warning('Background queue is full with %s tasks, overflow policy is %s', self.max_queue, self.overflow)
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped += 1
+                elif self.overflow == OVERFLOW_INLINE:
+                    self._inline += 1
+                    return False
+                else:
+                    self._dropped += 1
+                    return False
+            self._queue.append((func, args, kwargs))
+            self._submitted += 1
+            if not self._threads:
+                self._start()
+            self._condition.notify()
+        return True
+
+    def defer(self, background) -> 'DeferredTasks':
+        """
+        Wrap the background tasks of a response so they are queued on this executor instead of run after the response.
+
+        :param background: BackgroundTask or BackgroundTasks of Starlette or FastAPI, or any callable returning an awaitable
+        :return: Background object for a response
+        :rtype: DeferredTasks
+        """
+        return DeferredTasks(self, background)
+
+    def _start(self) -> None:
+        """Start the workers, called with the lock held"""
+        if self.backend == 'process':
+            from concurrent.futures import ProcessPoolExecutor  # noqa: PLC0415
+
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        for index in range(self.max_workers):
+            thread = threading.Thread(target=self._work, name=f'{self.name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        """Run queued tasks until shut down"""
+        try:
+            while True:
+                with self._condition:
+                    while not self._queue and not self._closed:
+                        self._condition.wait()
+                    if not self._queue:
+                        return
+                    func, args, kwargs = self._queue.popleft()
+                    self._overflowing = False
+                    self._running += 1
+                self._execute(func, args, kwargs)
+        finally:
+            loop = getattr(_local, 'loop', None)
+            if loop is not None:
+                loop.close()
+
+    def _execute(self, func, args: tuple, kwargs: dict) -> None:
+        """Run one task and count the outcome"""
+        start = perf_counter()
+        failed = False
+        try:
+            if self._pool is not None:
+                self._pool.submit(_run_task, func, args, kwargs).result()
+            else:
+                _run_task(func, args, kwargs)
+        except Exception:
+            failed = True
+            name = _task_name(func)
+            duration_ms = (perf_counter() - start) * 1000
+            fields = {'task': name, 'backend': self.backend, 'duration_ms': round(duration_ms, 3)}
+            self.logger.exception('Background task %s failed after %.2fms', name, duration_ms, extra={'extra_fields': fields})
+        with self._condition:
+            self._running -= 1
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop accepting tasks and stop the workers.
+
+        :param wait: Whether to finish the queued tasks first, otherwise they are dropped, defaults to True
+        :type wait: bool
+        """
+        with self._condition:
+            self._closed = True
+            if not wait:
+                self._dropped += len(self._queue)
+                self._queue.clear()
+            self._condition.notify_all()
+            threads = self._threads
+        for thread in threads:
+            thread.join()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def stats(self) -> dict:
+        """
+        Get the state of the queue and the number of tasks by outcome.
+
+        :return: queued, running, submitted, completed, failed, dropped and inline task counts, max_queue and max_workers
+        :rtype: dict
+        """
+        with self._condition:
+            return {
+                'queued': len(self._queue),
+                'running': self._running,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'dropped': self._dropped,
+                'inline': self._inline,
+                'max_queue': self.max_queue,
+                'max_workers': self.max_workers,
+            }
+
+    def render(self, prefix: str = 'tunsberg_background') -> bytes:
+        """
+        Render the stats in the Prometheus text exposition format, e.g. to serve them with MetricsMiddleware.
+
+        :param prefix: Prefix of the metric names, defaults to 'tunsberg_background'
+        :type prefix: str
+        :return: Exposition text
+        :rtype: bytes
+        """
+        stats = self.stats()
+        metrics = (
+            ('queued', 'gauge', 'Tasks waiting for a worker.', stats['queued']),
+            ('queue_capacity', 'gauge', 'Tasks that fit in the queue.', stats['max_queue']),
+            ('running', 'gauge', 'Tasks being run.', stats['running']),
+            ('tasks_submitted_total', 'counter', 'Tasks queued.', stats['submitted']),
+            ('tasks_completed_total', 'counter', 'Tasks that completed.', stats['completed']),
+            ('tasks_failed_total', 'counter', 'Tasks that raised an exception.', stats['failed']),
+            ('tasks_dropped_total', 'counter', 'Tasks dropped because the queue was full.', stats['dropped']),
+            ('tasks_inline_total', 'counter', 'Tasks left to the caller because the queue was full.', stats['inline']),
+        )
+        lines = []
+        for name, kind, description, value in metrics:
+            lines += [f'# HELP {prefix}_{name} {description}', f'# TYPE {prefix}_{name} {kind}', f'{prefix}_{name} {value}']
+        return ('\n'.join(lines) + '\n').encode()
+
+
+class DeferredTasks:
+    """Background object for a response that queues its tasks on a BackgroundExecutor"""
+
+    __slots__ = ('background', 'executor')
+
+    def __init__(self, executor: BackgroundExecutor, background):
+        """
+        Wrap background tasks.
+
+        :param executor: Executor to queue the tasks on
+        :type executor: BackgroundExecutor
+        :param background: BackgroundTask or BackgroundTasks of Starlette or FastAPI, or any callable returning an awaitable
+        """
+        self.executor = executor
+        self.background = background
+
+    async def __call__(self) -> None:
+        """Queue the tasks, called by Starlette once the response has been sent"""
+        tasks = getattr(self.background, 'tasks', None)
+        for task in tasks if tasks is not None else [self.background]:
+            func = getattr(task, 'func', None)
+            queued = self.executor.submit(func, *task.args, **task.kwargs) if func is not None else self.executor.submit(task)
+            if not queued and self.executor.overflow == OVERFLOW_INLINE:
+                await task()
+
+
+def set_default_executor(executor: BackgroundExecutor | None) -> None:
+    """
+    Queue the background tasks passed to the response helpers on an executor.
+
+    :param executor: Executor to use, None to run background tasks after the response again
+    :type executor: BackgroundExecutor or None
+    """
+    global _default_executor  # noqa: PLW0603
+    _default_executor = executor
+
+
+def get_default_executor() -> BackgroundExecutor | None:
+    """
+    Get the executor set with set_default_executor().
+
+    :return: Executor or None
+    :rtype: BackgroundExecutor or None
+    """
+    return _default_executor
@@ -0,0 +1,743 @@
+"""MessagePack and CBOR encoding of response envelopes, negotiated from the Accept header"""
+
+import importlib
+import struct
+import sys
+from array import array
+from contextvars import ContextVar
+from functools import cache, lru_cache
+from typing import Any
+
+JSON_MEDIA_TYPE = 'application/json'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+CBOR_MEDIA_TYPE = 'application/cbor'
+# Media types understood as MessagePack, clients use all of them
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, 'application/x-msgpack', 'application/vnd.msgpack')
+
+# Lists with at least this many numbers of a single type are packed and unpacked with one struct call
+_BULK_MIN = 8
+_BYTES = tuple(bytes((i,)) for i in range(256))
+_MAX_UINT64 = 0xFFFF_FFFF_FFFF_FFFF
+_VARY_HEADER = (b'vary', b'accept')
+_BYTESWAP = sys.byteorder == 'little'
+
+_U8 = struct.Struct('>BB').pack
+_U16 = struct.Struct('>BH').pack
+_U32 = struct.Struct('>BI').pack
+_U64 = struct.Struct('>BQ').pack
+_I8 = struct.Struct('>Bb').pack
+_I16 = struct.Struct('>Bh').pack
+_I32 = struct.Struct('>Bi').pack
+_I64 = struct.Struct('>Bq').pack
+_F64 = struct.Struct('>Bd').pack
+
+# Media type of the response to the request being handled, None for JSON. Set by ContentNegotiationMiddleware
+response_media_type: ContextVar[str | None] = ContextVar('tunsberg_response_media_type', default=None)
+
+
+@cache
+def _accelerator(name: str) -> Any | None:
+    """Import an optional C implementation, None when it is not installed"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def _array_typecode(fmt: str) -> str | None:
+    """Array type code with the size of a struct format character, None when there is none"""
+    size = struct.calcsize('>' + fmt)
+    codes = 'fd' if fmt in 'efd' else 'bhilq' if fmt.islower() else 'BHILQ'
+    return next((code for code in codes if array(code).itemsize == size), None)
+
+
+# Struct format character: array type code of the same size, used to convert many numbers at once
+_ARRAY_TYPECODES = {fmt: _array_typecode(fmt) for fmt in 'bhiqBHIQefd'}
+
+
+def _pack_numbers(values: list | tuple, fmt: str) -> bytes | None:
+    """Pack numbers big-endian in the width of a struct format character, None when one does not fit"""
+    try:
+        numbers = array(_ARRAY_TYPECODES[fmt], values)
+    except OverflowError:
+        return None
+    if _BYTESWAP:
+        numbers.byteswap()
+    return numbers.tobytes()
+
+
+def _interleave(marker: int, width: int, packed: bytes) -> bytearray:
+    """Put the same marker byte in front of each number in packed, a run of numbers of one fixed width"""
+    count = len(packed) // width
+    step = width + 1
+    out = bytearray(step * count)
+    out[0::step] = _BYTES[marker] * count
+    for offset in range(width):
+        out[offset + 1 :: step] = packed[offset::width]
+    return out
+
+
+def _deinterleave(data: bytes, pos: int, count: int, fmt: str, width: int) -> list:
+    """Unpack numbers of one fixed width, each preceded by a marker byte, starting at the first marker"""
+    step = width + 1
+    packed = bytearray(width * count)
+    for offset in range(width):
+        packed[offset::width] = data[pos + offset + 1 : pos + step * count : step]
+    numbers = array(_ARRAY_TYPECODES[fmt], packed)
+    if _BYTESWAP:
+        numbers.byteswap()
+    return numbers.tolist()
+
+
+# MessagePack
+
+# Marker, struct format and width of fixed width integers, narrowest first
+_MSGPACK_UNSIGNED = ((0xCC, 'B', 1), (0xCD, 'H', 2), (0xCE, 'I', 4), (0xCF, 'Q', 8))
+_MSGPACK_SIGNED = ((0xD0, 'b', 1), (0xD1, 'h', 2), (0xD2, 'i', 4), (0xD3, 'q', 8))
+# Signed 8-bit integers in the range of fixint
+_MSGPACK_FIXINT = bytes(range(0x80)) + bytes(range(0xE0, 0x100))
+
+
+def _msgpack_int(value: int, write) -> None:
+    if -0x20 <= value < 0x80:
+        write(_BYTES[value & 0xFF])
+    elif value > 0:
+        if value <= 0xFF:
+            write(_U8(0xCC, value))
+        elif value <= 0xFFFF:
+            write(_U16(0xCD, value))
+        elif value <= 0xFFFF_FFFF:
+            write(_U32(0xCE, value))
+        elif value <= _MAX_UINT64:
+            write(_U64(0xCF, value))
+        else:
+            raise OverflowError('Integer too large for MessagePack')
+    elif value >= -0x80:
+        write(_I8(0xD0, value))
+    elif value >= -0x8000:
+        write(_I16(0xD1, value))
+    elif value >= -0x8000_0000:
+        write(_I32(0xD2, value))
+    elif value >= -0x8000_0000_0000_0000:
+        write(_I64(0xD3, value))
+    else:
+        raise OverflowError('Integer too small for MessagePack')
+
+
+def _msgpack_length(length: int, fixed: int, fixed_limit: int, markers: tuple, write) -> None:
+    """Write the header of a string, binary, array or map"""
+    if length < fixed_limit:
+        write(_BYTES[fixed | length])
+    elif markers[0] is not None and length <= 0xFF:
+        write(_U8(markers[0], length))
+    elif length <= 0xFFFF:
+        write(_U16(markers[1], length))
+    elif length <= 0xFFFF_FFFF:
+        write(_U32(markers[2], length))
+    else:
+        raise ValueError('Object too large for MessagePack')
+
+
+def _msgpack_str(value: str, write) -> None:
+    encoded = value.encode()
+    _msgpack_length(len(encoded), 0xA0, 32, (0xD9, 0xDA, 0xDB), write)
+    write(encoded)
+
+
+def _msgpack_bytes(value: bytes, write) -> None:
+    _msgpack_length(len(value), 0, 0, (0xC4, 0xC5, 0xC6), write)
+    write(value)
+
+
+def _msgpack_array(value: list | tuple, write) -> None:
+    _msgpack_length(len(value), 0x90, 16, (None, 0xDC, 0xDD), write)
+    if len(value) >= _BULK_MIN:
+        types = set(map(type, value))
+        if types == {float}:
+            write(_interleave(0xCB, 8, struct.pack(f'>{len(value)}d', *value)))
+            return
+        if types == {int} and _msgpack_ints(value, write):
+            return
+    for item in value:
+        _msgpack_any(item, write)
+
+
+def _msgpack_ints(value: list | tuple, write) -> bool:
+    """Write integers in the narrowest width they all fit in, False when some need 65 bits"""
+    for marker, fmt, width in _MSGPACK_SIGNED if value[0] < 0 else _MSGPACK_UNSIGNED + _MSGPACK_SIGNED:
+        packed = _pack_numbers(value, fmt)
+        if packed is None:
+            continue
+        if (marker == 0xCC and packed.isascii()) or (marker == 0xD0 and not packed.translate(None, _MSGPACK_FIXINT)):
+            # Every integer is a fixint, which is the byte itself
+            write(packed)
+        else:
+            write(_interleave(marker, width, packed))
+        return True
+    return False
+
+
+@lru_cache(maxsize=1024)
+def _msgpack_key(key: str) -> bytes:
+    """Encode a string used as a map key, keys repeat in every record of a list"""
+    chunks = []
+    _msgpack_str(key, chunks.append)
+    return b''.join(chunks)
+
+
+def _msgpack_map(value: dict, write) -> None:
+    _msgpack_length(len(value), 0x80, 16, (None, 0xDE, 0xDF), write)
+    for key, item in value.items():
+        if type(key) is str:
+            write(_msgpack_key(key))
+        else:
+            _msgpack_any(key, write)
+        _msgpack_any(item, write)
+
+
+_MSGPACK_CONSTANTS = {None: b'\xc0', False: b'\xc2', True: b'\xc3'}
+_MSGPACK_TYPES = {
+    str: _msgpack_str,
+    int: _msgpack_int,
+    float: lambda value, write: write(_F64(0xCB, value)),
+    dict: _msgpack_map,
+    list: _msgpack_array,
+    tuple: _msgpack_array,
+    bytes: _msgpack_bytes,
+    bytearray: _msgpack_bytes,
+}
+
+
+def _msgpack_any(value: Any, write) -> None:
+    kind = type(value)
+    encoder = _MSGPACK_TYPES.get(kind)
+    if encoder is not None:
+        encoder(value, write)
+    elif value is None or kind is bool:
+        write(_MSGPACK_CONSTANTS[value])
+    else:
+        # Subclasses, like enums based on str or int, are encoded as their base type
+        for base, encoder in _MSGPACK_TYPES.items():
+            if isinstance(value, base):
+                encoder(value, write)
+                return
+        raise TypeError(f'Object of type {kind.__name__} is not MessagePack serializable')
+
+
+def _pack_msgpack(value: Any) -> bytes:
+    """Encode a value as MessagePack without any optional dependency"""
+    chunks = []
+    _msgpack_any(value, chunks.append)
+    return b''.join(chunks)
+
+
+# Marker of fixed width numbers: struct format and width
+_MSGPACK_NUMBERS = {
+    0xCA: ('f', 4),
+    0xCB: ('d', 8),
+    0xCC: ('B', 1),
+    0xCD: ('H', 2),
+    0xCE: ('I', 4),
+    0xCF: ('Q', 8),
+    0xD0: ('b', 1),
+    0xD1: ('h', 2),
+    0xD2: ('i', 4),
+    0xD3: ('q', 8),
+}
+
+
+def _msgpack_unpack_array(data: bytes, pos: int, count: int) -> tuple[list, int]:
+    if count >= _BULK_MIN:
+        marker = data[pos]
+        number = _MSGPACK_NUMBERS.get(marker)
+        if number is not None:
+            fmt, width = number
+            end = pos + (width + 1) * count
+            if end <= len(data) and data[pos : end : width + 1] == _BYTES[marker] * count:
+                return _deinterleave(data, pos, count, fmt, width), end
+        elif marker < 0x80 and pos + count <= len(data) and max(data[pos : pos + count]) < 0x80:
+            return list(data[pos : pos + count]), pos + count
+    items = []
+    for _ in range(count):
+        item, pos = _msgpack_unpack(data, pos)
+        items.append(item)
+    return items, pos
+
+
+def _msgpack_unpack_map(data: bytes, pos: int, count: int) -> tuple[dict, int]:
+    result = {}
+    for _ in range(count):
+        marker = data[pos]
+        if 0xA0 <= marker < 0xC0:
+            # Keys are nearly always short strings, read them without a call
+            end = pos + 1 + (marker & 0x1F)
+            key = data[pos + 1 : end].decode()
+            pos = end
+        else:
+            key, pos = _msgpack_unpack(data, pos)
+        result[key], pos = _msgpack_unpack(data, pos)
+    return result, pos
+
+
+def _msgpack_unpack_str(data: bytes, pos: int, length: int) -> tuple[str, int]:
+    end = pos + length
+    if end > len(data):
+        raise IndexError(pos)
+    return data[pos:end].decode(), end
+
+
+def _msgpack_unpack_bytes(data: bytes, pos: int, length: int) -> tuple[bytes, int]:
+    end = pos + length
+    if end > len(data):
+        raise IndexError(pos)
+    return data[pos:end], end
+
+
+# Marker of variable length objects: struct format of the length and function reading the object
+_MSGPACK_LENGTHS = {
+    0xC4: ('>B', _msgpack_unpack_bytes),
+    0xC5: ('>H', _msgpack_unpack_bytes),
+    0xC6: ('>I', _msgpack_unpack_bytes),
+    0xD9: ('>B', _msgpack_unpack_str),
+    0xDA: ('>H', _msgpack_unpack_str),
+    0xDB: ('>I', _msgpack_unpack_str),
+    0xDC: ('>H', _msgpack_unpack_array),
+    0xDD: ('>I', _msgpack_unpack_array),
+    0xDE: ('>H', _msgpack_unpack_map),
+    0xDF: ('>I', _msgpack_unpack_map),
+}
+
+
+def _msgpack_unpack(data: bytes, pos: int) -> tuple[Any, int]:  # noqa: PLR0911
+    marker = data[pos]
+    pos += 1
+    if marker < 0x80:
+        return marker, pos
+    if marker >= 0xE0:
+        return marker - 0x100, pos
+    if 0xA0 <= marker < 0xC0:
+        return _msgpack_unpack_str(data, pos, marker & 0x1F)
+    if marker < 0x90:
+        return _msgpack_unpack_map(data, pos, marker & 0x0F)
+    if marker < 0xA0:
+        return _msgpack_unpack_array(data, pos, marker & 0x0F)
+    if marker == 0xC0:
+        return None, pos
+    if marker in {0xC2, 0xC3}:
+        return marker == 0xC3, pos
+    number = _MSGPACK_NUMBERS.get(marker)
+    if number is not None:
+        return struct.unpack_from('>' + number[0], data, pos)[0], pos + number[1]
+    length = _MSGPACK_LENGTHS.get(marker)
+    if length is not None:
+        fmt, reader = length
+        return reader(data, pos + struct.calcsize(fmt), struct.unpack_from(fmt, data, pos)[0])
+    raise ValueError(f'Unsupported MessagePack marker 0x{marker:02x}')
+
+
+def _unpack_msgpack(data: bytes) -> Any:
+    """Decode MessagePack without any optional dependency"""
+    data = bytes(data)
+    try:
+        value, pos = _msgpack_unpack(data, 0)
+    except (IndexError, struct.error) as e:
+        raise ValueError('Truncated MessagePack data') from e
+    if pos != len(data):
+        raise ValueError('Extra data after MessagePack object')
+    return value
+
+
+def encode_msgpack(value: Any) -> bytes:
+    """
+    Encode a value as MessagePack.
+
+    Uses the msgpack package when it is installed, otherwise the built-in encoder.
+
+    :param value: None, bool, int, float, str, bytes, list, tuple or dict of these
+    :type value: Any
+    :return: Encoded value
+    :rtype: bytes
+    """
+    module = _accelerator('msgpack')
+    if module is not None:
+        return module.packb(value)
+    return _pack_msgpack(value)
+
+
+def decode_msgpack(data: bytes) -> Any:
+    """
+    Decode MessagePack.
+
+    Uses the msgpack package when it is installed, otherwise the built-in decoder.
+
+    :param data: Encoded value
+    :type data: bytes
+    :return: Decoded value
+    :rtype: Any
+    """
+    module = _accelerator('msgpack')
+    if module is not None:
+        return module.unpackb(data, strict_map_key=False)
+    return _unpack_msgpack(data)
+
+
+# CBOR
+
+# Largest value, additional information, struct format and width of fixed width arguments
+_CBOR_WIDTHS = ((0xFF, 24, 'B', 1), (0xFFFF, 25, 'H', 2), (0xFFFF_FFFF, 26, 'I', 4), (_MAX_UINT64, 27, 'Q', 8))
+_CBOR_HEADS = (_U8, _U16, _U32, _U64)
+# Integers below 24, which fit in the initial byte
+_CBOR_DIRECT = bytes(range(24))
+# Initial byte of integers below 24 in major type 1, indexed by the argument
+_CBOR_NEGATIVE_DIRECT = bytes((byte | 0x20) & 0xFF for byte in range(256))
+
+
+def _cbor_head(major: int, argument: int, write) -> None:
+    """Write the initial byte of a data item and its argument"""
+    if argument < 24:
+        write(_BYTES[major | argument])
+        return
+    for (limit, info, _, _), pack in zip(_CBOR_WIDTHS, _CBOR_HEADS, strict=True):
+        if argument <= limit:
+            write(pack(major | info, argument))
+            return
+    raise ValueError('Object too large for CBOR')
+
+
+def _cbor_int(value: int, write) -> None:
+    major = 0x00
+    if value < 0:
+        major = 0x20
+        value = -1 - value
+    if value > _MAX_UINT64:
+        # Bignums are tagged byte strings, tag 2 for positive and tag 3 for negative numbers
+        write(_BYTES[0xC2 if major == 0x00 else 0xC3])
+        _cbor_bytes(value.to_bytes((value.bit_length() + 7) // 8), write)
+        return
+    _cbor_head(major, value, write)
+
+
+def _cbor_str(value: str, write) -> None:
+    encoded = value.encode()
+    _cbor_head(0x60, len(encoded), write)
+    write(encoded)
+
+
+def _cbor_bytes(value: bytes, write) -> None:
+    _cbor_head(0x40, len(value), write)
+    write(value)
+
+
+def _cbor_array(value: list | tuple, write) -> None:
+    _cbor_head(0x80, len(value), write)
+    if len(value) >= _BULK_MIN:
+        types = set(map(type, value))
+        if types == {float}:
+            write(_interleave(0xFB, 8, struct.pack(f'>{len(value)}d', *value)))
+            return
+        if types == {int} and _cbor_ints(value, write):
+            return
+    for item in value:
+        _cbor_any(item, write)
+
+
+def _cbor_ints(value: list | tuple, write) -> bool:
+    """Write integers of the same sign in the narrowest width they all fit in, False when that is not possible"""
+    major = 0x00
+    if value[0] < 0:
+        # Negative integers are encoded as -1 - value in major type 1
+        major = 0x20
+        value = [~item for item in value]
+    for _, info, fmt, width in _CBOR_WIDTHS:
+        packed = _pack_numbers(value, fmt)
+        if packed is None:
+            continue
+        if info == 24 and not packed.translate(None, _CBOR_DIRECT):
+            write(packed if major == 0x00 else packed.translate(_CBOR_NEGATIVE_DIRECT))
+        else:
+            write(_interleave(major | info, width, packed))
+        return True
+    return False
+
+
+@lru_cache(maxsize=1024)
+def _cbor_key(key: str) -> bytes:
+    """Encode a string used as a map key, keys repeat in every record of a list"""
+    chunks = []
+    _cbor_str(key, chunks.append)
+    return b''.join(chunks)
+
+
+def _cbor_map(value: dict, write) -> None:
+    _cbor_head(0xA0, len(value), write)
+    for key, item in value.items():
+        if type(key) is str:
+            write(_cbor_key(key))
+        else:
+            _cbor_any(key, write)
+        _cbor_any(item, write)
+
+
+_CBOR_CONSTANTS = {None: b'\xf6', False: b'\xf4', True: b'\xf5'}
+_CBOR_TYPES = {
+    str: _cbor_str,
+    int: _cbor_int,
+    float: lambda value, write: write(_F64(0xFB, value)),
+    dict: _cbor_map,
+    list: _cbor_array,
+    tuple: _cbor_array,
+    bytes: _cbor_bytes,
+    bytearray: _cbor_bytes,
+}
+
+
+def _cbor_any(value: Any, write) -> None:
+    kind = type(value)
+    encoder = _CBOR_TYPES.get(kind)
+    if encoder is not None:
+        encoder(value, write)
+    elif value is None or kind is bool:
+        write(_CBOR_CONSTANTS[value])
+    else:
+        for base, encoder in _CBOR_TYPES.items():
+            if isinstance(value, base):
+                encoder(value, write)
+                return
+        raise TypeError(f'Object of type {kind.__name__} is not CBOR serializable')
+
+
+def _pack_cbor(value: Any) -> bytes:
+    """Encode a value as CBOR without any optional dependency"""
+    chunks = []
+    _cbor_any(value, chunks.append)
+    return b''.join(chunks)
+
+
+# Additional information of fixed width arguments: struct format and width
+_CBOR_ARGUMENTS = {24: ('B', 1), 25: ('H', 2), 26: ('I', 4), 27: ('Q', 8)}
+_CBOR_FLOATS = {0xF9: ('e', 2), 0xFA: ('f', 4), 0xFB: ('d', 8)}
+_CBOR_SIMPLE = {0xF4: False, 0xF5: True, 0xF6: None, 0xF7: None}
+_CBOR_BREAK = object()
+
+
+def _cbor_unpack_array(data: bytes, pos: int, count: int) -> tuple[list, int]:
+    if count >= _BULK_MIN:
+        initial = data[pos]
+        if initial < 24 and pos + count <= len(data) and max(data[pos : pos + count]) < 24:
+            return list(data[pos : pos + count]), pos + count
+        number = _CBOR_FLOATS.get(initial) if initial >= 0xF9 else _CBOR_ARGUMENTS.get(initial & 0x1F) if initial < 0x40 else None
+        if number is not None and _ARRAY_TYPECODES[number[0]] is not None:
+            fmt, width = number
+            end = pos + (width + 1) * count
+            if end <= len(data) and data[pos : end : width + 1] == _BYTES[initial] * count:
+                values = _deinterleave(data, pos, count, fmt, width)
+                return ([~item for item in values] if 0x20 <= initial < 0x40 else values), end
+    items = []
+    for _ in range(count):
+        item, pos = _cbor_unpack(data, pos)
+        items.append(item)
+    return items, pos
+
+
+def _cbor_unpack_indefinite(data: bytes, pos: int) -> tuple[list, int]:
+    """Read data items up to a break"""
+    items = []
+    while True:
+        item, pos = _cbor_unpack(data, pos)
+        if item is _CBOR_BREAK:
+            return items, pos
+        items.append(item)
+
+
+def _cbor_unpack(data: bytes, pos: int) -> tuple[Any, int]:  # noqa: PLR0911, PLR0912
+    initial = data[pos]
+    pos += 1
+    major = initial >> 5
+    info = initial & 0x1F
+    if major == 7:
+        if initial in _CBOR_SIMPLE:
+            return _CBOR_SIMPLE[initial], pos
+        number = _CBOR_FLOATS.get(initial)
+        if number is not None:
+            return struct.unpack_from('>' + number[0], data, pos)[0], pos + number[1]
+        if initial == 0xFF:
+            return _CBOR_BREAK, pos
+        raise ValueError(f'Unsupported CBOR simple value 0x{initial:02x}')
+
+    if info < 24:
+        argument = info
+    elif info in _CBOR_ARGUMENTS:
+        fmt, width = _CBOR_ARGUMENTS[info]
+        argument = struct.unpack_from('>' + fmt, data, pos)[0]
+        pos += width
+    elif info == 31 and major in {2, 3, 4, 5}:
+        # Indefinite length, the chunks or items follow up to a break
+        items, pos = _cbor_unpack_indefinite(data, pos)
+        if major == 2:
+            return b''.join(items), pos
+        if major == 3:
+            return ''.join(items), pos
+        if major == 4:
+            return items, pos
+        return dict(zip(items[::2], items[1::2], strict=True)), pos
+    else:
+        raise ValueError(f'Invalid CBOR initial byte 0x{initial:02x}')
+
+    if major == 0:
+        return argument, pos
+    if major == 1:
+        return -1 - argument, pos
+    if major in {2, 3}:
+        end = pos + argument
+        if end > len(data):
+            raise IndexError(pos)
+        return (data[pos:end] if major == 2 else data[pos:end].decode()), end
+    if major == 4:
+        return _cbor_unpack_array(data, pos, argument)
+    if major == 5:
+        result = {}
+        for _ in range(argument):
+            initial = data[pos]
+            if 0x60 <= initial < 0x78:
+                # Keys are nearly always short strings, read them without a call
+                end = pos + 1 + (initial & 0x1F)
+                key = data[pos + 1 : end].decode()
+                pos = end
+            else:
+                key, pos = _cbor_unpack(data, pos)
+            result[key], pos = _cbor_unpack(data, pos)
+        return result, pos
+    # Tagged item, bignums are converted and any other tag is dropped in favour of the item it wraps
+    value, pos = _cbor_unpack(data, pos)
+    if argument in {2, 3} and isinstance(value, bytes):
+        number = int.from_bytes(value)
+        return (number if argument == 2 else -1 - number), pos
+    return value, pos
+
+
+def _unpack_cbor(data: bytes) -> Any:
+    """Decode CBOR without any optional dependency"""
+    data = bytes(data)
+    try:
+        value, pos = _cbor_unpack(data, 0)
+    except (IndexError, struct.error) as e:
+        raise ValueError('Truncated CBOR data') from e
+    if value is _CBOR_BREAK:
+        raise ValueError('Unexpected CBOR break')
+    if pos != len(data):
+        raise ValueError('Extra data after CBOR object')
+    return value
+
+
+def encode_cbor(value: Any) -> bytes:
+    """
+    Encode a value as CBOR.
+
+    Uses the cbor2 package when it is installed, otherwise the built-in encoder.
+
+    :param value: None, bool, int, float, str, bytes, list, tuple or dict of these
+    :type value: Any
+    :return: Encoded value
+    :rtype: bytes
+    """
+    module = _accelerator('cbor2')
+    if module is not None:
+        return module.dumps(value)
+    return _pack_cbor(value)
+
+
+def decode_cbor(data: bytes) -> Any:
+    """
+    Decode CBOR.
+
+    Uses the cbor2 package when it is installed, otherwise the built-in decoder.
+
+    :param data: Encoded value
+    :type data: bytes
+    :return: Decoded value
+    :rtype: Any
+    """
+    module = _accelerator('cbor2')
+    if module is not None:
+        return module.loads(data)
+    return _unpack_cbor(data)
+
+
+# Binary media type: encoder
+ENCODERS = {
+    **dict.fromkeys(MSGPACK_MEDIA_TYPES, encode_msgpack),
+    CBOR_MEDIA_TYPE: encode_cbor,
+}
+_JSON_RANGES = frozenset((JSON_MEDIA_TYPE, 'application/*', '*/*'))
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept: str) -> str | None:
+    """
+    Pick the media type of a response from the Accept header of a request.
+
+    The media type with the highest quality wins, the first one listed on a tie. Wildcards select JSON.
+
+    :param accept: Value of the Accept header
+    :type accept: str
+    :return: MessagePack or CBOR media type, None for JSON
+    :rtype: str or None
+    """
+    best = None
+    best_quality = 0.0
+    for part in accept.split(','):
+        media_range, _, parameters = part.partition(';')
+        media_range = media_range.strip().lower()
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            name, _, value = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > best_quality and (media_range in ENCODERS or media_range in _JSON_RANGES):
+            best = media_range if media_range in ENCODERS else None
+            best_quality = quality
+    return best
+
+
+class ContentNegotiationMiddleware:
+    """
+    Let clients ask for response envelopes as MessagePack or CBOR in the Accept header.
+
+    The negotiated media type is stored in the response_media_type variable, which generate_json_response() and every
+    response helper built on it read. Responses created some other way, like validation errors raised by FastAPI, stay
+    JSON. Every response gets a Vary: Accept header so caches keep the representations apart.
+    """
+
+    def __init__(self, app):
+        """
+        Wrap an ASGI application.
+
+        :param app: ASGI application
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        """Handle an ASGI request"""
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        media_type = None
+        for name, value in scope['headers']:
+            if name == b'accept':
+                media_type = negotiate(value.decode('latin-1'))
+                break
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', ()), _VARY_HEADER]
+            await send(message)
+
+        token = response_media_type.set(media_type)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            response_media_type.reset(token)
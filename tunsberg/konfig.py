@@ -1,17 +1,73 @@
+import hashlib
 import json
+import keyword
 import logging
+import logging.config
+import logging.handlers
+import math
+import os
+import pickle
+import selectors
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
 import warnings
-from datetime import datetime, timezone
+from collections.abc import Mapping
+from datetime import UTC, datetime
+from functools import lru_cache
 from os import getenv
+from urllib.parse import urlsplit
+
+from tunsberg.middleware import RequestContextFilter, request_context
+
+MULTIPROCESS_MODES = ('per_worker', 'aggregator')
+ACCESS_LOGS = ('uvicorn', 'tunsberg')
+FILE_HANDLERS = ('file', 'rotating_file', 'time_rotating_file')
+RECORD_LENGTH_PREFIX = struct.Struct('>L')
 
 
 class JsonFormatter(logging.Formatter):
-    """Custom JSON log formatter"""
+    """
+    Custom JSON log formatter
+
+    The request ID of the request being handled is added when logging inside AccessLogMiddleware, and the contents of
+    an 'extra_fields' dictionary passed through the extra argument are merged into the output.
+
+    With dedupe_window set, exceptions are fingerprinted by their type and the location of every frame in the
+    traceback. The first occurrence within the window is logged with the full traceback, later ones only with the last
+    line of the traceback, the fingerprint and a repeat count. A summary record with the total repeat count is logged on
+    the 'tunsberg.konfig' logger once the window has expired, when the next record is formatted. The summary is logged
+    by a background thread, because format() runs while the handler lock is held. There is no timer, call
+    flush_exception_summaries() to log the summaries of open windows, e.g. on shutdown.
+    """
+
+    def __init__(self, *args, dedupe_window: float | None = None, dedupe_cache_size: int = 256, **kwargs):
+        """
+        Create a formatter, positional and other keyword arguments are passed on to logging.Formatter.
+
+        :param dedupe_window: Seconds during which repeated exceptions are logged without traceback, None to disable
+        :type dedupe_window: float or None
+        :param dedupe_cache_size: Maximum number of exception fingerprints tracked at the same time
+        :type dedupe_cache_size: int
+        """
+        super().__init__(*args, **kwargs)
+        self.dedupe_window = dedupe_window
+        self.dedupe_cache_size = dedupe_cache_size
+        self._exceptions = {}
+        self._next_expiry = float('inf')
+        self._lock = threading.Lock()
+        self._pending_summaries = []
+        self._summaries_requested = None
+        self._summary_thread = None
 
     def format(self, record):
         """Format log record as JSON"""
         log_record = {
-            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'timestamp': datetime.fromtimestamp(record.created, UTC).isoformat(),
             'level': record.levelname,
             'logger': record.name,
             'module': record.module,
@@ -19,12 +75,157 @@ class JsonFormatter(logging.Formatter):
             'message': record.getMessage(),
         }
 
-        # Add exception info if available
+        # Add the request ID, records received from other processes carry it as an attribute
+        request_id = record.__dict__.get('request_id')
+        if request_id is None:
+            context = request_context.get()
+            if context is not None:
+                request_id = context.request_id
+        if request_id is not None:
+            log_record['request_id'] = request_id
+
+        extra_fields = record.__dict__.get('extra_fields')
+        if extra_fields:
+            log_record.update(extra_fields)
+
+        # Add exception info if available, records received from other processes only carry the pre-rendered text
         if record.exc_info:
-            log_record['exception'] = self.formatException(record.exc_info)
+            if self.dedupe_window is None:
+                log_record['exception'] = self.formatException(record.exc_info)
+            else:
+                self._add_deduplicated_exception(log_record, record)
+        elif record.exc_text:
+            log_record['exception'] = record.exc_text
+
+        if self.dedupe_window is not None and time.monotonic() >= self._next_expiry:
+            self._queue_summaries(self._close_windows(expired_only=True))
 
         return json.dumps(log_record)
 
+    def flush_exception_summaries(self, expired_only: bool = False) -> None:
+        """
+        Close exception windows and log a summary for every exception that was repeated.
+
+        Summaries waiting for the background thread are logged as well. Do not call this from a handler or formatter.
+
+        :param expired_only: Only close windows that are older than dedupe_window
+        :type expired_only: bool
+        """
+        closed = self._close_windows(expired_only)
+        with self._lock:
+            pending, self._pending_summaries = self._pending_summaries, []
+        self._log_summaries(pending + closed)
+
+    def _close_windows(self, expired_only: bool) -> list:
+        now = time.monotonic()
+        closed = []
+        with self._lock:
+            for key, window in list(self._exceptions.items()):
+                # Windows are kept in the order they were opened, the first one that is still open ends the search
+                if expired_only and now - window.start < self.dedupe_window:
+                    break
+                del self._exceptions[key]
+                closed.append((window, now))
+            self._update_next_expiry()
+        return closed
+
+    def _add_deduplicated_exception(self, log_record: dict, record: logging.LogRecord) -> None:
+        # A formatter is shared by every handler using it, count each record only once
+        seen = record.__dict__.get('exception_fingerprint')
+        if seen is None:
+            exc_type, _, tb = record.exc_info
+            frames = []
+            while tb is not None:
+                frames.append((tb.tb_frame.f_code.co_filename, tb.tb_lineno, tb.tb_frame.f_code.co_name))
+                tb = tb.tb_next
+            key = (exc_type, tuple(frames))
+
+            closed = []
+            now = time.monotonic()
+            with self._lock:
+                window = self._exceptions.get(key)
+                if window is not None and now - window.start >= self.dedupe_window:
+                    # The window of this exception has expired, this is the first occurrence of a new one
+                    closed.append((self._exceptions.pop(key), now))
+                    window = None
+                if window is None:
+                    fingerprint = hashlib.blake2b(repr((exc_type.__module__, exc_type.__qualname__, key[1])).encode(), digest_size=8).hexdigest()
+                    window = _ExceptionWindow(fingerprint, exc_type.__qualname__, now)
+                    self._exceptions[key] = window
+                    if len(self._exceptions) > self.dedupe_cache_size:
+                        closed.append((self._exceptions.pop(next(iter(self._exceptions))), now))
+                    self._update_next_expiry()
+                else:
+                    window.repeats += 1
+                record.exception_fingerprint = window.fingerprint
+                record.exception_repeat = window.repeats
+            self._queue_summaries(closed)
+
+        log_record['exception_fingerprint'] = record.exception_fingerprint
+        if record.exception_repeat == 0:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            log_record['exception'] = record.exc_text
+        else:
+            log_record['exception'] = ''.join(traceback.format_exception_only(record.exc_info[0], record.exc_info[1])).strip()
+            log_record['exception_repeat'] = record.exception_repeat
+
+    def _update_next_expiry(self) -> None:
+        first = next(iter(self._exceptions.values()), None)
+        self._next_expiry = first.start + self.dedupe_window if first is not None else float('inf')
+
+    def _queue_summaries(self, closed: list) -> None:
+        # format() runs while the handler holds its lock, logging from here could deadlock with another handler sharing
+        # this formatter and would write the summary before the record being formatted. A thread logs them instead.
+        closed = [(window, now) for window, now in closed if window.repeats]
+        if not closed:
+            return
+        with self._lock:
+            self._pending_summaries.extend(closed)
+            if self._summary_thread is None:
+                self._summaries_requested = threading.Event()
+                self._summary_thread = threading.Thread(target=self._log_summaries_on_request, name='tunsberg-exception-summaries', daemon=True)
+                self._summary_thread.start()
+        self._summaries_requested.set()
+
+    def _log_summaries_on_request(self) -> None:
+        while True:
+            self._summaries_requested.wait()
+            self._summaries_requested.clear()
+            with self._lock:
+                pending, self._pending_summaries = self._pending_summaries, []
+            self._log_summaries(pending)
+
+    def _log_summaries(self, closed: list) -> None:
+        logger = logging.getLogger(__name__)
+        for window, now in closed:
+            if window.repeats:
+                logger.warning(
+                    'Exception %s (%s) was repeated %s times in %.1fs',
+                    window.exc_type,
+                    window.fingerprint,
+                    window.repeats,
+                    now - window.start,
+                    extra={
+                        'extra_fields': {
+                            'exception_fingerprint': window.fingerprint,
+                            'exception_type': window.exc_type,
+                            'exception_repeat': window.repeats,
+                            'window_seconds': round(now - window.start, 3),
+                        }
+                    },
+                )
+
+
+class _ExceptionWindow:
+    __slots__ = ('exc_type', 'fingerprint', 'repeats', 'start')
+
+    def __init__(self, fingerprint: str, exc_type: str, start: float):
+        self.fingerprint = fingerprint
+        self.exc_type = exc_type
+        self.start = start
+        self.repeats = 0
+
 
 def log_config(  # noqa: PLR0913
     log_level: int = logging.DEBUG,
@@ -33,10 +234,26 @@ def log_config(  # noqa: PLR0913
     log_handlers=None,
     log_formatter: str = 'default',
     date_format: str = '%Y-%m-%d %H:%M:%S',
+    *,
+    multiprocess_mode: str | None = None,
+    log_socket_path: str | None = None,
+    access_log: str = 'uvicorn',
+    exception_dedupe_window: float | None = None,
+    ring_buffer_capacity: int = 1000,
 ) -> dict:
     """
     Generate a configuration dictionary for logging in FastAPI with Uvicorn.
 
+    When running with several workers, every process builds its handlers from the same dictionary. Set multiprocess_mode
+    to 'per_worker' to give each process its own log file (the process id is added before the file extension, files of
+    exited workers are kept and have to be cleaned up outside of the app), or to 'aggregator' to replace the file
+    handlers with a socket handler that ships records to a LogAggregator, which is then the only process writing and
+    rotating the log file.
+
+    Selecting the 'ring_buffer' handler keeps the last ring_buffer_capacity records of every level in memory and writes
+    them to a separate '.debug' log file next to log_file_path when an ERROR is logged. The loggers are then set to DEBUG,
+    while the other selected handlers keep writing from log_level up.
+
     :param log_level: Log level integer, defaults to logging.DEBUG
     :type log_level: int
     :param log_file_path: Path to the log file, defaults to 'fastapi.log'
@@ -49,6 +266,16 @@ def log_config(  # noqa: PLR0913
     :type log_formatter: str
     :param date_format: Date format string, defaults to '%Y-%m-%d %H:%M:%S'
     :type date_format: str
+    :param multiprocess_mode: None, 'per_worker' or 'aggregator', defaults to None
+    :type multiprocess_mode: str or None
+    :param log_socket_path: Unix socket used in 'aggregator' mode, defaults to the log file path with a '.sock' suffix
+    :type log_socket_path: str or None
+    :param access_log: Which access log to write, 'uvicorn' or 'tunsberg' for AccessLogMiddleware, defaults to 'uvicorn'
+    :type access_log: str
+    :param exception_dedupe_window: Seconds during which the JSON formatter logs repeated exceptions without traceback
+    :type exception_dedupe_window: float or None
+    :param ring_buffer_capacity: Number of records kept by the 'ring_buffer' handler, defaults to 1000
+    :type ring_buffer_capacity: int
     :return: Configuration dictionary
     :rtype: dict
     """
@@ -68,7 +295,15 @@ def log_config(  # noqa: PLR0913
     if not log_file_path:
         raise ValueError('Log file path cannot be empty')
 
-    return {
+    # Make sure the multiprocess mode is known
+    if multiprocess_mode is not None and multiprocess_mode not in MULTIPROCESS_MODES:
+        raise ValueError('Invalid multiprocess mode')
+
+    # Make sure the access log is known
+    if access_log not in ACCESS_LOGS:
+        raise ValueError('Invalid access log')
+
+    config = {
         'version': 1,
         'disable_existing_loggers': False,
         'formatters': {
@@ -78,6 +313,7 @@ def log_config(  # noqa: PLR0913
             },
             'json': {
                 '()': JsonFormatter,
+                'dedupe_window': exception_dedupe_window,
             },
         },
         'handlers': {
@@ -105,6 +341,17 @@ def log_config(  # noqa: PLR0913
                 'interval': 1,
                 'backupCount': 7,
             },
+            'ring_buffer': {
+                'class': 'tunsberg.konfig.RingBufferHandler',
+                'capacity': ring_buffer_capacity,
+                'target': 'ring_buffer_file',
+            },
+            'ring_buffer_file': {
+                'class': 'logging.FileHandler',
+                'formatter': log_formatter,
+                'filename': '{}.debug{}'.format(*os.path.splitext(log_file_path)),
+                'delay': True,
+            },
         },
         'loggers': {
             'uvicorn': {
@@ -122,10 +369,791 @@ def log_config(  # noqa: PLR0913
                 'level': logging.getLevelName(log_level),
                 'propagate': False,
             },
+            'tunsberg': {
+                'handlers': log_handlers,
+                'level': logging.getLevelName(log_level),
+                'propagate': False,
+            },
         },
         'root': {'handlers': ['console'], 'level': 'DEBUG'},
     }
 
+    _apply_multiprocess_mode(config, multiprocess_mode, log_handlers, log_file_path, log_socket_path)
+    _apply_ring_buffer(config, log_handlers, log_level)
+
+    if access_log == 'tunsberg':
+        # AccessLogMiddleware writes the access records, keep Uvicorn from formatting its own
+        config['loggers']['uvicorn.access'] = {'handlers': [], 'level': 'WARNING', 'propagate': False}
+
+    return config
+
+
+def _apply_multiprocess_mode(config: dict, multiprocess_mode: str | None, log_handlers: list, log_file_path: str, log_socket_path: str | None) -> None:
+    """Give every worker its own log files, or replace the file handlers with a socket handler to an aggregator"""
+    if multiprocess_mode == 'per_worker':
+        for name in (*FILE_HANDLERS, 'ring_buffer_file'):
+            handler = config['handlers'][name]
+            handler['()'] = per_worker_file_handler
+            handler['handler_class'] = handler.pop('class')
+            # Workers are forked from a process that configures logging too, only create files that are written to.
+            # A forked worker reopens the handler under its own process id on its first record.
+            handler['delay'] = True
+    elif multiprocess_mode == 'aggregator':
+        # The socket handler pickles the raw record, formatting happens in the aggregator
+        config['filters'] = {'request_context': {'()': RequestContextFilter}}
+        config['handlers']['socket'] = {
+            'class': 'logging.handlers.SocketHandler',
+            'host': log_socket_path or f'{log_file_path}.sock',
+            'port': None,
+            'filters': ['request_context'],
+        }
+        config['handlers']['ring_buffer']['target'] = 'socket'
+        # dictConfig() creates every handler in the dictionary, only the aggregator may open the log file
+        for name in FILE_HANDLERS:
+            del config['handlers'][name]
+        handlers = list(dict.fromkeys('socket' if name in FILE_HANDLERS else name for name in log_handlers))
+        for logger in config['loggers'].values():
+            if logger['handlers']:
+                logger['handlers'] = handlers
+
+
+def _apply_ring_buffer(config: dict, log_handlers: list, log_level: int) -> None:
+    """Send every record to the ring buffer while the other handlers keep filtering at log_level"""
+    if 'ring_buffer' not in log_handlers:
+        return
+    # Runs after _apply_multiprocess_mode(), the socket handler replacing the file handlers must not ship DEBUG records
+    for name in dict.fromkeys(name for logger in config['loggers'].values() for name in logger['handlers']):
+        if name != 'ring_buffer':
+            config['handlers'][name]['level'] = logging.getLevelName(log_level)
+    for logger in config['loggers'].values():
+        logger['level'] = 'DEBUG'
+
+
+def per_worker_file_handler(handler_class: type, filename: str, **kwargs) -> logging.Handler:
+    """
+    Create a file handler that writes to a file of its own for the current process.
+
+    The process id is added before the file extension, so 'fastapi.log' becomes 'fastapi.1234.log'. Rotation then only
+    ever happens in the process that owns the file. When logging is configured before workers are forked, e.g. by
+    gunicorn, a worker switches to a file with its own process id on the first record it emits. Files of exited workers
+    are never removed, so every worker restart leaves one more file behind; clean them up with the tool that archives
+    the logs.
+
+    :param handler_class: File handler class to create, e.g. logging.handlers.TimedRotatingFileHandler
+    :type handler_class: type
+    :param filename: Path to the shared log file
+    :type filename: str
+    :return: File handler for the current process
+    :rtype: logging.Handler
+    """
+    if isinstance(handler_class, str):
+        handler_class = logging.config.BaseConfigurator({}).resolve(handler_class)
+    handler = _per_worker_class(handler_class)(_worker_filename(filename), **kwargs)
+    handler.shared_filename = filename
+    handler.pid = os.getpid()
+    return handler
+
+
+def _worker_filename(filename: str) -> str:
+    """Add the current process id before the file extension"""
+    root, ext = os.path.splitext(filename)
+    return f'{root}.{os.getpid()}{ext}'
+
+
+@lru_cache(maxsize=8)
+def _per_worker_class(handler_class: type) -> type:
+    """Subclass a file handler class to reopen its file under the process id of a forked worker"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Called with the handler lock held. os.getpid() is cheap, there is no fork hook to register per handler.
+        pid = os.getpid()
+        if pid != self.pid:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            self.baseFilename = os.path.abspath(_worker_filename(self.shared_filename))
+            self.pid = pid
+        handler_class.emit(self, record)
+
+    return type(f'PerWorker{handler_class.__name__}', (handler_class,), {'emit': emit})
+
+
+class LogAggregator:
+    """
+    Receive log records from worker processes over a Unix socket and handle them in a single process.
+
+    Workers send records with logging.handlers.SocketHandler (see log_config with multiprocess_mode='aggregator').
+    All connections are served from one thread, so the handlers in this process never compete for their locks and
+    rotating file handlers rotate exactly once. Records are unpickled, so the socket is created with owner-only
+    permissions and must not be reachable by untrusted processes.
+    """
+
+    def __init__(self, socket_path: str):
+        """
+        Create an aggregator, the socket is created by bind() or serve_forever().
+
+        :param socket_path: Path of the Unix socket to listen on
+        :type socket_path: str
+        """
+        self.socket_path = socket_path
+        self._selector = selectors.DefaultSelector()
+        self._buffers = {}
+        self._server = None
+        self._running = False
+
+    def bind(self) -> None:
+        """Create and listen on the Unix socket, replacing a stale socket file if present"""
+        # Listen on a temporary path first and move it into place, workers never see a socket that refuses connections
+        pending_path = f'{self.socket_path}.{os.getpid()}'
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(pending_path)
+        os.chmod(pending_path, 0o600)
+        server.listen()
+        os.replace(pending_path, self.socket_path)
+        server.setblocking(False)
+        self._selector.register(server, selectors.EVENT_READ)
+        self._server = server
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        """
+        Handle incoming records until shutdown() is called.
+
+        :param poll_interval: Seconds between checks for a shutdown request
+        :type poll_interval: float
+        """
+        if self._server is None:
+            self.bind()
+        self._running = True
+        try:
+            while self._running:
+                for key, _ in self._selector.select(poll_interval):
+                    if key.fileobj is self._server:
+                        self._accept()
+                    else:
+                        self._read(key.fileobj)
+        finally:
+            self.server_close()
+
+    def shutdown(self) -> None:
+        """Stop serve_forever() after the current poll"""
+        self._running = False
+
+    def server_close(self) -> None:
+        """Close all connections and remove the socket file"""
+        for conn in list(self._buffers):
+            self._close(conn)
+        if self._server is not None:
+            self._selector.unregister(self._server)
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def handle(self, record: logging.LogRecord) -> None:
+        """Dispatch a received record to the logger it was logged on"""
+        logging.getLogger(record.name).handle(record)
+
+    def _accept(self) -> None:
+        conn, _ = self._server.accept()
+        conn.setblocking(False)
+        self._selector.register(conn, selectors.EVENT_READ)
+        self._buffers[conn] = bytearray()
+
+    def _close(self, conn: socket.socket) -> None:
+        self._selector.unregister(conn)
+        conn.close()
+        del self._buffers[conn]
+
+    def _read(self, conn: socket.socket) -> None:
+        try:
+            chunk = conn.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self._close(conn)
+            return
+
+        # Records are pickled dictionaries prefixed with their length as a 4-byte big-endian integer
+        buffer = self._buffers[conn]
+        buffer += chunk
+        offset = 0
+        prefix = RECORD_LENGTH_PREFIX.size
+        while len(buffer) - offset >= prefix:
+            size = RECORD_LENGTH_PREFIX.unpack_from(buffer, offset)[0]
+            if len(buffer) - offset - prefix < size:
+                break
+            try:
+                record = logging.makeLogRecord(pickle.loads(buffer[offset + prefix : offset + prefix + size]))
+            except (pickle.UnpicklingError, EOFError, ValueError, TypeError) as e:
+                # A corrupt frame leaves the rest of the stream unusable, drop this connection and keep serving the others
+                sys.stderr.write(f'Log aggregator dropped a connection after a corrupt record: {e!r}\n')
+                self._close(conn)
+                return
+            self.handle(record)
+            offset += prefix + size
+        del buffer[:offset]
+
+
+def run_log_aggregator(socket_path: str, config: dict) -> None:
+    """
+    Configure logging from a dictionary and serve a LogAggregator until the process is stopped.
+
+    :param socket_path: Unix socket the workers send their records to
+    :type socket_path: str
+    :param config: Logging configuration for the aggregator, usually log_config() with file handlers only
+    :type config: dict
+    """
+    logging.config.dictConfig(config)
+    LogAggregator(socket_path).serve_forever()
+
+
+def start_log_aggregator(socket_path: str, config: dict, timeout: float = 5.0):
+    """
+    Start a LogAggregator in a daemon process and wait until it accepts connections.
+
+    Call this before starting the workers, for example before uvicorn.run(..., workers=4), so no records are lost
+    while the socket is being created.
+
+    :param socket_path: Unix socket the workers send their records to
+    :type socket_path: str
+    :param config: Logging configuration for the aggregator, usually log_config() with file handlers only
+    :type config: dict
+    :param timeout: Seconds to wait for the socket to appear
+    :type timeout: float
+    :return: The aggregator process
+    :rtype: multiprocessing.Process
+    :raises TimeoutError: If the aggregator does not create the socket in time
+    """
+    import multiprocessing  # noqa: PLC0415
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    process = multiprocessing.Process(target=run_log_aggregator, args=(socket_path, config), name='tunsberg-log-aggregator', daemon=True)
+    process.start()
+
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(socket_path):
+        if not process.is_alive() or time.monotonic() > deadline:
+            process.terminate()
+            raise TimeoutError(f'Log aggregator did not start listening on {socket_path}')
+        time.sleep(0.01)
+    return process
+
+
+class RingBufferHandler(logging.handlers.MemoryHandler):
+    """
+    Keep the most recent records in memory and write them to a target handler only when they are needed.
+
+    Records are kept in a preallocated ring of the last capacity records, optionally also limited to roughly max_bytes.
+    Only the raw record fields are stored: messages are not formatted until the buffer is dumped, which happens when a
+    record of flushLevel or above arrives, when dump() is called, or on a signal installed with
+    install_signal_handler(). Tracebacks are rendered when the record is stored so no frames are kept alive.
+
+    Unlike MemoryHandler, flush() does not write the buffer, so logging.shutdown() does not dump it at exit unless
+    flushOnClose is set.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1000,
+        flushLevel: int = logging.ERROR,  # noqa: N803
+        target: logging.Handler | None = None,
+        flushOnClose: bool = False,  # noqa: N803
+        max_bytes: int | None = None,
+    ):
+        """
+        Create a ring buffer handler, the camel case arguments match logging.handlers.MemoryHandler.
+
+        :param capacity: Maximum number of records kept, defaults to 1000
+        :type capacity: int
+        :param flushLevel: Level of records that trigger a dump, defaults to logging.ERROR
+        :type flushLevel: int
+        :param target: Handler the buffered records are written to
+        :type target: logging.Handler or None
+        :param flushOnClose: Whether to dump the buffer when the handler is closed, defaults to False
+        :type flushOnClose: bool
+        :param max_bytes: Approximate maximum size of the buffered messages and tracebacks, None for no limit
+        :type max_bytes: int or None
+        """
+        super().__init__(capacity, flushLevel=flushLevel, target=target, flushOnClose=flushOnClose)
+        self.max_bytes = max_bytes
+        self.buffer = [None] * capacity
+        self._sizes = [0] * capacity
+        self._start = 0
+        self._count = 0
+        self._bytes = 0
+        self._dump_requested = None
+        self._dump_thread = None
+
+    def __len__(self) -> int:
+        """Return the number of buffered records"""
+        return self._count
+
+    def shouldFlush(self, record: logging.LogRecord) -> bool:  # noqa: N802
+        """Dump when a record at or above the flush level arrives, a full buffer only drops its oldest record"""
+        return record.levelno >= self.flushLevel
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Store the record and dump the buffer if the record calls for it"""
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = _TRACEBACK_FORMATTER.formatException(record.exc_info)
+        request_id = record.__dict__.get('request_id')
+        if request_id is None:
+            context = request_context.get()
+            if context is not None:
+                request_id = context.request_id
+        entry = (
+            record.name,
+            record.levelno,
+            record.levelname,
+            record.pathname,
+            record.filename,
+            record.module,
+            record.lineno,
+            record.msg,
+            record.args,
+            exc_text,
+            record.funcName,
+            record.stack_info,
+            record.created,
+            record.msecs,
+            record.relativeCreated,
+            record.thread,
+            record.threadName,
+            record.process,
+            request_id,
+            record.__dict__.get('extra_fields'),
+        )
+        size = _RING_ENTRY_OVERHEAD + len(str(record.msg)) + len(exc_text or '')
+
+        if self._count == self.capacity:
+            self._drop_oldest()
+        index = (self._start + self._count) % self.capacity
+        self.buffer[index] = entry
+        self._sizes[index] = size
+        self._count += 1
+        self._bytes += size
+        while self.max_bytes is not None and self._bytes > self.max_bytes and self._count > 1:
+            self._drop_oldest()
+
+        if self.shouldFlush(record):
+            self.dump()
+
+    def dump(self) -> None:
+        """Write every buffered record to the target handler, oldest first, and empty the buffer"""
+        with self.lock:
+            entries = [self.buffer[(self._start + i) % self.capacity] for i in range(self._count)]
+            self.buffer = [None] * self.capacity
+            self._sizes = [0] * self.capacity
+            self._start = self._count = self._bytes = 0
+            if self.target is None:
+                return
+            for entry in entries:
+                record = logging.makeLogRecord(dict(zip(_RING_FIELDS, entry, strict=True)))
+                if record.request_id is None:
+                    del record.request_id
+                if record.extra_fields is None:
+                    del record.extra_fields
+                self.target.handle(record)
+            self.target.flush()
+
+    def flush(self) -> None:
+        """Flush the target handler without writing the buffer"""
+        with self.lock:
+            if self.target is not None:
+                self.target.flush()
+
+    def close(self) -> None:
+        """Close the handler, dumping the buffer first if flushOnClose is set"""
+        try:
+            if self.flushOnClose:
+                self.dump()
+        finally:
+            with self.lock:
+                self.target = None
+                logging.Handler.close(self)
+
+    def install_signal_handler(self, signum: int = signal.SIGUSR2) -> None:
+        """
+        Dump the buffer from a background thread when a signal is received.
+
+        :param signum: Signal to listen for, defaults to SIGUSR2
+        :type signum: int
+        """
+        # The signal handler runs between two bytecodes of whatever the main thread was doing, possibly in the middle of
+        # emit() with the reentrant handler lock already held. It only wakes a thread, which dumps once emit() is done.
+        if self._dump_thread is None:
+            self._dump_requested = threading.Event()
+            self._dump_thread = threading.Thread(target=self._dump_on_request, name='tunsberg-ring-buffer-dump', daemon=True)
+            self._dump_thread.start()
+        signal.signal(signum, lambda received_signum, frame: self._dump_requested.set())
+
+    def _dump_on_request(self) -> None:
+        while True:
+            self._dump_requested.wait()
+            self._dump_requested.clear()
+            self.dump()
+
+    def _drop_oldest(self) -> None:
+        self.buffer[self._start] = None
+        self._bytes -= self._sizes[self._start]
+        self._start = (self._start + 1) % self.capacity
+        self._count -= 1
+
+
+# Field names of the tuples stored by RingBufferHandler, in order
+_RING_FIELDS = (
+    'name',
+    'levelno',
+    'levelname',
+    'pathname',
+    'filename',
+    'module',
+    'lineno',
+    'msg',
+    'args',
+    'exc_text',
+    'funcName',
+    'stack_info',
+    'created',
+    'msecs',
+    'relativeCreated',
+    'thread',
+    'threadName',
+    'process',
+    'request_id',
+    'extra_fields',
+)
+# Rough size of a stored record without its message and traceback, used for max_bytes
+_RING_ENTRY_OVERHEAD = 256
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+
+class LogLevelController:
+    """
+    Change logger levels and handlers of a running process without restarting it.
+
+    Every override remembers the original level and handlers of the logger so it can be reverted, either explicitly or
+    automatically once its TTL has passed. Overrides can be applied from code, a signal, a polled control file or the
+    ASGI app returned by asgi_app().
+
+    A control file or request body is a JSON object like:
+        {"loggers": {"uvicorn": {"level": "DEBUG", "ttl": 300}, "tunsberg": {"handlers": ["console"]}}, "revert": ["app"]}
+    """
+
+    def __init__(self, loggers: list[str] | None = None):
+        """
+        Create a controller.
+
+        :param loggers: Loggers changed by the signal handler, defaults to the loggers configured by log_config()
+        :type loggers: list or None
+        """
+        self.loggers = loggers if loggers is not None else ['uvicorn', 'uvicorn.error', 'uvicorn.access', 'tunsberg']
+        self._lock = threading.RLock()
+        self._originals = {}
+        self._timers = {}
+        self._expires = {}
+        self._watch_stop = None
+        self._toggle_requested = None
+        self._toggle_thread = None
+        self._toggle_options = (logging.DEBUG, None)
+
+    def override(self, logger_name: str, level: int | str | None = None, handlers: list[str] | None = None, ttl: float | None = None) -> None:
+        """
+        Override the level and/or handlers of a logger.
+
+        :param logger_name: Name of the logger, '' for the root logger
+        :type logger_name: str
+        :param level: New level as an integer or level name
+        :type level: int or str or None
+        :param handlers: Names of already configured handlers the logger should use instead of its current ones
+        :type handlers: list or None
+        :param ttl: Seconds after which the override is reverted, None to keep it until revert() is called
+        :type ttl: float or None
+        :raises ValueError: If the level, a handler name or the TTL is invalid
+        """
+        self._override(logger_name, *_resolve_override(level, handlers, ttl))
+
+    def _override(self, logger_name: str, level: int | None, new_handlers: list[logging.Handler] | None, ttl: float | None) -> None:
+        # Only called with a validated override, so the logger is never left changed without its revert timer
+        logger = logging.getLogger(logger_name)
+        with self._lock:
+            self._originals.setdefault(logger_name, (logger.level, list(logger.handlers)))
+            if level is not None:
+                logger.setLevel(level)
+            if new_handlers is not None:
+                logger.handlers = new_handlers
+
+            self._cancel_timer(logger_name)
+            if ttl is not None:
+                timer = threading.Timer(ttl, self._expire, args=(logger_name,))
+                timer.daemon = True
+                self._timers[logger_name] = timer
+                self._expires[logger_name] = time.monotonic() + ttl
+                timer.start()
+
+    def set_level(self, logger_name: str, level: int | str, ttl: float | None = None) -> None:
+        """Override the level of a logger, see override()"""
+        self.override(logger_name, level=level, ttl=ttl)
+
+    def set_handlers(self, logger_name: str, handlers: list[str], ttl: float | None = None) -> None:
+        """Override the handlers of a logger, see override()"""
+        self.override(logger_name, handlers=handlers, ttl=ttl)
+
+    def revert(self, logger_name: str | None = None) -> None:
+        """
+        Restore the original level and handlers of a logger.
+
+        :param logger_name: Name of the logger, None to revert every override
+        :type logger_name: str or None
+        """
+        with self._lock:
+            names = list(self._originals) if logger_name is None else [logger_name]
+            for name in names:
+                original = self._originals.pop(name, None)
+                if original is None:
+                    continue
+                self._cancel_timer(name)
+                logger = logging.getLogger(name)
+                logger.setLevel(original[0])
+                logger.handlers = original[1]
+
+    def overrides(self) -> dict:
+        """
+        Describe the active overrides.
+
+        :return: Current level, handler names and seconds until revert for every overridden logger
+        :rtype: dict
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = {}
+            for name in self._originals:
+                logger = logging.getLogger(name)
+                expires = self._expires.get(name)
+                state[name] = {
+                    'level': logging.getLevelName(logger.level),
+                    'handlers': [handler.name for handler in logger.handlers],
+                    'expires_in': round(max(expires - now, 0), 3) if expires is not None else None,
+                }
+            return state
+
+    def apply(self, spec: dict) -> None:
+        """
+        Apply overrides described by a dictionary, see the class documentation for the format.
+
+        :param spec: Overrides to apply
+        :type spec: dict
+        :raises ValueError: If the specification is invalid
+        """
+        if not isinstance(spec, dict):
+            raise ValueError('Log control specification must be an object')
+        revert = spec.get('revert', [])
+        if not isinstance(revert, list) or not all(isinstance(name, str) for name in revert):
+            raise ValueError('Log control revert must be a list of logger names')
+        loggers = spec.get('loggers', {})
+        if not isinstance(loggers, dict):
+            raise ValueError('Log control loggers must be an object')
+
+        # Validate the whole specification before changing anything, so an invalid one is not applied partially
+        overrides = {}
+        for name, options in loggers.items():
+            if not isinstance(options, dict):
+                raise ValueError(f'Log control options for {name} must be an object')
+            overrides[name] = _resolve_override(options.get('level'), options.get('handlers'), options.get('ttl'))
+
+        for name in revert:
+            self.revert(name)
+        for name, override in overrides.items():
+            self._override(name, *override)
+
+    def install_signal_handler(self, signum: int = signal.SIGUSR1, level: int = logging.DEBUG, ttl: float | None = 300) -> None:
+        """
+        Toggle verbose logging for the controlled loggers when a signal is received.
+
+        The first signal sets the level of every logger in self.loggers, the next one reverts them. The change is made by a
+        background thread, shortly after the signal. Signal handlers can only be installed from the main thread.
+
+        :param signum: Signal to listen for, defaults to SIGUSR1
+        :type signum: int
+        :param level: Level to switch to, defaults to logging.DEBUG
+        :type level: int
+        :param ttl: Seconds after which the loggers are reverted automatically, defaults to 300
+        :type ttl: float or None
+        """
+        # The signal handler runs between two bytecodes of the main thread, possibly while it holds the controller or
+        # logging lock, and starting a TTL timer takes a threading lock too. It only wakes a thread, which toggles.
+        self._toggle_options = (level, ttl)
+        if self._toggle_thread is None:
+            self._toggle_requested = threading.Event()
+            self._toggle_thread = threading.Thread(target=self._toggle_on_request, name='tunsberg-log-toggle', daemon=True)
+            self._toggle_thread.start()
+        signal.signal(signum, lambda received_signum, frame: self._toggle_requested.set())
+
+    def _toggle_on_request(self) -> None:
+        while True:
+            self._toggle_requested.wait()
+            self._toggle_requested.clear()
+            level, ttl = self._toggle_options
+            with self._lock:
+                if any(name in self._originals for name in self.loggers):
+                    for name in self.loggers:
+                        self.revert(name)
+                else:
+                    for name in self.loggers:
+                        self.set_level(name, level, ttl=ttl)
+
+    def watch_file(self, path: str, interval: float = 1.0) -> None:
+        """
+        Poll a JSON control file and apply it whenever it changes.
+
+        Only the modification time and size of the file are checked between changes. Removing the file reverts every
+        override.
+
+        :param path: Path to the control file
+        :type path: str
+        :param interval: Seconds between polls, defaults to 1.0
+        :type interval: float
+        """
+        self.stop()
+        stop = threading.Event()
+        self._watch_stop = stop
+        threading.Thread(target=self._watch, args=(path, interval, stop), name='tunsberg-log-control', daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop watching the control file"""
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+            self._watch_stop = None
+
+    def poll_file(self, path: str, last_seen: tuple | None = None) -> tuple | None:
+        """
+        Apply a control file if it changed since the last poll.
+
+        :param path: Path to the control file
+        :type path: str
+        :param last_seen: Value returned by the previous poll
+        :type last_seen: tuple or None
+        :return: Modification time and size of the file, None if it does not exist
+        :rtype: tuple or None
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if last_seen is not None:
+                self.revert()
+            return None
+        except OSError:
+            logging.getLogger(__name__).exception('Cannot read log control file %s', path)
+            return last_seen
+
+        seen = (stat.st_mtime_ns, stat.st_size)
+        if seen != last_seen:
+            try:
+                with open(path) as f:
+                    self.apply(json.load(f))
+            except ValueError:
+                logging.getLogger(__name__).exception('Invalid log control file %s', path)
+            except OSError:
+                logging.getLogger(__name__).exception('Cannot read log control file %s', path)
+        return seen
+
+    def asgi_app(self):
+        """
+        Create an ASGI app for changing log levels over HTTP.
+
+        GET returns the active overrides, POST applies a JSON specification and DELETE reverts every override. Mount it
+        behind authentication, e.g. app.mount('/admin/logging', controller.asgi_app()).
+
+        :return: ASGI application
+        """
+
+        async def app(scope, receive, send):
+            if scope['type'] != 'http':
+                return
+            status = 200
+            payload = None
+            if scope['method'] == 'POST':
+                body = b''
+                more_body = True
+                while more_body:
+                    message = await receive()
+                    body += message.get('body', b'')
+                    more_body = message.get('more_body', False)
+                try:
+                    self.apply(json.loads(body))
+                except ValueError as e:
+                    status, payload = 400, {'error': str(e)}
+            elif scope['method'] == 'DELETE':
+                self.revert()
+            elif scope['method'] != 'GET':
+                status, payload = 405, {'error': 'Method not allowed'}
+            if payload is None:
+                payload = self.overrides()
+
+            content = json.dumps(payload).encode()
+            headers = [(b'content-type', b'application/json'), (b'content-length', str(len(content)).encode())]
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': content})
+
+        return app
+
+    def _watch(self, path: str, interval: float, stop: threading.Event) -> None:
+        last_seen = None
+        while not stop.is_set():
+            last_seen = self.poll_file(path, last_seen)
+            stop.wait(interval)
+
+    def _expire(self, logger_name: str) -> None:
+        # Runs in the timer thread. A timer that fired while a newer override replaced it must not revert that one.
+        with self._lock:
+            if self._timers.get(logger_name) is threading.current_thread():
+                self.revert(logger_name)
+
+    def _cancel_timer(self, logger_name: str) -> None:
+        timer = self._timers.pop(logger_name, None)
+        if timer is not None:
+            timer.cancel()
+        self._expires.pop(logger_name, None)
+
+
+def _resolve_level(level: int | str) -> int:
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    if not isinstance(level, int) or isinstance(level, bool) or logging.getLevelName(level).startswith('Level'):
+        raise ValueError('Invalid log level')
+    return level
+
+
+def _resolve_override(level, handlers, ttl) -> tuple[int | None, list[logging.Handler] | None, float | None]:
+    level = _resolve_level(level) if level is not None else None
+    if handlers is not None:
+        if not isinstance(handlers, list) or not all(isinstance(name, str) for name in handlers):
+            raise ValueError('Log handlers must be a list of handler names')
+        handlers = [_find_handler(name) for name in handlers]
+    if ttl is not None:
+        if not isinstance(ttl, (int, float)) or isinstance(ttl, bool) or not math.isfinite(ttl) or ttl <= 0:
+            raise ValueError('Invalid log override TTL, expected a positive number of seconds')
+        ttl = float(ttl)
+    return level, handlers, ttl
+
+
+def _find_handler(name: str) -> logging.Handler:
+    # Handlers configured by dictConfig() but not attached to any logger, e.g. 'file' while only 'console' is used, are
+    # only reachable by name. logging.getHandlerByName() was added in Python 3.12.
+    if hasattr(logging, 'getHandlerByName'):
+        handler = logging.getHandlerByName(name)
+    else:
+        with logging._lock:
+            handler = logging._handlers.get(name)
+    if handler is None:
+        raise ValueError(f'Unknown log handler: {name}')
+    return handler
+
 
 def uvicorn_log_config(
     log_level: int = logging.DEBUG, log_file_path: str = 'uvicorn.log', log_format: str = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
@@ -222,6 +1250,193 @@ def check_required_env_vars(required_env_vars: dict, env: str, live_envs: [] or
     :rtype: bool or None
     :raises ValueError: If any required environment variable is not set
     """
+    # Validate if all required environment variables are set
+    missing_vars = [env_var for env_var in _required_env_var_names(required_env_vars, env, live_envs, code_build) if getenv(env_var) is None]
+
+    if missing_vars:
+        missing_vars_str = ', '.join(missing_vars)
+        raise ValueError(f'Environment Config Error: The following variables are not set: {missing_vars_str}')
+
+    return True
+
+
+class Settings:
+    """
+    Immutable snapshot of typed configuration values created by load_settings().
+
+    Every snapshot is an instance of a subclass with one slot per variable, so reading a value is a plain attribute
+    access. Values cannot be changed after the snapshot has been created.
+    """
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        """Prevent changing values"""
+        raise AttributeError('Settings are read-only')
+
+    def __delattr__(self, name):
+        """Prevent removing values"""
+        raise AttributeError('Settings are read-only')
+
+    def __eq__(self, other):
+        """Compare the values of two snapshots"""
+        if not isinstance(other, Settings):
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    def __hash__(self):
+        """Hash the sorted variable names, values may not be hashable and equal snapshots may list them in any order"""
+        return hash(tuple(sorted(self.__slots__)))
+
+    def __reduce__(self):
+        """Copy and pickle through the values, the class of a snapshot is created on the fly"""
+        return _make_settings, (self.as_dict(),)
+
+    def __repr__(self):
+        """Show the variable names without their values, which may be secrets"""
+        return f'Settings({", ".join(self.__slots__)})'
+
+    def as_dict(self) -> dict:
+        """
+        Get all values.
+
+        :return: Values by variable name
+        :rtype: dict
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def parse_bool(value: str) -> bool:
+    """
+    Parse a boolean environment variable.
+
+    :param value: One of 1/0, true/false, yes/no or on/off, case insensitive
+    :type value: str
+    :return: Parsed value
+    :rtype: bool
+    :raises ValueError: If the value is not a boolean
+    """
+    lowered = value.strip().lower()
+    if lowered in {'1', 'true', 'yes', 'on'}:
+        return True
+    if lowered in {'0', 'false', 'no', 'off'}:
+        return False
+    # The value is left out of the message, it ends up in logs and could be a secret
+    raise ValueError('not a boolean')
+
+
+def parse_list(value: str) -> list[str]:
+    """
+    Parse a comma separated environment variable.
+
+    :param value: Comma separated values
+    :type value: str
+    :return: Stripped, non-empty values
+    :rtype: list
+    """
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def parse_url(value: str) -> str:
+    """
+    Validate a URL environment variable.
+
+    :param value: URL with scheme and host, e.g. 'postgresql://db:5432/app'
+    :type value: str
+    :return: The URL
+    :rtype: str
+    :raises ValueError: If the scheme or host is missing
+    """
+    parts = urlsplit(value.strip())
+    if not parts.scheme or not parts.netloc:
+        raise ValueError('not a URL with scheme and host')
+    return value.strip()
+
+
+SETTINGS_PARSERS = {bool: parse_bool, list: parse_list}
+
+
+def load_settings(
+    required_env_vars: dict, env: str, live_envs: list | None = None, code_build: bool = False, environ: Mapping[str, str] | None = None
+) -> Settings:
+    """
+    Read, parse and validate environment variables once and return them as an immutable snapshot.
+
+    Uses the same specification as check_required_env_vars, extended with optional 'type', 'parser' and 'default'
+    keys. 'type' is a callable that converts the raw string, bool and list are parsed with parse_bool and parse_list.
+    'parser' takes precedence over 'type'. Variables that are not set use their default, or None.
+
+    Example for required_env_vars:
+        {
+            'ENV': {'runtime': True, 'build': True},
+            'WORKERS': {'runtime': False, 'build': False, 'type': int, 'default': 4},
+            'DATABASE_URL': {'runtime': True, 'build': False, 'parser': parse_url},
+        }
+
+    :param required_env_vars: Environment variable specification
+    :type required_env_vars: dict
+    :param env: Current environment
+    :type env: str
+    :param live_envs: List of live environments
+    :type live_envs: list or None
+    :param code_build: Whether the code is being built
+    :type code_build: bool
+    :param environ: Mapping to read the variables from, defaults to os.environ
+    :type environ: Mapping or None
+    :return: Settings snapshot with one attribute per variable
+    :rtype: Settings
+    :raises ValueError: Listing every variable that is required but not set or that could not be parsed, without values
+    """
+    if environ is None:
+        environ = os.environ
+
+    required = set(_required_env_var_names(required_env_vars, env, live_envs, code_build))
+    values = {}
+    missing_vars = []
+    invalid_vars = []
+    for env_var, spec in required_env_vars.items():
+        raw = environ.get(env_var)
+        if raw is None:
+            if env_var in required and 'default' not in spec:
+                missing_vars.append(env_var)
+            values[env_var] = spec.get('default')
+            continue
+
+        expected = spec.get('parser') or spec.get('type')
+        parser = spec.get('parser') or SETTINGS_PARSERS.get(spec.get('type'), spec.get('type'))
+        try:
+            values[env_var] = parser(raw) if parser is not None else raw
+        except (TypeError, ValueError):
+            # Only name the variable, the error of the parser can repeat the value, which could be a secret
+            invalid_vars.append(f'{env_var} (expected {getattr(expected, "__name__", type(expected).__name__)})')
+
+    errors = []
+    if missing_vars:
+        errors.append(f'The following variables are not set: {", ".join(missing_vars)}')
+    if invalid_vars:
+        errors.append(f'The following variables are invalid: {", ".join(invalid_vars)}')
+    if errors:
+        raise ValueError(f'Environment Config Error: {"; ".join(errors)}')
+
+    return _make_settings(values)
+
+
+def _make_settings(values: dict) -> Settings:
+    settings = _settings_class(tuple(values))()
+    for name, value in values.items():
+        object.__setattr__(settings, name, value)
+    return settings
+
+
+@lru_cache(maxsize=32)
+def _settings_class(names: tuple[str, ...]) -> type:
+    invalid_names = [name for name in names if not name.isidentifier() or keyword.iskeyword(name)]
+    if invalid_names:
+        raise ValueError(f'Environment Config Error: The following variables are not valid attribute names: {", ".join(invalid_names)}')
+    return type('Settings', (Settings,), {'__slots__': names})
+
+
+def _required_env_var_names(required_env_vars: dict, env: str, live_envs: list | None, code_build: bool) -> list[str]:
     if live_envs is None:
         live_envs = ['production', 'prod']
 
@@ -229,15 +1444,219 @@ def check_required_env_vars(required_env_vars: dict, env: str, live_envs: [] or
     is_code_build = code_build
 
     # Select environment variables based on current environment (production or build)
-    req_env_vars = [
-        env_var for env_var, conditions in required_env_vars.items() if (conditions['runtime'] and is_runtime) or (conditions['build'] and is_code_build)
+    return [
+        env_var
+        for env_var, conditions in required_env_vars.items()
+        if (conditions.get('runtime') and is_runtime) or (conditions.get('build') and is_code_build)
     ]
 
-    # Validate if all required environment variables are set
-    missing_vars = [env_var for env_var in req_env_vars if getenv(env_var) is None]
 
-    if missing_vars:
-        missing_vars_str = ', '.join(missing_vars)
-        raise ValueError(f'Environment Config Error: The following variables are not set: {missing_vars_str}')
+def parse_env_file(path: str) -> dict[str, str]:
+    """
+    Read variables from a .env file.
 
-    return True
+    Lines have the form KEY=VALUE and may start with 'export '. Values can be wrapped in single or double quotes,
+    double quoted values support escaped newlines. Empty lines, lines starting with '#' and comments after unquoted values
+    are ignored.
+
+    :param path: Path to the .env file
+    :type path: str
+    :return: Values by variable name
+    :rtype: dict
+    """
+    values = {}
+    with open(path, encoding='utf-8') as f:
+        for raw_line in f:
+            line = raw_line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            key = key.removeprefix('export ').strip()
+            value = value.strip()
+            if len(value) > 1 and value[0] == value[-1] and value[0] in {'"', "'"}:
+                quote, value = value[0], value[1:-1]
+                if quote == '"':
+                    value = value.replace('\\n', '\n').replace('\\"', '"')
+            elif ' #' in value:
+                value = value.split(' #', 1)[0].rstrip()
+            values[key] = value
+    return values
+
+
+class SettingsLoader:
+    """
+    Load settings from the process environment, .env files and a secrets directory, and reload them when files change.
+
+    A secrets directory holds one file per variable, named after the variable, as mounted by Docker and Kubernetes.
+    The process environment takes precedence over the secrets directory, which takes precedence over .env files, later
+    files override earlier ones. Files are only read again when their modification time, size or inode changes, so
+    polling costs one stat() per file. Subscribers are called with the new snapshot and the names of the changed
+    variables after every successful reload. A reload that fails validation is logged and the previous snapshot is kept.
+    A file that cannot be read fails the first load, on later reloads it keeps the values it was last read with.
+    """
+
+    def __init__(  # noqa: PLR0913, PLR0917
+        self,
+        required_env_vars: dict,
+        env: str,
+        live_envs: list | None = None,
+        code_build: bool = False,
+        env_files: list[str] | None = None,
+        secrets_dir: str | None = None,
+    ):
+        """
+        Create a loader and load the first snapshot.
+
+        :param required_env_vars: Environment variable specification, see load_settings()
+        :type required_env_vars: dict
+        :param env: Current environment
+        :type env: str
+        :param live_envs: List of live environments
+        :type live_envs: list or None
+        :param code_build: Whether the code is being built
+        :type code_build: bool
+        :param env_files: .env files to read, missing files are skipped
+        :type env_files: list or None
+        :param secrets_dir: Directory with one file per variable
+        :type secrets_dir: str or None
+        :raises ValueError: If a file cannot be read or the first snapshot cannot be loaded, see load_settings()
+        """
+        self.required_env_vars = required_env_vars
+        self.env = env
+        self.live_envs = live_envs
+        self.code_build = code_build
+        self.env_files = list(env_files or [])
+        self.secrets_dir = secrets_dir
+        self._files = {}
+        self._secrets_listing = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = None
+        self._refresh_files(strict=True)
+        self._settings = self._load()
+
+    @property
+    def settings(self) -> Settings:
+        """The current settings snapshot"""
+        return self._settings
+
+    def subscribe(self, callback) -> None:
+        """
+        Call a function after every reload that changed at least one value.
+
+        :param callback: Function taking the new Settings and a list of changed variable names
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback) -> None:
+        """Stop calling a function subscribed with subscribe()"""
+        self._subscribers.remove(callback)
+
+    def poll(self) -> bool:
+        """
+        Reload the settings if a file changed.
+
+        :return: Whether the snapshot was replaced
+        :rtype: bool
+        """
+        with self._lock:
+            if not self._refresh_files():
+                return False
+            try:
+                settings = self._load()
+            except ValueError:
+                logging.getLogger(__name__).exception('Reloading settings failed, keeping the previous values')
+                return False
+            previous, self._settings = self._settings, settings
+
+        changed = [name for name, value in settings.as_dict().items() if previous.as_dict().get(name) != value]
+        if not changed:
+            return False
+        for callback in list(self._subscribers):
+            try:
+                callback(settings, changed)
+            except Exception:
+                logging.getLogger(__name__).exception('Settings subscriber %r failed', callback)
+        return True
+
+    def start(self, interval: float = 5.0) -> None:
+        """
+        Poll for changes in a daemon thread.
+
+        :param interval: Seconds between polls, defaults to 5.0
+        :type interval: float
+        """
+        self.stop()
+        stop = threading.Event()
+        self._stop = stop
+
+        def watch():
+            while not stop.wait(interval):
+                try:
+                    self.poll()
+                except Exception:
+                    # Keep the thread alive, otherwise hot reload stays off until the process restarts
+                    logging.getLogger(__name__).exception('Polling settings failed')
+
+        threading.Thread(target=watch, name='tunsberg-settings', daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop polling"""
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def _load(self) -> Settings:
+        environ = {}
+        for path in self.env_files:
+            environ.update(self._files.get(path, (None, {}))[1])
+        if self.secrets_dir is not None:
+            # Secrets that could not be read are left out, so required ones are reported as not set
+            for name in self._secrets_listing or ():
+                environ.update(self._files.get(os.path.join(self.secrets_dir, name), (None, {}))[1])
+        environ.update(os.environ)
+        return load_settings(self.required_env_vars, self.env, self.live_envs, self.code_build, environ=environ)
+
+    def _refresh_files(self, strict: bool = False) -> bool:
+        changed = False
+        for path in self.env_files:
+            changed |= self._refresh_file(path, parse_env_file, strict)
+
+        if self.secrets_dir is not None:
+            try:
+                listing = sorted(name for name in os.listdir(self.secrets_dir) if not name.startswith('.'))
+            except FileNotFoundError:
+                listing = []
+            if listing != self._secrets_listing:
+                changed = True
+                for name in set(self._secrets_listing or ()) - set(listing):
+                    self._files.pop(os.path.join(self.secrets_dir, name), None)
+                self._secrets_listing = listing
+            for name in listing:
+                changed |= self._refresh_file(os.path.join(self.secrets_dir, name), _read_secret, strict)
+        return changed
+
+    def _refresh_file(self, path: str, reader, strict: bool = False) -> bool:
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            cached = self._files.get(path)
+            if cached is not None and cached[0] == signature:
+                return False
+            values = reader(path)
+        except (FileNotFoundError, IsADirectoryError):
+            return self._files.pop(path, None) is not None
+        except (OSError, ValueError) as e:
+            if strict:
+                raise ValueError(f'Environment Config Error: Cannot read {path} ({type(e).__name__})') from e
+            # The file can be replaced while it is read or be unreadable, keep the previous values and read it again on
+            # the next poll
+            logging.getLogger(__name__).exception('Cannot read settings file %s, keeping the previous values', path)
+            return False
+        self._files[path] = (signature, values)
+        return True
+
+
+def _read_secret(path: str) -> dict[str, str]:
+    with open(path, encoding='utf-8') as f:
+        return {os.path.basename(path): f.read().rstrip('\r\n')}
@@ -0,0 +1,496 @@
+"""
+Indexed queries over the JSON log files written by JsonFormatter, including rotated and gzip-compressed ones.
+
+    python -m tunsberg.logquery fastapi.log --since 2024-05-01T12:00 --until 2024-05-01T12:15 --level ERROR
+    python -m tunsberg.logquery fastapi.log --request-id 4f0c2a9e --since 2h
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+from datetime import UTC, datetime, timedelta
+from functools import partial
+from time import time
+
+INDEX_VERSION = 1
+INDEX_DIRECTORY = '.logindex'
+BLOCK_BYTES = 1 << 20
+# Blocks of a plain file scanned by one worker, gzip files are always scanned by a single worker
+BLOCKS_PER_TASK = 64
+# About 1% false positives for the request ID filter of a block
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+
+_LEVELS = logging.getLevelNamesMapping()
+_DURATION = re.compile(r'^(\d+(?:\.\d+)?)([smhd])$')
+# Suffixes added by RotatingFileHandler (.1) and TimedRotatingFileHandler (.2024-05-01 up to .2024-05-01_12-30-00), and
+# by a rotator compressing the rotated file
+_ROTATION_SUFFIX = r'(?:\.\d+|\.\d{4}-\d{2}-\d{2}(?:_\d{2}(?:-\d{2}){0,2})?)?(?:\.gz)?'
+_DURATION_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+
+
+def _bloom_positions(key: str, bits: int) -> list[int]:
+    """Bit positions of a key, derived from one hash with double hashing"""
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], 'little')
+    step = int.from_bytes(digest[8:], 'little') | 1
+    return [(first + i * step) % bits for i in range(BLOOM_HASHES)]
+
+
+def _bloom(keys: set) -> str | None:
+    """Build a Bloom filter of keys, encoded for the index file"""
+    if not keys:
+        return None
+    bits = max(64, -(-len(keys) * BLOOM_BITS_PER_KEY // 8) * 8)
+    array = bytearray(bits // 8)
+    for key in keys:
+        for position in _bloom_positions(key, bits):
+            array[position >> 3] |= 1 << (position & 7)
+    return base64.b64encode(array).decode()
+
+
+def _bloom_contains(bloom: str | None, key: str) -> bool:
+    """Whether a key may be in a Bloom filter built by _bloom()"""
+    if bloom is None:
+        return False
+    array = base64.b64decode(bloom)
+    return all(array[position >> 3] & (1 << (position & 7)) for position in _bloom_positions(key, len(array) * 8))
+
+
+def parse_time(value) -> float | None:
+    """
+    Convert the bounds of a query to a Unix timestamp.
+
+    :param value: Unix timestamp, datetime, ISO 8601 string, or a duration before now like '15m', '2h' or '1d'; naive
+        times are UTC
+    :return: Unix timestamp or None when value is None
+    :rtype: float or None
+    """
+    if value is None or isinstance(value, int | float):
+        return value
+    if isinstance(value, str):
+        duration = _DURATION.match(value)
+        if duration:
+            return time() - timedelta(**{_DURATION_UNITS[duration[2]]: float(duration[1])}).total_seconds()
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return value.timestamp()
+
+
+class _BlockBuilder:
+    """Collect the values of the lines of one block"""
+
+    __slots__ = ('end', 'length', 'levels', 'lines', 'loggers', 'offset', 'request_ids', 'start')
+
+    def __init__(self, offset: int):
+        self.offset = offset
+        self.length = 0
+        self.lines = 0
+        self.start = None
+        self.end = None
+        self.levels = set()
+        self.loggers = set()
+        self.request_ids = set()
+
+    def add(self, line: bytes) -> None:
+        self.length += len(line)
+        self.lines += 1
+        try:
+            record = json.loads(line)
+            timestamp = datetime.fromisoformat(record['timestamp']).timestamp()
+        except (ValueError, TypeError, KeyError):
+            # Not written by JsonFormatter, queries skip the line
+            return
+        if self.start is None or timestamp < self.start:
+            self.start = timestamp
+        if self.end is None or timestamp > self.end:
+            self.end = timestamp
+        self.levels.add(record.get('level'))
+        self.loggers.add(record.get('logger'))
+        request_id = record.get('request_id')
+        if request_id is not None:
+            self.request_ids.add(str(request_id))
+
+    def finish(self) -> dict:
+        return {
+            'offset': self.offset,
+            'length': self.length,
+            'lines': self.lines,
+            'start': self.start,
+            'end': self.end,
+            'levels': sorted(level for level in self.levels if level is not None),
+            'loggers': sorted(logger for logger in self.loggers if logger is not None),
+            'request_ids': _bloom(self.request_ids),
+        }
+
+
+def _index_lines(f, offset: int, size: int | None, block_bytes: int) -> tuple[list[dict], int]:
+    """Split complete lines from offset up to size into blocks, return the blocks and the offset after the last line"""
+    blocks = []
+    block = None
+    for line in f:
+        if not line.endswith(b'\n') or (size is not None and offset + len(line) > size):
+            # A line still being written, it is indexed the next time
+            break
+        if block is None:
+            block = _BlockBuilder(offset)
+        block.add(line)
+        offset += len(line)
+        if block.length >= block_bytes:
+            blocks.append(block.finish())
+            block = None
+    if block is not None:
+        blocks.append(block.finish())
+    return blocks, offset
+
+
+def index_path(path: str, index_dir: str | None = None) -> str:
+    """
+    Get the path of the index of a log file.
+
+    :param path: Log file
+    :type path: str
+    :param index_dir: Directory of the index files, defaults to '.logindex' next to the log file
+    :type index_dir: str or None
+    :return: Path of the index file
+    :rtype: str
+    """
+    directory = index_dir if index_dir is not None else os.path.join(os.path.dirname(os.path.abspath(path)), INDEX_DIRECTORY)
+    return os.path.join(directory, os.path.basename(path) + '.json')
+
+
+def index_segment(path: str, index_dir: str | None = None, block_bytes: int = BLOCK_BYTES, rebuild: bool = False) -> dict:
+    """
+    Get the index of a log file, building or extending it when the file changed since it was indexed.
+
+    Lines appended to a plain file since it was indexed are added to the existing index, a file that was replaced, e.g.
+    by rotation, is indexed again. The index is saved when the index directory is writable.
+
+    :param path: Log file, compressed with gzip when its name ends with .gz
+    :type path: str
+    :param index_dir: Directory of the index files, defaults to '.logindex' next to the log file
+    :type index_dir: str or None
+    :param block_bytes: Approximate size of the blocks in bytes, defaults to 1 MiB
+    :type block_bytes: int
+    :param rebuild: Whether to ignore an existing index, defaults to False
+    :type rebuild: bool
+    :return: Index
+    :rtype: dict
+    """
+    stat = os.stat(path)
+    compressed = path.endswith('.gz')
+    destination = index_path(path, index_dir)
+    index = None
+    if not rebuild:
+        try:
+            with open(destination) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            pass
+    if index is not None:
+        same_file = index.get('version') == INDEX_VERSION and index['inode'] == stat.st_ino and index['block_bytes'] == block_bytes
+        if same_file and index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+            return index
+        if not same_file or compressed or stat.st_size < index['end']:
+            index = None
+
+    blocks, offset = (index['blocks'], index['end']) if index is not None else ([], 0)
+    if compressed:
+        with gzip.open(path, 'rb') as f:
+            new_blocks, offset = _index_lines(f, offset, None, block_bytes)
+    else:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            new_blocks, offset = _index_lines(f, offset, stat.st_size, block_bytes)
+    index = {
+        'version': INDEX_VERSION,
+        'inode': stat.st_ino,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'block_bytes': block_bytes,
+        'compressed': compressed,
+        'end': offset,
+        'blocks': blocks + new_blocks,
+    }
+    try:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temporary = f'{destination}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(temporary, destination)
+    except OSError:
+        # Read-only log directories are queried with an index kept in memory
+        pass
+    return index
+
+
+def find_segments(log_file_path: str) -> list[str]:
+    """
+    Find a log file and the files rotated from it, like fastapi.log.1 or fastapi.log.2024-05-01.gz.
+
+    The files of every worker written with multiprocess_mode='per_worker', like fastapi.4711.log and its rotated files,
+    and the dumps of the ring buffer, like fastapi.debug.log, are included as well. Other files sharing the name, like
+    fastapi.log.sock or app.py next to a log file named app, are not.
+
+    :param log_file_path: Path of the log file, as passed to log_config()
+    :type log_file_path: str
+    :return: Paths of the existing files
+    :rtype: list[str]
+    """
+    directory, name = os.path.split(os.path.abspath(log_file_path))
+    stem, ext = os.path.splitext(name)
+    # Ring buffer dumps add .debug and per-worker files the process id before the extension, rotation adds a suffix after
+    pattern = re.compile(rf'{re.escape(stem)}(?:\.debug)?(?:\.\d+)?{re.escape(ext)}{_ROTATION_SUFFIX}')
+    return sorted(os.path.join(directory, entry.name) for entry in os.scandir(directory) if entry.is_file() and pattern.fullmatch(entry.name))
+
+
+class _Criteria:
+    """Conditions of a query, checked against blocks of the index first and lines of the matching blocks next"""
+
+    __slots__ = ('fields', 'level', 'logger', 'needles', 'request_id', 'since', 'until')
+
+    def __init__(self, since: float | None, until: float | None, level: int | None, logger: str | None, request_id: str | None, fields: dict):  # noqa: PLR0913, PLR0917
+        self.since = since
+        self.until = until
+        self.level = level
+        self.logger = logger
+        self.request_id = request_id
+        self.fields = fields
+        # Encoded values every matching line contains, to skip parsing most of the others
+        values = list(fields.values()) + ([request_id] if request_id is not None else [])
+        self.needles = [json.dumps(value).encode() for value in values]
+
+    def _logger_matches(self, name: str) -> bool:
+        return name == self.logger or name.startswith(f'{self.logger}.')
+
+    def matches_block(self, block: dict) -> bool:
+        if self.since is not None or self.until is not None:
+            if block['start'] is None:
+                return False
+            if self.since is not None and block['end'] < self.since:
+                return False
+            if self.until is not None and block['start'] >= self.until:
+                return False
+        if self.level is not None and not any(_LEVELS.get(level, 0) >= self.level for level in block['levels']):
+            return False
+        if self.logger is not None and not any(self._logger_matches(name) for name in block['loggers']):
+            return False
+        return self.request_id is None or _bloom_contains(block['request_ids'], self.request_id)
+
+    def filter(self, data: bytes, block: dict) -> list[dict]:
+        """Parse the lines of a block that match"""
+        check_time = (self.since is not None and block['start'] < self.since) or (self.until is not None and block['end'] >= self.until)
+        records = []
+        for line in data.splitlines():
+            if not all(needle in line for needle in self.needles):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict) or not self._matches(record, check_time):
+                continue
+            records.append(record)
+        return records
+
+    def _matches(self, record: dict, check_time: bool) -> bool:
+        if check_time:
+            try:
+                timestamp = datetime.fromisoformat(record['timestamp']).timestamp()
+            except (ValueError, TypeError, KeyError):
+                return False
+            if (self.since is not None and timestamp < self.since) or (self.until is not None and timestamp >= self.until):
+                return False
+        if self.level is not None and _LEVELS.get(record.get('level'), 0) < self.level:
+            return False
+        if self.logger is not None and not self._logger_matches(str(record.get('logger'))):
+            return False
+        if self.request_id is not None and record.get('request_id') != self.request_id:
+            return False
+        return all(key in record and record[key] == value for key, value in self.fields.items())
+
+
+def _scan(task: tuple) -> list[dict]:
+    """Read the given blocks of a log file and return the matching records"""
+    path, compressed, blocks, criteria = task
+    records = []
+    if compressed:
+        # Seeking forward in a gzip file decompresses and discards, only the matching blocks are parsed
+        with gzip.open(path, 'rb') as f:
+            for block in blocks:
+                f.seek(block['offset'])
+                records += criteria.filter(f.read(block['length']), block)
+        return records
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for block in blocks:
+            records += criteria.filter(mapped[block['offset'] : block['offset'] + block['length']], block)
+    return records
+
+
+def _map(function, items: list, workers: int | None):
+    """Map a function over items in worker processes, in this process when there is a single item or worker"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(items) <= 1:
+        yield from map(function, items)
+        return
+    # Only queries spanning several files or blocks need processes, and they take longer than the import
+    from concurrent.futures import ProcessPoolExecutor  # noqa: PLC0415
+
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(items)))
+    try:
+        yield from executor.map(function, items)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def index_logs(log_file_path: str | list[str], index_dir: str | None = None, workers: int | None = None, rebuild: bool = False) -> dict[str, dict]:
+    """
+    Index a log file and the files rotated from it, in parallel.
+
+    :param log_file_path: Path of the log file, or a list of log files to index
+    :type log_file_path: str or list[str]
+    :param index_dir: Directory of the index files, defaults to '.logindex' next to every log file
+    :type index_dir: str or None
+    :param workers: Number of processes, defaults to the number of CPUs
+    :type workers: int or None
+    :param rebuild: Whether to ignore existing indexes, defaults to False
+    :type rebuild: bool
+    :return: Index of every file, oldest file first
+    :rtype: dict
+    """
+    paths = find_segments(log_file_path) if isinstance(log_file_path, str) else list(log_file_path)
+    indexes = list(_map(partial(index_segment, index_dir=index_dir, rebuild=rebuild), paths, workers))
+    # Rotated files are named after their position or date, order them by their first record instead
+    order = sorted(range(len(paths)), key=lambda i: min((block['start'] for block in indexes[i]['blocks'] if block['start'] is not None), default=float('inf')))
+    return {paths[i]: indexes[i] for i in order}
+
+
+def query_logs(  # noqa: PLR0913
+    log_file_path: str | list[str],
+    *,
+    since=None,
+    until=None,
+    level: int | str | None = None,
+    logger: str | None = None,
+    request_id: str | None = None,
+    fields: dict | None = None,
+    limit: int | None = None,
+    index_dir: str | None = None,
+    workers: int | None = None,
+):
+    """
+    Find the records of JSON log files matching all of the given conditions.
+
+    Only blocks of the files whose index shows they can contain a match are read and parsed, by several processes at once.
+
+    :param log_file_path: Path of the log file, its rotated files are queried too, or a list of log files to query
+    :type log_file_path: str or list[str]
+    :param since: Only records logged at or after this time, see parse_time() for the accepted values
+    :param until: Only records logged before this time, see parse_time() for the accepted values
+    :param level: Only records at or above this level, e.g. 'WARNING' or logging.WARNING
+    :type level: int or str or None
+    :param logger: Only records of this logger and its children
+    :type logger: str or None
+    :param request_id: Only records of this request
+    :type request_id: str or None
+    :param fields: Only records with these values, e.g. {'status': 500}
+    :type fields: dict or None
+    :param limit: Maximum number of records
+    :type limit: int or None
+    :param index_dir: Directory of the index files, defaults to '.logindex' next to every log file
+    :type index_dir: str or None
+    :param workers: Number of processes, defaults to the number of CPUs
+    :type workers: int or None
+    :return: Matching records, oldest file first and in the order of the lines of every file
+    :rtype: Iterator[dict]
+    """
+    if isinstance(level, str):
+        if level.upper() not in _LEVELS:
+            raise ValueError(f'Unknown log level {level!r}')
+        level = _LEVELS[level.upper()]
+    criteria = _Criteria(parse_time(since), parse_time(until), level, logger, request_id, dict(fields or {}))
+
+    tasks = []
+    for path, index in index_logs(log_file_path, index_dir=index_dir, workers=workers).items():
+        blocks = [block for block in index['blocks'] if criteria.matches_block(block)]
+        if not blocks:
+            continue
+        size = len(blocks) if index['compressed'] else BLOCKS_PER_TASK
+        tasks += [(path, index['compressed'], blocks[i : i + size], criteria) for i in range(0, len(blocks), size)]
+
+    count = 0
+    for records in _map(_scan, tasks, workers):
+        for record in records:
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield record
+
+
+def _field(value: str) -> tuple[str, object]:
+    """Parse a key=value argument, the value is JSON when it parses, otherwise a string"""
+    key, separator, raw = value.partition('=')
+    if not separator or not key:
+        raise argparse.ArgumentTypeError(f'expected key=value, got {value!r}')
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Query log files from the command line, matching records are written as JSON lines"""
+    parser = argparse.ArgumentParser(prog='python -m tunsberg.logquery', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log_file', nargs='+', help='log file, its rotated files are queried too when it is the only one')
+    parser.add_argument('--since', help='ISO 8601 time (UTC when naive) or duration before now like 15m, 2h or 1d')
+    parser.add_argument('--until', help='ISO 8601 time (UTC when naive) or duration before now like 15m, 2h or 1d')
+    parser.add_argument('--level', help='minimum level, e.g. WARNING')
+    parser.add_argument('--logger', help='logger name, includes its children')
+    parser.add_argument('--request-id', help='request ID')
+    parser.add_argument('--field', type=_field, action='append', default=[], metavar='KEY=VALUE', help='field value, repeat for more fields')
+    parser.add_argument('--limit', type=int, help='maximum number of records')
+    parser.add_argument('--count', action='store_true', help='print the number of matching records instead')
+    parser.add_argument('--index-dir', help=f'directory of the index files, defaults to {INDEX_DIRECTORY} next to the log files')
+    parser.add_argument('--workers', type=int, help='number of processes, defaults to the number of CPUs')
+    parser.add_argument('--reindex', action='store_true', help='rebuild the indexes and print a summary of every file')
+    args = parser.parse_args(argv)
+    log_files = args.log_file[0] if len(args.log_file) == 1 else args.log_file
+
+    if args.reindex:
+        for path, index in index_logs(log_files, index_dir=args.index_dir, workers=args.workers, rebuild=True).items():
+            lines = sum(block['lines'] for block in index['blocks'])
+            sys.stdout.write(f'{path}: {lines} lines in {len(index["blocks"])} blocks\n')
+        return
+
+    try:
+        records = query_logs(
+            log_files,
+            since=args.since,
+            until=args.until,
+            level=args.level,
+            logger=args.logger,
+            request_id=args.request_id,
+            fields=dict(args.field),
+            limit=args.limit,
+            index_dir=args.index_dir,
+            workers=args.workers,
+        )
+        if args.count:
+            sys.stdout.write(f'{sum(1 for _ in records)}\n')
+            return
+        for record in records:
+            sys.stdout.write(json.dumps(record) + '\n')
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
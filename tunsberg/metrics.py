@@ -0,0 +1,328 @@
+"""Request metrics recorded in fixed-memory histograms and exposed in Prometheus text format"""
+
+import glob
+import mmap
+import os
+import weakref
+from time import perf_counter_ns
+
+METRICS_PATH = '/metrics'
+UNMATCHED_ROUTE = '<unmatched>'
+OVERFLOW_ROUTE = '<overflow>'
+PROMETHEUS_CONTENT_TYPE = b'text/plain; version=0.0.4; charset=utf-8'
+
+# Log-linear latency histogram in nanoseconds: everything below 2**DURATION_MIN_BITS (16µs) shares the first bucket,
+# every power of two above it is split into 2**SUB_BUCKET_BITS linear buckets up to 2**DURATION_MAX_BITS (69s), and
+# the last bucket collects everything slower.
+DURATION_MIN_BITS = 14
+DURATION_MAX_BITS = 36
+SUB_BUCKET_BITS = 1
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_SUB_BUCKET_MASK = _SUB_BUCKETS - 1
+_OVERFLOW_BUCKET = 1 + (DURATION_MAX_BITS - DURATION_MIN_BITS) * _SUB_BUCKETS
+
+
+def _bucket_upper_bound_ns(index: int) -> int:
+    """Exclusive upper bound of a finite histogram bucket in nanoseconds"""
+    if index == 0:
+        return 1 << DURATION_MIN_BITS
+    bits = DURATION_MIN_BITS + 1 + (index - 1) // _SUB_BUCKETS
+    sub = (index - 1) % _SUB_BUCKETS
+    return (_SUB_BUCKETS + sub + 1) << (bits - 1 - SUB_BUCKET_BITS)
+
+
+# Upper bounds of the finite buckets in seconds, the overflow bucket is only part of +Inf
+DURATION_BUCKETS = tuple(_bucket_upper_bound_ns(index) / 1e9 for index in range(_OVERFLOW_BUCKET))
+
+# File layout in unsigned 64 bit words: a header followed by max_series slots. A slot holds the length of its key (0 for
+# an unused slot), the key itself, the response bytes, the summed duration and the buckets. The request count is the sum
+# of the buckets, which saves a write per request.
+_MAGIC = 0x74756E7362657267  # 'tunsberg'
+_HEADER_WORDS = 2
+_KEY_WORDS = 16
+_KEY_BYTES = _KEY_WORDS * 8
+_BYTES = 1 + _KEY_WORDS
+_BUCKETS = _BYTES + 2
+_SLOT_WORDS = _BUCKETS + _OVERFLOW_BUCKET + 1
+
+_registries = weakref.WeakSet()
+
+
+def _reset_after_fork() -> None:
+    """Give every registry its own file in a forked worker"""
+    for registry in list(_registries):
+        registry._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class MetricsRegistry:
+    """
+    Request counts, response bytes and latency histograms per method, route and status.
+
+    Every process writes to its own memory-mapped file without taking a lock, the middleware only records from the event
+    loop thread. Give the workers of a server the same directory, ideally on tmpfs and emptied before the server starts,
+    and collect() adds up the files of all of them. Without a directory the metrics are kept in anonymous memory and only
+    cover the current process.
+
+    The number of series is fixed when the file is created, series beyond max_series are added to a single series with
+    the route '<overflow>'.
+    """
+
+    def __init__(self, directory: str | None = None, max_series: int = 1024):
+        """
+        Create a registry.
+
+        :param directory: Directory shared by all workers, defaults to None for per process metrics
+        :type directory: str or None
+        :param max_series: Number of method, route and status combinations each worker can record, defaults to 1024
+        :type max_series: int
+        """
+        if max_series < 1:
+            raise ValueError('max_series must be at least 1')
+        self.directory = directory
+        self.max_series = max_series
+        self._map = None
+        self._counts = None
+        self._slots = {}
+        self._overflow = None
+        _registries.add(self)
+
+    @property
+    def path(self) -> str | None:
+        """File this process writes to, None without a directory"""
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, f'metrics.{os.getpid()}.bin')
+
+    def _open(self) -> None:
+        """Map the file of this process, creating it when needed"""
+        size = (_HEADER_WORDS + self.max_series * _SLOT_WORDS) * 8
+        if self.directory is None:
+            self._map = mmap.mmap(-1, size)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        self._counts = memoryview(self._map).cast('Q')
+        self._counts[1] = _SLOT_WORDS
+        self._counts[0] = _MAGIC
+
+    def _reset(self) -> None:
+        """Forget the mapping inherited from the parent process, the next observation creates a new one"""
+        self._map = None
+        self._counts = None
+        self._slots = {}
+        self._overflow = None
+
+    def _allocate(self, key: tuple[str, str, int]) -> int:
+        """Claim the slot of a new series and return the offset of its counters"""
+        if self._counts is None:
+            self._open()
+        if len(self._slots) < self.max_series - 1:
+            offset = self._slots[key] = self._write_key(len(self._slots), key)
+            return offset
+        # The last slot is shared by every series that did not fit, they are not remembered to keep memory fixed
+        if self._overflow is None:
+            self._overflow = self._write_key(self.max_series - 1, ('', OVERFLOW_ROUTE, 0))
+        return self._overflow
+
+    def _write_key(self, slot: int, key: tuple[str, str, int]) -> int:
+        """Write the key of a slot, publishing its length last, and return the offset of its counters"""
+        start = _HEADER_WORDS + slot * _SLOT_WORDS
+        method, status = key[0].encode(), str(key[2]).encode()
+        # Long routes are cut short so the key always fits its slot
+        route = key[1].encode()[: _KEY_BYTES - len(method) - len(status) - 2]
+        encoded = b'\0'.join((method, route, status))
+        self._map[(start + 1) * 8 : (start + 1) * 8 + len(encoded)] = encoded
+        self._counts[start] = len(encoded)
+        return start + _BYTES
+
+    def observe(self, method: str, route: str, status: int, nbytes: int, duration_ns: int) -> None:
+        """
+        Record a request.
+
+        :param method: HTTP method
+        :type method: str
+        :param route: Route template, e.g. '/items/{item_id}', not the requested path
+        :type route: str
+        :param status: Response status code
+        :type status: int
+        :param nbytes: Response body size in bytes
+        :type nbytes: int
+        :param duration_ns: Time taken in nanoseconds
+        :type duration_ns: int
+        """
+        key = (method, route, status)
+        offset = self._slots.get(key)
+        if offset is None:
+            offset = self._allocate(key)
+        counts = self._counts
+        counts[offset] += nbytes
+        counts[offset + 1] += duration_ns
+        bits = duration_ns.bit_length()
+        if bits <= DURATION_MIN_BITS:
+            counts[offset + 2] += 1
+        elif bits > DURATION_MAX_BITS:
+            counts[offset + 2 + _OVERFLOW_BUCKET] += 1
+        else:
+            counts[offset + 3 + ((bits - DURATION_MIN_BITS - 1) << SUB_BUCKET_BITS) + ((duration_ns >> (bits - 1 - SUB_BUCKET_BITS)) & _SUB_BUCKET_MASK)] += 1
+
+    def collect(self) -> dict[tuple[str, str, int], tuple[int, int, int, list[int]]]:
+        """
+        Add up the series of every worker.
+
+        :return: Count, bytes, summed duration in nanoseconds and bucket counts per method, route and status
+        :rtype: dict
+        """
+        totals = {}
+        if self.directory is None:
+            if self._counts is not None:
+                _add_series(totals, self._counts)
+            return totals
+        for path in sorted(glob.glob(os.path.join(glob.escape(self.directory), 'metrics.*.bin'))):
+            try:
+                with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    counts = memoryview(mapped).cast('Q')
+                    try:
+                        _add_series(totals, counts)
+                    finally:
+                        counts.release()
+            except (OSError, ValueError, TypeError):
+                # Files still being created or left behind by another layout are skipped
+                continue
+        return totals
+
+    def render(self, prefix: str = 'tunsberg_http') -> bytes:
+        """
+        Render the collected metrics in the Prometheus text exposition format.
+
+        :param prefix: Prefix of the metric names, defaults to 'tunsberg_http'
+        :type prefix: str
+        :return: Exposition text
+        :rtype: bytes
+        """
+        series = sorted(self.collect().items())
+        lines = [
+            f'# HELP {prefix}_requests_total Requests handled.',
+            f'# TYPE {prefix}_requests_total counter',
+        ]
+        labels = {key: _labels(*key) for key, _ in series}
+        lines.extend(f'{prefix}_requests_total{{{labels[key]}}} {count}' for key, (count, _, _, _) in series)
+        lines += [
+            f'# HELP {prefix}_response_bytes_total Response body bytes sent.',
+            f'# TYPE {prefix}_response_bytes_total counter',
+        ]
+        lines.extend(f'{prefix}_response_bytes_total{{{labels[key]}}} {nbytes}' for key, (_, nbytes, _, _) in series)
+        lines += [
+            f'# HELP {prefix}_request_duration_seconds Time taken to handle requests.',
+            f'# TYPE {prefix}_request_duration_seconds histogram',
+        ]
+        for key, (count, _, duration_ns, buckets) in series:
+            cumulative = 0
+            for bound, bucket in zip(DURATION_BUCKETS, buckets, strict=False):
+                cumulative += bucket
+                lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels[key]},le="{bound!r}"}} {cumulative}')
+            lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels[key]},le="+Inf"}} {count}')
+            lines.append(f'{prefix}_request_duration_seconds_sum{{{labels[key]}}} {duration_ns / 1e9!r}')
+            lines.append(f'{prefix}_request_duration_seconds_count{{{labels[key]}}} {count}')
+        return ('\n'.join(lines) + '\n').encode()
+
+
+def _add_series(totals: dict, counts: memoryview) -> None:
+    """Add the series of one mapped file to totals"""
+    if counts[0] != _MAGIC or counts[1] != _SLOT_WORDS:
+        return
+    mapped = counts.obj
+    for start in range(_HEADER_WORDS, len(counts) - _SLOT_WORDS + 1, _SLOT_WORDS):
+        length = counts[start]
+        if not length:
+            continue
+        method, route, status = bytes(mapped[(start + 1) * 8 : (start + 1) * 8 + length]).decode(errors='ignore').split('\0')
+        key = (method, route, int(status or 0))
+        nbytes, duration_ns = counts[start + _BYTES : start + _BUCKETS]
+        buckets = counts[start + _BUCKETS : start + _SLOT_WORDS].tolist()
+        count = sum(buckets)
+        if key in totals:
+            previous = totals[key]
+            buckets = [a + b for a, b in zip(previous[3], buckets, strict=True)]
+            count, nbytes, duration_ns = count + previous[0], nbytes + previous[1], duration_ns + previous[2]
+        totals[key] = (count, nbytes, duration_ns, buckets)
+
+
+def _labels(method: str, route: str, status: int) -> str:
+    """Format the labels of a series"""
+    route = route.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'method="{method}",route="{route}",status="{status or ""}"'
+
+
+class MetricsMiddleware:
+    """
+    Record the method, route, status, response size and duration of every HTTP request.
+
+    The route is the template of the matched route, e.g. '/items/{item_id}', so the number of series stays bounded.
+    Requests that did not match a route are recorded as '<unmatched>'. GET requests to metrics_path are answered with
+    the collected metrics and not recorded, set it to None to expose the metrics elsewhere.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry | None = None, metrics_path: str | None = METRICS_PATH, collectors: tuple = ()):
+        """
+        Wrap an ASGI application.
+
+        :param app: ASGI application
+        :param registry: Registry to record to, defaults to a new per process registry
+        :type registry: MetricsRegistry or None
+        :param metrics_path: Path the metrics are served on, defaults to '/metrics', None to not serve them
+        :type metrics_path: str or None
+        :param collectors: More objects with a render() method served on metrics_path, like a BackgroundExecutor
+        :type collectors: tuple
+        """
+        self.app = app
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.metrics_path = metrics_path
+        self.collectors = tuple(collectors)
+
+    async def __call__(self, scope, receive, send):
+        """Handle an ASGI request"""
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        if scope['path'] == self.metrics_path and scope['method'] in {'GET', 'HEAD'}:
+            await self.serve(send, include_body=scope['method'] == 'GET')
+            return
+
+        start = perf_counter_ns()
+        response = [500, 0]
+
+        # A plain function returning the awaitable of send, an async wrapper would add a coroutine to every message
+        def send_wrapper(message):
+            message_type = message['type']
+            if message_type == 'http.response.body':
+                response[1] += len(message.get('body', b''))
+            elif message_type == 'http.response.start':
+                response[0] = message['status']
+            return send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            self.registry.observe(
+                scope['method'],
+                getattr(route, 'path', UNMATCHED_ROUTE),
+                response[0],
+                response[1],
+                perf_counter_ns() - start,
+            )
+
+    async def serve(self, send, include_body: bool = True) -> None:
+        """Send the metrics as an ASGI response"""
+        body = b''.join([self.registry.render(), *(collector.render() for collector in self.collectors)])
+        headers = [(b'content-type', PROMETHEUS_CONTENT_TYPE), (b'content-length', str(len(body)).encode())]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body if include_body else b''})
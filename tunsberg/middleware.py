@@ -0,0 +1,153 @@
+"""ASGI middleware for request context and access logging"""
+
+import logging
+import os
+import re
+from contextvars import ContextVar
+from time import perf_counter
+
+ACCESS_LOGGER = 'tunsberg.access'
+REQUEST_ID_HEADER = 'x-request-id'
+# Request IDs sent by clients end up in logs and response headers, anything else is replaced by a generated one
+_REQUEST_ID_PATTERN = re.compile(rb'[A-Za-z0-9._-]{1,128}')
+
+
+class RequestContext:
+    """Per-request values shared with log formatters through the request_context variable"""
+
+    __slots__ = ('request_id', 'scope', 'start')
+
+    def __init__(self, request_id: str, start: float, scope: dict):
+        """
+        Create a request context.
+
+        :param request_id: Request ID, taken from the request headers or generated
+        :type request_id: str
+        :param start: Value of time.perf_counter() when the request was received
+        :type start: float
+        :param scope: ASGI scope of the request
+        :type scope: dict
+        """
+        self.request_id = request_id
+        self.start = start
+        self.scope = scope
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the request was received"""
+        return perf_counter() - self.start
+
+
+request_context: ContextVar[RequestContext | None] = ContextVar('tunsberg_request_context', default=None)
+
+
+def get_request_id() -> str | None:
+    """
+    Get the ID of the request currently being handled.
+
+    :return: Request ID or None outside of a request
+    :rtype: str or None
+    """
+    context = request_context.get()
+    return context.request_id if context is not None else None
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Copy the current request ID onto log records.
+
+    Records handled in another process, e.g. by a LogAggregator, no longer have access to the request context of the
+    worker that created them.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Add request_id to the record if it does not have one"""
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = get_request_id()
+        return True
+
+
+class AccessLogMiddleware:
+    """
+    Set a request context for every HTTP request and log one structured access record when it completes.
+
+    The record is logged on the 'tunsberg.access' logger with method, path, status, bytes and duration in the
+    extra_fields attribute, which JsonFormatter adds to its output. Use log_config(access_log='tunsberg') to silence the
+    access log written by Uvicorn. The request ID is read from the X-Request-ID header when it holds up to 128 letters,
+    digits, dots, underscores or dashes, otherwise a random one is generated, and it is returned in the same response
+    header, replacing one set by the app.
+    """
+
+    def __init__(self, app, logger_name: str = ACCESS_LOGGER, header_name: str = REQUEST_ID_HEADER, trust_header: bool = True):
+        """
+        Wrap an ASGI application.
+
+        :param app: ASGI application
+        :param logger_name: Logger the access records are logged on, defaults to 'tunsberg.access'
+        :type logger_name: str
+        :param header_name: Header carrying the request ID, defaults to 'x-request-id'
+        :type header_name: str
+        :param trust_header: Whether to reuse a request ID sent by the client, defaults to True
+        :type trust_header: bool
+        """
+        self.app = app
+        self.logger = logging.getLogger(logger_name)
+        self.header_name = header_name.lower().encode('latin-1')
+        self.trust_header = trust_header
+
+    async def __call__(self, scope, receive, send):
+        """Handle an ASGI request"""
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        request_id = None
+        if self.trust_header:
+            for name, value in scope['headers']:
+                if name == self.header_name:
+                    if _REQUEST_ID_PATTERN.fullmatch(value):
+                        request_id = value.decode('latin-1')
+                    break
+        if not request_id:
+            request_id = os.urandom(8).hex()
+
+        token = request_context.set(RequestContext(request_id, start, scope))
+        header_name = self.header_name
+        header = (header_name, request_id.encode('latin-1'))
+        response = {'status': 500, 'bytes': 0}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                # Replace a request ID header set by the app, so the response carries exactly one
+                message['headers'] = [*(item for item in message.get('headers', ()) if item[0].lower() != header_name), header]
+            elif message['type'] == 'http.response.body':
+                response['bytes'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if self.logger.isEnabledFor(logging.INFO):
+                duration_ms = (perf_counter() - start) * 1000
+                fields = {
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'status': response['status'],
+                    'bytes': response['bytes'],
+                    'duration_ms': round(duration_ms, 3),
+                }
+                # Build the record directly, the caller lookup done by Logger.info() would always point here anyway
+                record = self.logger.makeRecord(
+                    self.logger.name,
+                    logging.INFO,
+                    __file__,
+                    0,
+                    '%s %s %s %sB %.2fms',
+                    (fields['method'], fields['path'], fields['status'], fields['bytes'], duration_ms),
+                    None,
+                    extra={'extra_fields': fields},
+                )
+                self.logger.handle(record)
+            request_context.reset(token)
@@ -0,0 +1,376 @@
+"""Sampling profiler for slow and randomly selected requests"""
+
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import weakref
+from time import perf_counter
+
+PROFILER_LOGGER = 'tunsberg.profiler'
+
+_profilers = weakref.WeakSet()
+
+
+def _reset_after_fork() -> None:
+    """Forget sampler threads and sessions inherited from the parent process"""
+    for profiler in list(_profilers):
+        profiler._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class ProfileSession:
+    """Samples collected for a single request"""
+
+    __slots__ = ('frame', 'method', 'path', 'profiling', 'sampled', 'samples', 'self_counts', 'start', 'task', 'thread_id', 'total_counts')
+
+    def __init__(self, task: asyncio.Task, method: str, path: str, sampled: bool, frame=None):
+        """
+        Create a session.
+
+        :param task: Task handling the request
+        :type task: asyncio.Task
+        :param method: HTTP method
+        :type method: str
+        :param path: Requested path
+        :type path: str
+        :param sampled: Whether the request was selected for profiling up front
+        :type sampled: bool
+        :param frame: Frame of the task stacks are recorded below, defaults to None to record whole stacks
+        """
+        self.task = task
+        self.frame = frame
+        self.thread_id = threading.get_ident()
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.profiling = sampled
+        self.start = perf_counter()
+        self.samples = 0
+        self.self_counts = {}
+        self.total_counts = {}
+
+
+class SamplingProfiler:
+    """
+    Sample the stacks of requests from a background thread.
+
+    Every request is registered when it starts. Requests selected with probability sample_rate are sampled from the
+    start, any other request is sampled from the moment it has taken longer than slow_threshold. The sampler thread
+    records where the task of each sampled request is: the frames executing on the event loop when the task is running,
+    or the chain of coroutines it is waiting in when it is suspended, so time spent waiting for I/O is attributed too.
+    Code run in a thread pool, like path functions declared with def, shows up as the await on the thread pool.
+
+    The overhead is capped: the sampler backs off so that it never takes more than max_overhead of the wall time, at
+    most max_sessions requests are sampled at once, and stacks are cut at max_depth frames.
+
+    enabled, sample_rate and slow_threshold can be changed at any time, e.g. from a LogLevelController or admin route.
+    """
+
+    def __init__(  # noqa: PLR0913, PLR0917
+        self,
+        sample_rate: float = 0.0,
+        slow_threshold: float | None = 1.0,
+        interval: float = 0.005,
+        top: int = 10,
+        max_overhead: float = 0.02,
+        max_sessions: int = 4,
+        max_depth: int = 64,
+        logger_name: str = PROFILER_LOGGER,
+        enabled: bool = True,
+    ):
+        """
+        Create a profiler.
+
+        :param sample_rate: Fraction of requests profiled from the start, defaults to 0.0
+        :type sample_rate: float
+        :param slow_threshold: Seconds after which a request is profiled, defaults to 1.0, None to only sample
+        :type slow_threshold: float or None
+        :param interval: Seconds between samples, defaults to 0.005
+        :type interval: float
+        :param top: Number of functions in the logged summary, defaults to 10
+        :type top: int
+        :param max_overhead: Largest fraction of wall time the sampler may take, defaults to 0.02
+        :type max_overhead: float
+        :param max_sessions: Largest number of requests sampled at the same time, defaults to 4
+        :type max_sessions: int
+        :param max_depth: Largest number of frames recorded per sample, defaults to 64
+        :type max_depth: int
+        :param logger_name: Logger the summaries are logged on, defaults to 'tunsberg.profiler'
+        :type logger_name: str
+        :param enabled: Whether requests are profiled, defaults to True
+        :type enabled: bool
+        """
+        if not 0 < max_overhead < 1:
+            raise ValueError('max_overhead must be between 0 and 1')
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+        self.top = top
+        self.max_overhead = max_overhead
+        self.max_sessions = max_sessions
+        self.max_depth = max_depth
+        self.logger = logging.getLogger(logger_name)
+        self._sessions = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopping = False
+        self._idle = True
+        _profilers.add(self)
+
+    def _reset(self) -> None:
+        """Drop the sampler thread, which does not exist in a forked child"""
+        self._sessions = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._idle = True
+
+    def begin(self, method: str, path: str) -> ProfileSession | None:
+        """
+        Register the request handled by the current task.
+
+        :param method: HTTP method
+        :type method: str
+        :param path: Requested path
+        :type path: str
+        :return: Session to pass to end(), None when the request is not profiled
+        :rtype: ProfileSession or None
+        """
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and self.slow_threshold is None:
+            return None
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        if sampled and sum(session.profiling for session in list(self._sessions.values())) >= self.max_sessions:
+            sampled = False
+            if self.slow_threshold is None:
+                return None
+        # Stacks are recorded below the caller, the frames above it belong to the server and the event loop
+        session = ProfileSession(task, method, path, sampled, sys._getframe(1))
+        self._sessions[id(session)] = session
+        if self._thread is None:
+            self.start()
+        # Waking the sampler takes a lock, only do it when the session needs a sample sooner than already planned
+        if sampled or self._idle:
+            self._wake.set()
+        return session
+
+    def end(self, session: ProfileSession | None, route: str | None = None) -> dict | None:
+        """
+        Unregister a request and log its summary if it was profiled.
+
+        :param session: Session returned by begin()
+        :type session: ProfileSession or None
+        :param route: Route template of the request, if known
+        :type route: str or None
+        :return: Fields of the logged summary, None when nothing was logged
+        :rtype: dict or None
+        """
+        if session is None:
+            return None
+        self._sessions.pop(id(session), None)
+        if not session.samples:
+            return None
+        duration = perf_counter() - session.start
+        fields = {
+            'method': session.method,
+            'path': session.path,
+            'route': route,
+            'reason': 'sampled' if session.sampled else 'slow',
+            'duration_ms': round(duration * 1000, 3),
+            'samples': session.samples,
+            'top': self.summary(session),
+        }
+        level = logging.INFO if session.sampled else logging.WARNING
+        self.logger.log(
+            level,
+            'Profiled %s %s %.2fms, %s samples',
+            session.method,
+            session.path,
+            duration * 1000,
+            session.samples,
+            extra={'extra_fields': fields},
+        )
+        return fields
+
+    def summary(self, session: ProfileSession) -> list[dict]:
+        """
+        Get the functions seen in most samples.
+
+        :param session: Profiled session
+        :type session: ProfileSession
+        :return: Function, file, first line, samples with the function on top of the stack and samples containing it
+        :rtype: list[dict]
+        """
+        ranked = sorted(session.total_counts.items(), key=lambda item: (session.self_counts.get(item[0], 0), item[1]), reverse=True)
+        return [
+            {
+                'function': code.co_qualname,
+                'file': code.co_filename,
+                'line': code.co_firstlineno,
+                'self': session.self_counts.get(code, 0),
+                'total': total,
+            }
+            for code, total in ranked[: self.top]
+        ]
+
+    def start(self) -> None:
+        """Start the sampler thread, begin() does this when needed"""
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='tunsberg-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the sampler thread"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def next_delay(self, delay: float | None, spent: float) -> float | None:
+        """
+        Stretch the delay before the next sample so sampling stays within max_overhead of the wall time.
+
+        :param delay: Wanted delay in seconds, None to wait for the next request
+        :type delay: float or None
+        :param spent: Seconds the last sample took
+        :type spent: float
+        :return: Delay in seconds
+        :rtype: float or None
+        """
+        if delay is None:
+            return None
+        return max(delay, spent * (1 - self.max_overhead) / self.max_overhead)
+
+    def _run(self) -> None:
+        """Sample until stopped"""
+        delay = None
+        while True:
+            self._wake.wait(delay)
+            self._wake.clear()
+            if self._stopping:
+                return
+            start = perf_counter()
+            delay = self.sample(start)
+            delay = self.next_delay(delay, perf_counter() - start)
+
+    def sample(self, now: float) -> float | None:
+        """
+        Take one sample of every profiled request.
+
+        :param now: Value of time.perf_counter()
+        :type now: float
+        :return: Seconds until the next sample is due, None when no request is registered
+        :rtype: float or None
+        """
+        self._idle = True
+        sessions = list(self._sessions.values())
+        if not sessions:
+            return None
+        self._idle = False
+        profiling = sum(session.profiling for session in sessions)
+        delay = None
+        frames = None
+        for session in sessions:
+            if not session.profiling:
+                threshold = self.slow_threshold
+                if threshold is None:
+                    continue
+                remaining = session.start + threshold - now
+                if remaining > 0 or profiling >= self.max_sessions:
+                    delay = remaining if delay is None else min(delay, remaining)
+                    continue
+                session.profiling = True
+                profiling += 1
+            if frames is None:
+                frames = sys._current_frames()
+            self._record(session, frames)
+            delay = self.interval
+        if delay is not None:
+            delay = max(delay, self.interval)
+        return delay
+
+    def _record(self, session: ProfileSession, frames: dict) -> None:
+        """Add the current stack of a request to its session"""
+        try:
+            # The task is running when the frame it registered from is on the stack of its thread, any other task of
+            # the event loop running at the time has its own frame
+            stack = self._running_stack(session, frames.get(session.thread_id))
+            if stack is None:
+                stack = self._suspended_stack(session, session.task.get_coro())
+        except (AttributeError, RuntimeError, ValueError):
+            # The task moved on while its stack was being read, skip this sample
+            return
+        if not stack:
+            return
+        session.samples += 1
+        leaf = stack[-1]
+        session.self_counts[leaf] = session.self_counts.get(leaf, 0) + 1
+        for code in set(stack):
+            session.total_counts[code] = session.total_counts.get(code, 0) + 1
+
+    def _running_stack(self, session: ProfileSession, frame) -> list | None:
+        """Code objects from the middleware down to the frame executing on the event loop, None if the task is not running"""
+        stack = []
+        while frame is not None and frame is not session.frame:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        if frame is None:
+            return None
+        stack.reverse()
+        return stack[-self.max_depth :]
+
+    def _suspended_stack(self, session: ProfileSession, coroutine) -> list:
+        """Code objects from the middleware down to the coroutine a suspended task is waiting in"""
+        stack = []
+        inside = False
+        while coroutine is not None and len(stack) < self.max_depth:
+            frame = getattr(coroutine, 'cr_frame', None) or getattr(coroutine, 'gi_frame', None) or getattr(coroutine, 'ag_frame', None)
+            if frame is None:
+                break
+            if inside:
+                stack.append(frame.f_code)
+            elif frame is session.frame:
+                inside = True
+            coroutine = getattr(coroutine, 'cr_await', None) or getattr(coroutine, 'gi_yieldfrom', None) or getattr(coroutine, 'ag_await', None)
+        return stack
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sampled fraction of requests and every request slower than a threshold.
+
+    The summary of a profiled request is logged on the 'tunsberg.profiler' logger, a child of the 'tunsberg' logger set
+    up by log_config(), with method, path, route, reason, duration_ms, samples and the top functions in the
+    extra_fields attribute. Sampled requests are logged at INFO, slow requests at WARNING. See SamplingProfiler for the
+    arguments.
+    """
+
+    def __init__(self, app, profiler: SamplingProfiler | None = None, **kwargs):
+        """
+        Wrap an ASGI application.
+
+        :param app: ASGI application
+        :param profiler: Profiler to use, defaults to a new SamplingProfiler created with kwargs
+        :type profiler: SamplingProfiler or None
+        """
+        self.app = app
+        self.profiler = profiler if profiler is not None else SamplingProfiler(**kwargs)
+
+    async def __call__(self, scope, receive, send):
+        """Handle an ASGI request"""
+        if scope['type'] != 'http' or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+        session = self.profiler.begin(scope['method'], scope['path'])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.end(session, getattr(scope.get('route'), 'path', None))
@@ -1,12 +1,23 @@
+import inspect
 import json
-from typing import Any
+from functools import partial
+from time import perf_counter_ns
+from typing import TYPE_CHECKING, Any
 
-from fastapi import Query
-from fastapi_pagination import Page, Params
 from pydantic import BaseModel, Field
 from starlette import status
 from starlette.responses import JSONResponse, Response
 
+from tunsberg.background import DeferredTasks, get_default_executor
+from tunsberg.encoding import ENCODERS, response_media_type
+
+if TYPE_CHECKING:
+    from fastapi_pagination import Page
+
+    from tunsberg.serialization import SerializationRecorder
+
+_serialization_recorder = None
+
 
 class Pagination(BaseModel):
     """Pagination model"""
@@ -33,21 +44,48 @@ class ResponsePaginationModel(ResponseModel):
     pagination: Pagination | None = None
 
 
-class CustomParams(Params):
-    """Override Params for custom default size"""
+def _custom_params() -> type:
+    # FastAPI and fastapi-pagination are only needed for pagination parameters and take longer to import than the rest
+    from fastapi import Query  # noqa: PLC0415
+    from fastapi_pagination import Params  # noqa: PLC0415
+
+    class CustomParams(Params):
+        """Override Params for custom default size"""
+
+        size: int = Query(10, ge=1, le=100, description='Page size')
+
+    CustomParams.__qualname__ = 'CustomParams'
+    return CustomParams
+
+
+_LAZY_ATTRIBUTES = {'CustomParams': _custom_params}
 
-    size: int = Query(10, ge=1, le=100, description='Page size')
 
+def __getattr__(name: str) -> Any:
+    """Create attributes that depend on heavy optional imports the first time they are used"""
+    factory = _LAZY_ATTRIBUTES.get(name)
+    if factory is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = globals()[name] = factory()
+    return value
 
-def generate_json_response(response: ResponseModel) -> JSONResponse:
+
+def generate_json_response(response: ResponseModel) -> Response:
     """
     Generate a JSON response for FastAPI from a ResponseModel.
 
+    The response is MessagePack or CBOR instead when ContentNegotiationMiddleware negotiated one of them with the client.
+    Background tasks are queued on the executor set with set_default_executor(), if any.
+    Building the response is recorded by the recorder set with set_serialization_recorder(), if any.
+
     :param response: ResponseModel to be converted
     :type response: ResponseModel
     :return: Tuple of response and status code
     :rtype: Tuple[Dict[str, Any], int]
     """
+    recorder = _serialization_recorder
+    if recorder is not None:
+        start = perf_counter_ns()
     content = dict()
     content['status_code'] = response.status_code
     content['message'] = response.message
@@ -62,11 +100,32 @@ def generate_json_response(response: ResponseModel) -> JSONResponse:
         content['pagination'] = response.pagination.model_dump()
     if response.background_tasks:
         background = response.background_tasks
+        executor = get_default_executor()
+        if executor is not None and not isinstance(background, DeferredTasks):
+            background = executor.defer(background)
 
-    return JSONResponse(status_code=response.status_code, content=content, background=background)
+    media_type = response_media_type.get()
+    if media_type is not None:
+        result = Response(content=ENCODERS[media_type](content), status_code=response.status_code, media_type=media_type, background=background)
+    else:
+        result = JSONResponse(status_code=response.status_code, content=content, background=background)
+    if recorder is not None:
+        recorder.record(content.get('data'), len(result.body), perf_counter_ns() - start, media_type)
+    return result
 
 
-def response_success(message: str = 'Resources was successfully retrieved', data: Any | None = None, background_tasks: Any | None = None) -> JSONResponse:
+def set_serialization_recorder(recorder: 'SerializationRecorder | None') -> None:
+    """
+    Record the time and size of every response built by the response helpers.
+
+    :param recorder: Recorder to use, None to stop recording
+    :type recorder: SerializationRecorder or None
+    """
+    global _serialization_recorder  # noqa: PLW0603
+    _serialization_recorder = recorder
+
+
+def response_success(message: str = 'Resources was successfully retrieved', data: Any | None = None, background_tasks: Any | None = None) -> Response:
     """
     Use this response when a resource is successfully retrieved.
 
@@ -82,7 +141,7 @@ def response_success(message: str = 'Resources was successfully retrieved', data
     return generate_json_response(ResponseModel(status_code=status.HTTP_200_OK, message=message, data=data, background_tasks=background_tasks))
 
 
-def response_pagination(message: str = 'Resources was successfully retrieved', data: Any | None = None, pagination: Page | None = None) -> JSONResponse:
+def response_pagination(message: str = 'Resources was successfully retrieved', data: Any | None = None, pagination: 'Page | None' = None) -> Response:
     """
     Use this response when a resource is successfully retrieved.
 
@@ -102,7 +161,7 @@ def response_pagination(message: str = 'Resources was successfully retrieved', d
     return generate_json_response(ResponsePaginationModel(status_code=status.HTTP_200_OK, message=message, data=data, pagination=page_info))
 
 
-def response_created(message: str = 'Resource was successfully created', data: Any | None = None) -> JSONResponse:
+def response_created(message: str = 'Resource was successfully created', data: Any | None = None) -> Response:
     """
     Use this response when a resource is successfully created.
 
@@ -126,7 +185,7 @@ def response_no_content() -> Response:
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
-def response_bad_request(message: str = 'Bad request', data: Any | None = None) -> JSONResponse:
+def response_bad_request(message: str = 'Bad request', data: Any | None = None) -> Response:
     """
     Use this response when a bad request is made.
 
@@ -140,7 +199,7 @@ def response_bad_request(message: str = 'Bad request', data: Any | None = None)
     return generate_json_response(ResponseModel(status_code=status.HTTP_400_BAD_REQUEST, message=message, data=data))
 
 
-def response_unauthorized(message: str = 'Unauthorized') -> JSONResponse:
+def response_unauthorized(message: str = 'Unauthorized') -> Response:
     """
     Use this response when a request is unauthorized.
 
@@ -152,7 +211,7 @@ def response_unauthorized(message: str = 'Unauthorized') -> JSONResponse:
     return generate_json_response(ResponseModel(status_code=status.HTTP_401_UNAUTHORIZED, message=message))
 
 
-def response_forbidden(message: str = 'Forbidden') -> JSONResponse:
+def response_forbidden(message: str = 'Forbidden') -> Response:
     """
     Use this response when a request is forbidden.
 
@@ -164,7 +223,7 @@ def response_forbidden(message: str = 'Forbidden') -> JSONResponse:
     return generate_json_response(ResponseModel(status_code=403, message=message))
 
 
-def response_not_found(message: str = 'Resource not found') -> JSONResponse:
+def response_not_found(message: str = 'Resource not found') -> Response:
     """
     Use this response when a resource is not found.
 
@@ -176,7 +235,7 @@ def response_not_found(message: str = 'Resource not found') -> JSONResponse:
     return generate_json_response(ResponseModel(status_code=status.HTTP_404_NOT_FOUND, message=message))
 
 
-def response_conflict(message: str = 'Resource already exists') -> JSONResponse:
+def response_conflict(message: str = 'Resource already exists') -> Response:
     """
     Use this response when a resource already exists.
 
@@ -188,7 +247,7 @@ def response_conflict(message: str = 'Resource already exists') -> JSONResponse:
     return generate_json_response(ResponseModel(status_code=status.HTTP_409_CONFLICT, message=message))
 
 
-def response_request_entity_too_large(message: str = 'Request entity too large') -> JSONResponse:
+def response_request_entity_too_large(message: str = 'Request entity too large') -> Response:
     """
     Use this response when a request is too large.
 
@@ -200,7 +259,7 @@ def response_request_entity_too_large(message: str = 'Request entity too large')
     return generate_json_response(ResponseModel(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, message=message))
 
 
-def response_unsupported_media_type(message: str = 'Unsupported media type') -> JSONResponse:
+def response_unsupported_media_type(message: str = 'Unsupported media type') -> Response:
     """
     Use this response when a user has supplied invalid file input. For example, a file that is not a .png
 
@@ -212,7 +271,7 @@ def response_unsupported_media_type(message: str = 'Unsupported media type') ->
     return generate_json_response(ResponseModel(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, message=message))
 
 
-def response_internal_server_error(message: str = 'Internal server error') -> JSONResponse:
+def response_internal_server_error(message: str = 'Internal server error') -> Response:
     """
     Use this response when an internal server error occurs.
 
@@ -224,7 +283,7 @@ def response_internal_server_error(message: str = 'Internal server error') -> JS
     return generate_json_response(ResponseModel(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, message=message))
 
 
-def response_service_unavailable(message: str = 'Service unavailable') -> JSONResponse:
+def response_service_unavailable(message: str = 'Service unavailable') -> Response:
     """
     Use this response when a service is unavailable.
 
@@ -236,7 +295,7 @@ def response_service_unavailable(message: str = 'Service unavailable') -> JSONRe
     return generate_json_response(ResponseModel(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, message=message))
 
 
-def response_not_implemented(message: str = 'Not implemented') -> JSONResponse:
+def response_not_implemented(message: str = 'Not implemented') -> Response:
     """
     Use this response when a request is not implemented.
 
@@ -248,7 +307,7 @@ def response_not_implemented(message: str = 'Not implemented') -> JSONResponse:
     return generate_json_response(ResponseModel(status_code=status.HTTP_501_NOT_IMPLEMENTED, message=message))
 
 
-def response_custom(message: str = 'An unknown error has occurred', status_code: int = 500, data: Any | None = None) -> JSONResponse:
+def response_custom(message: str = 'An unknown error has occurred', status_code: int = 500, data: Any | None = None) -> Response:
     """
     Use this response when a response is needed with a custom message and status code.
 
@@ -262,3 +321,127 @@ def response_custom(message: str = 'An unknown error has occurred', status_code:
     :rtype: Tuple[Dict[str, Any], int]
     """
     return generate_json_response(ResponseModel(status_code=status_code, message=message, data=data))
+
+
+class _ExceptionMapping:
+    """Response helper of an exception type and the bodies rendered for its fixed message"""
+
+    __slots__ = ('bodies', 'expose_message', 'helper', 'message')
+
+    def __init__(self, helper, message: str | None, expose_message: bool):
+        self.helper = helper
+        self.message = message
+        self.expose_message = expose_message
+        # Media type negotiated with the client (None for JSON): body, status code and media type of the response
+        self.bodies = {}
+
+
+class ExceptionResponses:
+    """
+    Registry turning exceptions into responses of the response helpers.
+
+    The mapping of an exception class is looked up along its MRO the first time it is raised and cached, so subclasses of a
+    registered type get its response without an isinstance chain on every error. Responses with a fixed message are
+    rendered once per negotiated media type and their body is reused afterwards.
+
+    The text of an exception may contain internal details, so it is only sent to clients for types registered with
+    expose_message=True. Any other type gets the message given when registering it or the default of the helper.
+    """
+
+    def __init__(self):
+        """Create an empty registry"""
+        self._mappings = {}
+        self._dispatch = {}
+
+    def register(
+        self, exc_type: type[BaseException], helper=None, status_code: int | None = None, message: str | None = None, expose_message: bool = False
+    ) -> None:
+        """
+        Respond to an exception type, and its subclasses, with a response helper or a status code.
+
+        :param exc_type: Exception type
+        :type exc_type: type
+        :param helper: Response helper taking the message, like response_not_found
+        :param status_code: Status code of a response_custom() response, instead of a helper
+        :type status_code: int or None
+        :param message: Message of every response, defaults to the default of the helper
+        :type message: str or None
+        :param expose_message: Send the string of the exception as the message, defaults to False
+        :type expose_message: bool
+        :raises ValueError: If neither or both of helper and status_code are given
+        :raises TypeError: If the helper does not take a message, like response_no_content
+        """
+        if (helper is None) == (status_code is None):
+            raise ValueError('Pass either helper or status_code')
+        if helper is None:
+            helper = partial(response_custom, status_code=status_code)
+        try:
+            signature = inspect.signature(helper)
+            signature.bind('message')
+            if message is None:
+                signature.bind()
+        except TypeError as e:
+            raise TypeError(f'{getattr(helper, "__name__", helper)!r} cannot be called with a message: {e}') from None
+        except ValueError:
+            # Callables without a signature, like some builtins, are only checked when called
+            pass
+        self._mappings[exc_type] = _ExceptionMapping(helper, message, expose_message)
+        self._dispatch.clear()
+
+    def _lookup(self, exc_type: type) -> _ExceptionMapping | None:
+        """Find the mapping of the closest registered base class"""
+        try:
+            return self._dispatch[exc_type]
+        except KeyError:
+            mapping = next((self._mappings[cls] for cls in exc_type.__mro__ if cls in self._mappings), None)
+            self._dispatch[exc_type] = mapping
+            return mapping
+
+    def response_for(self, exc: BaseException) -> Response | None:
+        """
+        Get the response for an exception.
+
+        :param exc: Exception to respond to
+        :type exc: BaseException
+        :return: Response, None when the type of the exception is not registered
+        :rtype: Response or None
+        """
+        mapping = self._lookup(type(exc))
+        if mapping is None:
+            return None
+        if mapping.expose_message:
+            message = str(exc) or mapping.message
+            return mapping.helper(message) if message else mapping.helper()
+
+        negotiated = response_media_type.get()
+        cached = mapping.bodies.get(negotiated)
+        if cached is None:
+            response = mapping.helper(mapping.message) if mapping.message is not None else mapping.helper()
+            mapping.bodies[negotiated] = (response.body, response.status_code, response.media_type)
+            return response
+        body, status_code, media_type = cached
+        return Response(content=body, status_code=status_code, media_type=media_type)
+
+    async def handle(self, request, exc: BaseException) -> Response:
+        """
+        Exception handler for Starlette and FastAPI, a coroutine so it is not run in the thread pool.
+
+        :param request: Request that raised the exception
+        :param exc: Exception raised
+        :type exc: BaseException
+        :return: Response
+        :rtype: Response
+        """
+        response = self.response_for(exc)
+        if response is None:
+            raise exc
+        return response
+
+    def install(self, app) -> None:
+        """
+        Add the handler to an app for every registered exception type, register them all before.
+
+        :param app: FastAPI or Starlette app
+        """
+        for exc_type in self._mappings:
+            app.add_exception_handler(exc_type, self.handle)
@@ -0,0 +1,188 @@
+"""Instrumentation of the time and size of response bodies built by the response helpers"""
+
+import logging
+import threading
+
+from tunsberg.middleware import request_context
+
+SERIALIZATION_LOGGER = 'tunsberg.serialization'
+UNKNOWN_ROUTE = '<unknown>'
+OVERFLOW_ROUTE = '<overflow>'
+# A tuple, isinstance() is several times slower with a union of types
+_CONTAINERS = (dict, list)
+
+
+def data_shape(data, depth: int = 0) -> tuple[int, int]:
+    """
+    Estimate the shape of response data without walking all of it.
+
+    Only the first item of every list is followed, so the cost depends on the nesting of the data and the number of keys
+    of its dictionaries, not on the number of items.
+
+    :param data: Data of a response
+    :param depth: Depth of data itself, used when recursing
+    :type depth: int
+    :return: Number of items of the largest list seen and the nesting depth
+    :rtype: tuple[int, int]
+    """
+    if isinstance(data, dict):
+        items, deepest = 0, depth + 1
+        for value in data.values():
+            if isinstance(value, _CONTAINERS):
+                child_items, child_depth = data_shape(value, depth + 1)
+                items = max(items, child_items)
+                deepest = max(deepest, child_depth)
+        return items, deepest
+    if isinstance(data, list):
+        if not data:
+            return 0, depth + 1
+        items, deepest = data_shape(data[0], depth + 1)
+        return max(len(data), items), max(deepest, depth + 1)
+    return 0, depth
+
+
+class SerializationRecorder:
+    """
+    Record how long the response helpers take to build a body, how large it is and the shape of its data, per route.
+
+    Pass a recorder to responses.set_serialization_recorder() to enable it. Every call is aggregated per route template,
+    taken from the request context of AccessLogMiddleware, for at most max_routes routes, anything beyond that is added
+    to a single '<overflow>' route. Without AccessLogMiddleware there is no request context and every call is recorded
+    as '<unknown>', which is logged once as a warning. Calls slower than slow_threshold_ms or larger than large_bytes
+    are logged on the 'tunsberg.serialization' logger, and every call is passed to callback if one is given.
+    """
+
+    def __init__(
+        self,
+        slow_threshold_ms: float | None = None,
+        large_bytes: int | None = None,
+        callback=None,
+        max_routes: int = 256,
+        logger_name: str = SERIALIZATION_LOGGER,
+    ):
+        """
+        Create a recorder.
+
+        :param slow_threshold_ms: Log calls taking at least this many milliseconds, defaults to None to not log any
+        :type slow_threshold_ms: float or None
+        :param large_bytes: Log calls producing a body of at least this many bytes, defaults to None to not log any
+        :type large_bytes: int or None
+        :param callback: Function called with the fields of every call, defaults to None
+        :param max_routes: Number of routes aggregated separately, defaults to 256
+        :type max_routes: int
+        :param logger_name: Logger slow and large calls are logged on, defaults to 'tunsberg.serialization'
+        :type logger_name: str
+        """
+        self.slow_threshold_ms = slow_threshold_ms
+        self.large_bytes = large_bytes
+        self.callback = callback
+        self.max_routes = max_routes
+        self.logger = logging.getLogger(logger_name)
+        self._lock = threading.Lock()
+        self._warned_no_context = False
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all recorded calls"""
+        with self._lock:
+            # Route: calls, total and max nanoseconds, total and max bytes, max items, max depth
+            self._routes = {}
+
+    def record(self, data, nbytes: int, duration_ns: int, media_type: str | None = None) -> None:
+        """
+        Record one call of a response helper.
+
+        :param data: Data of the response
+        :param nbytes: Size of the body in bytes
+        :type nbytes: int
+        :param duration_ns: Time taken to build the response in nanoseconds
+        :type duration_ns: int
+        :param media_type: Media type negotiated with the client, defaults to None for JSON
+        :type media_type: str or None
+        """
+        context = request_context.get()
+        if context is not None:
+            route = getattr(context.scope.get('route'), 'path', UNKNOWN_ROUTE)
+        else:
+            route = UNKNOWN_ROUTE
+            if not self._warned_no_context:
+                self._warned_no_context = True
+                self.logger.warning('Serialization recorded without a request context, add AccessLogMiddleware to record the route')
+        items, depth = data_shape(data)
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                if len(self._routes) >= self.max_routes:
+                    route = OVERFLOW_ROUTE
+                stats = self._routes.setdefault(route, [0, 0, 0, 0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += duration_ns
+            stats[3] += nbytes
+            stats[2] = max(stats[2], duration_ns)
+            stats[4] = max(stats[4], nbytes)
+            stats[5] = max(stats[5], items)
+            stats[6] = max(stats[6], depth)
+
+        duration_ms = duration_ns / 1e6
+        slow = self.slow_threshold_ms is not None and duration_ms >= self.slow_threshold_ms
+        large = self.large_bytes is not None and nbytes >= self.large_bytes
+        if self.callback is None and not slow and not large:
+            return
+        fields = {
+            'route': route,
+            'media_type': media_type or 'application/json',
+            'encode_ms': round(duration_ms, 3),
+            'bytes': nbytes,
+            'items': items,
+            'depth': depth,
+        }
+        if self.callback is not None:
+            self.callback(fields)
+        if slow or large:
+            self.logger.warning(
+                'Serialized %s bytes for %s in %.2fms', nbytes, route, duration_ms, extra={'extra_fields': {**fields, 'slow': slow, 'large': large}}
+            )
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Get the calls recorded for every route.
+
+        :return: Route: calls, total and max encode time in milliseconds, total and max bytes, max items and max depth
+        :rtype: dict
+        """
+        with self._lock:
+            routes = {route: list(stats) for route, stats in self._routes.items()}
+        return {
+            route: {
+                'calls': calls,
+                'encode_ms_total': round(total_ns / 1e6, 3),
+                'encode_ms_max': round(max_ns / 1e6, 3),
+                'bytes_total': total_bytes,
+                'bytes_max': max_bytes,
+                'items_max': items,
+                'depth_max': depth,
+            }
+            for route, (calls, total_ns, max_ns, total_bytes, max_bytes, items, depth) in routes.items()
+        }
+
+    def log_summary(self, level: int = logging.INFO) -> dict[str, dict]:
+        """
+        Log the summary of every route, slowest first, e.g. periodically or when the app stops.
+
+        :param level: Log level, defaults to logging.INFO
+        :type level: int
+        :return: Summary that was logged
+        :rtype: dict
+        """
+        summary = self.summary()
+        for route, fields in sorted(summary.items(), key=lambda item: item[1]['encode_ms_total'], reverse=True):
+            self.logger.log(
+                level,
+                'Serialization of %s: %s calls, %.2fms total, %s bytes total',
+                route,
+                fields['calls'],
+                fields['encode_ms_total'],
+                fields['bytes_total'],
+                extra={'extra_fields': {'route': route, **fields}},
+            )
+        return summary
@@ -1,23 +1,490 @@
 """Common utilities for the package"""
 
+import mmap
+import os
 import re
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
+from operator import attrgetter
 
+# Semantic Versioning 2.0.0, https://semver.org/#is-there-a-suggested-regular-expression-regex-to-check-a-semver-string
+_NUMBER = r'0|[1-9]\d*'
+_PRERELEASE_IDENTIFIER = r'(?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*)'
+_SEMVER = re.compile(
+    rf'(?P<major>{_NUMBER})\.(?P<minor>{_NUMBER})\.(?P<patch>{_NUMBER})'
+    rf'(?:-(?P<prerelease>{_PRERELEASE_IDENTIFIER}(?:\.{_PRERELEASE_IDENTIFIER})*))?'
+    r'(?:\+(?P<build>[0-9a-zA-Z-]+(?:\.[0-9a-zA-Z-]+)*))?',
+    re.ASCII,
+)
+# Versions in constraints may leave out the minor and patch numbers
+_PARTIAL = re.compile(
+    rf'(?P<major>{_NUMBER})(?:\.(?P<minor>{_NUMBER})(?:\.(?P<patch>{_NUMBER})'
+    rf'(?:-(?P<prerelease>{_PRERELEASE_IDENTIFIER}(?:\.{_PRERELEASE_IDENTIFIER})*))?)?)?',
+    re.ASCII,
+)
+_CLAUSE = re.compile(r'\s*(?P<operator>==|!=|>=|<=|=|>|<|~|\^)?\s*v?(?P<version>\S+)\s*')
+# Tags format_version_tag accepted before it used the semantic version pattern, PEP 440 allows leading zeros
+_LEGACY_TAG_PATTERN = re.compile(r'\d+\.\d+\.\d+')
+# Last element of the sort key of releases, pre-releases start with 0 so they sort before the release
+_RELEASE = (1,)
 
-def format_version_tag(name: str) -> str:
+
+def _prerelease_key(prerelease: tuple[str, ...]) -> tuple:
+    """Sort key of pre-release identifiers, numeric identifiers sort numerically and before alphanumeric ones"""
+    return tuple((0, int(identifier), '') if identifier.isdigit() else (1, 0, identifier) for identifier in prerelease)
+
+
+class Version:
+    """
+    Semantic version, see https://semver.org.
+
+    Versions are immutable, hashable and ordered by precedence: a pre-release sorts before the release it leads up to,
+    and build metadata is ignored when ordering. Two versions that only differ in build metadata are not equal, but
+    neither sorts before the other.
+    """
+
+    __slots__ = ('_key', 'build', 'major', 'minor', 'patch', 'prerelease')
+
+    def __init__(self, major: int, minor: int, patch: int, prerelease: tuple[str, ...] = (), build: tuple[str, ...] = ()):
+        """
+        Create a version.
+
+        :param major: Major version
+        :type major: int
+        :param minor: Minor version
+        :type minor: int
+        :param patch: Patch version
+        :type patch: int
+        :param prerelease: Pre-release identifiers, e.g. ('rc', '1')
+        :type prerelease: tuple[str, ...]
+        :param build: Build metadata identifiers
+        :type build: tuple[str, ...]
+        """
+        object.__setattr__(self, 'major', major)
+        object.__setattr__(self, 'minor', minor)
+        object.__setattr__(self, 'patch', patch)
+        object.__setattr__(self, 'prerelease', tuple(prerelease))
+        object.__setattr__(self, 'build', tuple(build))
+        # Releases get (1,) and pre-releases (0, identifiers...) so a release sorts after all of its pre-releases
+        object.__setattr__(self, '_key', (major, minor, patch, (0, *_prerelease_key(prerelease)) if prerelease else _RELEASE))
+
+    @classmethod
+    def parse(cls, text: str) -> 'Version':
+        """
+        Parse a version.
+
+        :param text: Version, e.g. '1.2.3-rc.1+build.5'
+        :type text: str
+        :return: Parsed version
+        :rtype: Version
+        :raises ValueError: If the text is not a valid semantic version
+        """
+        return _parse(text)
+
+    @property
+    def sort_key(self) -> tuple:
+        """Key that orders versions by precedence, useful to sort other objects by their version"""
+        return self._key
+
+    @property
+    def is_prerelease(self) -> bool:
+        """Whether the version has pre-release identifiers"""
+        return bool(self.prerelease)
+
+    def __setattr__(self, name, value):
+        """Versions are immutable"""
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        """Copy and pickle through the constructor, attributes cannot be set on an existing version"""
+        return type(self), (self.major, self.minor, self.patch, self.prerelease, self.build)
+
+    def __str__(self) -> str:
+        """Format the version the way it is parsed"""
+        text = f'{self.major}.{self.minor}.{self.patch}'
+        if self.prerelease:
+            text += '-' + '.'.join(self.prerelease)
+        if self.build:
+            text += '+' + '.'.join(self.build)
+        return text
+
+    def __repr__(self) -> str:
+        """Show the version"""
+        return f'{type(self).__name__}({str(self)!r})'
+
+    def __eq__(self, other) -> bool:
+        """Versions are equal when every part, build metadata included, is equal"""
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key == other._key and self.build == other.build
+
+    def __hash__(self) -> int:
+        """Hash of every part of the version"""
+        return hash((self._key, self.build))
+
+    def __lt__(self, other) -> bool:
+        """Compare precedence"""
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key < other._key
+
+    def __le__(self, other) -> bool:
+        """Compare precedence"""
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key <= other._key
+
+    def __gt__(self, other) -> bool:
+        """Compare precedence"""
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key > other._key
+
+    def __ge__(self, other) -> bool:
+        """Compare precedence"""
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key >= other._key
+
+
+def _key_from_match(match: re.Match) -> tuple:
+    """Sort key of a match of the semantic version pattern, the same as Version.sort_key"""
+    prerelease = match['prerelease']
+    return (
+        int(match['major']),
+        int(match['minor']),
+        int(match['patch']),
+        (0, *_prerelease_key(prerelease.split('.'))) if prerelease else _RELEASE,
+    )
+
+
+def _from_match(match: re.Match) -> Version:
+    """Create a version from a match of the semantic version pattern"""
+    prerelease = match['prerelease']
+    build = match['build']
+    return Version(
+        int(match['major']),
+        int(match['minor']),
+        int(match['patch']),
+        tuple(prerelease.split('.')) if prerelease else (),
+        tuple(build.split('.')) if build else (),
+    )
+
+
+@lru_cache(maxsize=4096)
+def _parse(text: str) -> Version:
+    """Parse a version, cached because the same tags are parsed over and over by release tooling"""
+    match = _SEMVER.fullmatch(text)
+    if match is None:
+        raise ValueError(f'Invalid version: {text}')
+    return _from_match(match)
+
+
+_SORT_KEY = attrgetter('_key')
+
+
+def parse_versions(tags: Iterable[str], prefix: str = '') -> tuple[list[Version], list[str]]:
+    """
+    Validate a list of tags and sort the valid ones in a single pass.
+
+    :param tags: Tag names
+    :type tags: Iterable[str]
+    :param prefix: Prefix every version tag starts with, e.g. 'v', defaults to ''
+    :type prefix: str
+    :return: Valid versions sorted from lowest to highest precedence, and the tags that are not valid versions
+    :rtype: tuple[list[Version], list[str]]
+    """
+    fullmatch = _SEMVER.fullmatch
+    start = len(prefix)
+    versions = []
+    invalid = []
+    for tag in tags:
+        match = fullmatch(tag, start) if tag.startswith(prefix) else None
+        if match is None:
+            invalid.append(tag)
+        else:
+            versions.append(_from_match(match))
+    versions.sort(key=_SORT_KEY)
+    return versions, invalid
+
+
+def sort_versions(tags: Iterable[str], prefix: str = '', reverse: bool = False) -> list[Version]:
+    """
+    Sort tags by version precedence, leaving out tags that are not valid versions.
+
+    :param tags: Tag names
+    :type tags: Iterable[str]
+    :param prefix: Prefix every version tag starts with, e.g. 'v', defaults to ''
+    :type prefix: str
+    :param reverse: Sort from highest to lowest precedence, defaults to False
+    :type reverse: bool
+    :return: Sorted versions
+    :rtype: list[Version]
+    """
+    versions, _ = parse_versions(tags, prefix)
+    if reverse:
+        versions.reverse()
+    return versions
+
+
+class VersionConstraint:
+    """
+    Comma separated version requirements that must all be met, e.g. '>=1.2,<2'.
+
+    Supported operators are ==, =, !=, >, >=, <, <=, ~ and ^. A version without an operator must match exactly.
+    Missing minor and patch numbers count as 0, except for == and = where '1.2' matches any 1.2.x release, and for ~ and
+    ^ which follow npm: '~1.2.3' allows patch releases, '^1.2.3' allows everything up to the next major version, or
+    the next minor version below 1.0.0. Pre-releases only match when a requirement names a pre-release itself or
+    include_prerelease is set.
+    """
+
+    __slots__ = ('_checks', 'include_prerelease', 'text')
+
+    def __init__(self, text: str, include_prerelease: bool = False):
+        """
+        Parse a constraint.
+
+        :param text: Constraint, e.g. '>=1.2,<2'
+        :type text: str
+        :param include_prerelease: Whether pre-releases can match, defaults to False
+        :type include_prerelease: bool
+        :raises ValueError: If the constraint cannot be parsed
+        """
+        self.text = text
+        self.include_prerelease = include_prerelease
+        self._checks = []
+        for clause in text.split(','):
+            if not clause.strip() or clause.strip() == '*':
+                continue
+            match = _CLAUSE.fullmatch(clause)
+            partial = _PARTIAL.fullmatch(match['version']) if match else None
+            if partial is None:
+                raise ValueError(f'Invalid version constraint: {text}')
+            self._checks.extend(_clause_checks(match['operator'] or '=', partial))
+            if partial['prerelease']:
+                self.include_prerelease = True
+
+    def __repr__(self) -> str:
+        """Show the constraint"""
+        return f'{type(self).__name__}({self.text!r})'
+
+    def __contains__(self, version: Version) -> bool:
+        """Whether a version meets the constraint"""
+        return self.matches(version)
+
+    def matches(self, version: Version) -> bool:
+        """
+        Check whether a version meets every requirement.
+
+        :param version: Version to check
+        :type version: Version
+        :return: True if the version meets the constraint
+        :rtype: bool
+        """
+        return self._matches_key(version.sort_key)
+
+    def _matches_key(self, key: tuple) -> bool:
+        """Check the sort key of a version, pre-releases are the keys not ending in (1,)"""
+        if not self.include_prerelease and key[3] != _RELEASE:
+            return False
+        return all(check(key) for check in self._checks)
+
+
+def _clause_checks(operator: str, partial: re.Match) -> list:
+    """Turn a single requirement into functions that check the sort key of a version"""
+    major = int(partial['major'])
+    minor = int(partial['minor'] or 0)
+    patch = int(partial['patch'] or 0)
+    prerelease = tuple(partial['prerelease'].split('.')) if partial['prerelease'] else ()
+    lower = Version(major, minor, patch, prerelease).sort_key
+
+    if operator in {'=', '=='} and partial['patch'] is None:
+        # '1' or '1.2' match every version that starts with them
+        operator = '~' if partial['minor'] is not None else '^'
+    if operator == '~':
+        upper = (major, minor + 1, 0, (0,)) if partial['minor'] is not None else (major + 1, 0, 0, (0,))
+        return [lambda key: key >= lower, lambda key: key < upper]
+    if operator == '^':
+        if major or partial['minor'] is None:
+            upper = (major + 1, 0, 0, (0,))
+        elif minor or partial['patch'] is None:
+            upper = (0, minor + 1, 0, (0,))
+        else:
+            upper = (0, 0, patch + 1, (0,))
+        return [lambda key: key >= lower, lambda key: key < upper]
+    # (0,) sorts before every pre-release key of the same numbers, so '<2' also rules out 2.0.0-rc.1
+    checks = {
+        '=': lambda key: key == lower,
+        '==': lambda key: key == lower,
+        '!=': lambda key: key != lower,
+        '>': lambda key: key > lower,
+        '>=': lambda key: key >= lower,
+        '<': lambda key: key < (lower if prerelease else (major, minor, patch, (0,))),
+        '<=': lambda key: key <= lower,
+    }
+    return [checks[operator]]
+
+
+def max_satisfying(versions: Iterable[Version | str], constraint: VersionConstraint | str, prefix: str = '') -> Version | None:
+    """
+    Pick the highest version that meets a constraint.
+
+    :param versions: Versions, or tag names which are skipped when they are not valid versions
+    :type versions: Iterable[Version | str]
+    :param constraint: Constraint, e.g. '>=1.2,<2'
+    :type constraint: VersionConstraint or str
+    :param prefix: Prefix every version tag starts with, e.g. 'v', defaults to ''
+    :type prefix: str
+    :return: Highest matching version, None if no version matches
+    :rtype: Version or None
+    """
+    if isinstance(constraint, str):
+        constraint = VersionConstraint(constraint)
+    fullmatch = _SEMVER.fullmatch
+    start = len(prefix)
+    best = best_key = None
+    for version in versions:
+        if isinstance(version, str):
+            match = fullmatch(version, start) if version.startswith(prefix) else None
+            if match is None:
+                continue
+            # Only sort keys are compared, a Version is created for the winner alone
+            key = _key_from_match(match)
+        else:
+            match = version
+            key = version.sort_key
+        if (best_key is None or key > best_key) and constraint._matches_key(key):
+            best, best_key = match, key
+    if isinstance(best, re.Match):
+        return _from_match(best)
+    return best
+
+
+def _git_dir(path: str) -> str:
+    """Find the directory holding the refs of a repository, a work tree or a .git directory"""
+    git_dir = os.path.join(path, '.git')
+    if os.path.isfile(git_dir):
+        # Linked work trees and submodules have a .git file pointing at the real directory
+        with open(git_dir, encoding='utf-8') as f:
+            content = f.read().strip()
+        if not content.startswith('gitdir:'):
+            raise ValueError(f'Not a git repository: {path}')
+        git_dir = os.path.join(path, content.removeprefix('gitdir:').strip())
+    elif not os.path.isdir(git_dir):
+        git_dir = path
+    if not os.path.isdir(os.path.join(git_dir, 'refs')) and not os.path.isfile(os.path.join(git_dir, 'commondir')):
+        raise ValueError(f'Not a git repository: {path}')
+    # Tags of linked work trees live in the main repository
+    commondir = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir):
+        with open(commondir, encoding='utf-8') as f:
+            git_dir = os.path.join(git_dir, f.read().strip())
+    return os.path.normpath(git_dir)
+
+
+def _loose_tags(directory: str, prefix: str = '') -> Iterator[str]:
+    """Walk refs/tags, tags containing slashes are stored in subdirectories"""
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _loose_tags(entry.path, f'{prefix}{entry.name}/')
+        else:
+            yield prefix + entry.name
+
+
+def _packed_tags(path: str) -> Iterator[str]:
+    """Read the tags from packed-refs without loading the whole file"""
+    try:
+        f = open(path, 'rb')  # noqa: SIM115
+    except FileNotFoundError:
+        return
+    with f:
+        try:
+            packed = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped
+            return
+        with packed:
+            marker = b' refs/tags/'
+            position = packed.find(marker)
+            while position != -1:
+                start = position + len(marker)
+                end = packed.find(b'\n', start)
+                if end == -1:
+                    end = len(packed)
+                yield packed[start:end].rstrip(b'\r').decode('utf-8', errors='replace')
+                position = packed.find(marker, end)
+
+
+def iter_git_tags(path: str = '.') -> Iterator[str]:
+    """
+    List the tags of a git repository without running git.
+
+    Loose tags are read from refs/tags and packed tags from packed-refs, which is memory-mapped and scanned for tag
+    entries only. Tags are streamed as they are found, in no particular order, and every tag is listed once.
+
+    :param path: Work tree or .git directory, defaults to the current directory
+    :type path: str
+    :return: Tag names, e.g. 'v1.2.3'
+    :rtype: Iterator[str]
+    :raises ValueError: If path is not a git repository
+    """
+    git_dir = _git_dir(path)
+    loose = set()
+    for tag in _loose_tags(os.path.join(git_dir, 'refs', 'tags')):
+        loose.add(tag)
+        yield tag
+    for tag in _packed_tags(os.path.join(git_dir, 'packed-refs')):
+        if tag not in loose:
+            yield tag
+
+
+def latest_git_tag(path: str = '.', prefix: str = '', constraint: VersionConstraint | str | None = None, include_prerelease: bool = False) -> Version | None:
+    """
+    Get the highest version tagged in a git repository without running git.
+
+    :param path: Work tree or .git directory, defaults to the current directory
+    :type path: str
+    :param prefix: Prefix every version tag starts with, e.g. 'v', defaults to ''
+    :type prefix: str
+    :param constraint: Constraint the version must meet, e.g. '<2', defaults to None
+    :type constraint: VersionConstraint or str or None
+    :param include_prerelease: Whether pre-releases count, defaults to False
+    :type include_prerelease: bool
+    :return: Highest version, None if no tag is a valid version
+    :rtype: Version or None
+    :raises ValueError: If path is not a git repository
+    """
+    if not isinstance(constraint, VersionConstraint):
+        constraint = VersionConstraint(constraint or '*', include_prerelease=include_prerelease)
+    return max_satisfying(iter_git_tags(path), constraint, prefix)
+
+
+@lru_cache(maxsize=1024)
+def format_version_tag(name: str, strict: bool = False) -> str:
     """
     Format version tag that is used by setuptools-git-versioning
 
+    Accepts semantic release versions without pre-release or build metadata. Unless strict, numbers with leading zeros
+    such as 01.2.3 or 2024.01.5 are accepted too, as they were before and as PEP 440 allows them, even though
+    Version.parse and parse_versions reject them.
+
     :param name:
     :type name: str
+    :param strict: Whether to reject numbers with leading zeros, defaults to False
+    :type strict: bool
     :return: Correctly formatted tag name
     :rtype: str
     :raises ValueError: If tag name is not formatted correctly
     """
-    pattern = re.compile(r'^\d+\.\d+\.\d+$')
-    match = pattern.search(name)
-
-    # Check if the tag name is formatted correctly
-    if match:
+    # Check if the tag name is a release version, fullmatch() also rejects a trailing newline
+    match = _SEMVER.fullmatch(name)
+    if match is not None and match['prerelease'] is None and match['build'] is None:
+        return name
+    if not strict and _LEGACY_TAG_PATTERN.fullmatch(name):
         return name
 
     # If the tag name is not formatted correctly, raise an error